@@ -8,6 +8,7 @@ st.set_page_config(
     layout="wide"
 )
 
+import re
 import json
 import tempfile
 from PIL import Image
@@ -18,15 +19,29 @@ from utils.story_generator import StoryGenerator
 from utils.image_generator import ImageGenerator
 from utils.audio_generator import AudioGenerator
 from utils.video_generator import VideoGenerator
+from utils.job_runner import get_job_runner, ACTIVE_STATUSES, DONE, FAILED
+from utils.governor import governor
 from utils.db_utils import db_manager
 from utils.telegram_utils import telegram_manager
 import pandas as pd
 import traceback
 
+# Khoảng thời gian (giây) giữa hai lần cập nhật trạng thái job chạy nền
+JOB_POLL_SECONDS = 2
+
+# ID phiên hợp lệ: uuid4 dạng hex (không đoán được, không chứa ký tự đường dẫn)
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
 # Hàm tạo thư mục output với ID phiên
 def create_session_directory():
     if 'session_id' not in st.session_state:
-        st.session_state.session_id = str(int(time.time()))
+        # Lấy lại ID phiên từ URL để khi tải lại trang vẫn gắn được vào job đang chạy;
+        # giá trị không hợp lệ bị bỏ qua vì ID phiên được dùng làm tên thư mục output
+        session_id = st.query_params.get("session", "")
+        if not SESSION_ID_PATTERN.match(session_id):
+            session_id = uuid.uuid4().hex
+        st.session_state.session_id = session_id
+    st.query_params["session"] = st.session_state.session_id
     
     session_dir = os.path.join(DEFAULT_CONFIG['output_dir'], st.session_state.session_id)
     os.makedirs(session_dir, exist_ok=True)
@@ -247,7 +262,76 @@ def update_log(log_placeholder, message):
     # Hiển thị tất cả các log
     log_placeholder.code("\n".join(st.session_state.log_messages))
 
+# Hàm chạy và theo dõi job chạy nền
+def submit_job(kind, params, tag):
+    """Gửi job chạy trong process riêng, gắn với phiên làm việc và vị trí tag trên UI"""
+    get_job_runner().submit(kind, params, session_id=st.session_state.session_id, tag=tag)
+    st.rerun()
+
+def display_queue_status():
+    """Hiển thị vị trí của phiên trong hàng đợi slot dùng chung (job, encode, tạo ảnh, TTS)"""
+    labels = {"job": "chạy job", "encode": "encode video", "image": "tạo ảnh", "tts": "tạo audio"}
+    try:
+        queue_status = governor.queue_status(st.session_state.session_id)
+    except Exception as e:
+        st.caption(f"Không đọc được hàng đợi tài nguyên: {e}")
+        return
+    
+    for resource, info in queue_status.items():
+        if info["position"]:
+            st.caption(f"Đang chờ slot {labels.get(resource, resource)}: vị trí {info['position']}/{info['waiting']} "
+                       f"({info['held']}/{info['slots']} slot đang được dùng)")
+
+def display_job(tag, on_result=None):
+    """Hiển thị trạng thái, tiến độ và log của job mới nhất tại vị trí tag trong phiên
+    
+    on_result: hàm nhận kết quả job, được gọi một lần khi job xong (để lưu vào session_state)
+    
+    Returns:
+        dict: kết quả của job đã xong, None nếu chưa có job hoặc job chưa xong
+    """
+    runner = get_job_runner()
+    job = runner.latest(st.session_state.session_id, tag)
+    if not job:
+        return None
+    
+    status_text = {
+        "queued": "⏳ Đang chờ chạy",
+        "running": "⚙️ Đang chạy",
+        "done": "🎉 Hoàn thành",
+        "failed": "❌ Lỗi"
+    }.get(job["status"], job["status"])
+    message = job.get("message") or ""
+    st.progress(int(job["progress"] * 100), text=f"{status_text} {message}".strip())
+    
+    with st.expander("Xem log tiến trình", expanded=False):
+        st.code("\n".join(runner.logs(job["id"])) or "Chưa có log")
+    
+    if job["status"] in ACTIVE_STATUSES:
+        st.info("Job đang chạy nền, bạn có thể tải lại trang hoặc đóng trình duyệt mà không mất tiến trình.")
+        display_queue_status()
+        if st.button("Hủy job", key=f"cancel_job_{tag}"):
+            runner.cancel(job["id"])
+            st.rerun()
+        # Tự cập nhật lại trang ở cuối main()
+        st.session_state.jobs_running = True
+        return None
+    
+    if job["status"] == FAILED:
+        st.error(f"Lỗi: {job.get('error')}")
+        return None
+    
+    # Chỉ nạp kết quả vào session_state một lần cho mỗi job
+    applied_jobs = st.session_state.setdefault("applied_jobs", set())
+    if job["status"] == DONE and job["id"] not in applied_jobs:
+        applied_jobs.add(job["id"])
+        if on_result:
+            on_result(job["result"])
+    return job["result"] if job["status"] == DONE else None
+
 def main():
+    # Nhiều phiên dùng chung máy chủ: giới hạn slot job/encode/ảnh/TTS
+    governor.enable_for_server()
     st.title("🎬 Tạo Tự Động Truyện và Video từ Ý Tưởng")
     st.markdown("""
     Ứng dụng này giúp bạn tạo tự động nội dung truyện và video từ ý tưởng của bạn. 
@@ -397,41 +481,33 @@ def main():
                         default=[1]
                     )
             
-            # Nút tạo hình ảnh
+            # Nút tạo hình ảnh: tạo trong process riêng để không khóa phiên làm việc
             if st.button("Tạo hình ảnh minh họa"):
-                try:
-                    with st.spinner(f"Đang tạo hình ảnh minh họa với model {settings['image_model']}..."):
-                        # Khởi tạo ImageGenerator với tùy chọn nâng cao
-                        image_generator = ImageGenerator(model_type=settings["image_model"])
-                        
-                        # Giới hạn số chương nếu cần
-                        if sample_chapters and selected_chapters:
-                            filtered_story_data = {
-                                "concept": st.session_state.story_data["concept"],
-                                "num_chapters": len(selected_chapters),
-                                "chapters": [
-                                    chapter for chapter in st.session_state.story_data["chapters"] 
-                                    if chapter["chapter_num"] in selected_chapters
-                                ]
-                            }
-                            story_data_to_process = filtered_story_data
-                        else:
-                            story_data_to_process = st.session_state.story_data
-                        
-                        # Xử lý tạo hình ảnh
-                        story_images = image_generator.process_story(
-                            story_data_to_process, 
-                            output_dir=settings["output_dir"]
-                        )
-                        
-                        # Lưu story_images vào session_state
-                        st.session_state.story_images = story_images
-                        st.success("Đã tạo xong hình ảnh minh họa!")
-                except MemoryError:
-                    st.error("Lỗi: Không đủ bộ nhớ để xử lý. Hãy thử giảm số chương hoặc chọn phương pháp 'Chỉ tạo hình ảnh cho một số chương mẫu'.")
-                except Exception as e:
-                    st.error(f"Lỗi khi tạo hình ảnh: {str(e)}")
-                    st.info("Hãy thử lại với ít chương hơn hoặc giảm kích thước nội dung.")
+                # Giới hạn số chương nếu cần
+                if sample_chapters and selected_chapters:
+                    story_data_to_process = {
+                        "concept": st.session_state.story_data["concept"],
+                        "num_chapters": len(selected_chapters),
+                        "chapters": [
+                            chapter for chapter in st.session_state.story_data["chapters"] 
+                            if chapter["chapter_num"] in selected_chapters
+                        ]
+                    }
+                else:
+                    story_data_to_process = st.session_state.story_data
+                
+                submit_job("images", {
+                    "story_data": story_data_to_process,
+                    "output_dir": settings["output_dir"],
+                    "model_type": settings["image_model"]
+                }, tag="images")
+            
+            def on_images_result(result):
+                # Lưu story_images vào session_state
+                st.session_state.story_images = result["story_images"]
+            
+            if display_job("images", on_images_result):
+                st.success("Đã tạo xong hình ảnh minh họa!")
             
             # Hiển thị hình ảnh nếu đã tạo
             if 'story_images' in st.session_state:
@@ -456,18 +532,20 @@ def main():
         else:
             settings = st.session_state.story_config
             
-            # Nút tạo audio
+            # Nút tạo audio: tạo trong process riêng để không khóa phiên làm việc
             if st.button("Tạo audio từ text"):
-                with st.spinner(f"Đang tạo audio với provider {settings['tts_provider']}..."):
-                    audio_generator = AudioGenerator(provider=settings["tts_provider"])
-                    story_audio = audio_generator.process_story(
-                        st.session_state.story_data, 
-                        output_dir=settings["output_dir"]
-                    )
-                    
-                    # Lưu story_audio vào session_state
-                    st.session_state.story_audio = story_audio
-                    st.success("Đã tạo xong audio!")
+                submit_job("audio", {
+                    "story_data": st.session_state.story_data,
+                    "output_dir": settings["output_dir"],
+                    "provider": settings["tts_provider"]
+                }, tag="audio")
+            
+            def on_audio_result(result):
+                # Lưu story_audio vào session_state
+                st.session_state.story_audio = result["story_audio"]
+            
+            if display_job("audio", on_audio_result):
+                st.success("Đã tạo xong audio!")
             
             # Hiển thị audio nếu đã tạo
             if 'story_audio' in st.session_state:
@@ -506,24 +584,28 @@ def main():
                 
                 fps = st.slider("Frames per second (FPS)", min_value=15, max_value=60, value=30, step=1)
             
-            # Nút tạo video
+            # Nút tạo video: render trong process riêng để không khóa phiên làm việc
             if st.button("Tạo video"):
-                with st.spinner("Đang tạo video... Quá trình này có thể mất nhiều thời gian..."):
-                    video_generator = VideoGenerator(width=width, height=height, fps=fps)
-                    video_data = video_generator.create_full_video(
-                        st.session_state.story_data,
-                        st.session_state.story_images,
-                        st.session_state.story_audio,
-                        output_dir=settings["output_dir"]
-                    )
-                    
-                    # Lưu video_data vào session_state
-                    st.session_state.video_data = video_data
-                    
-                    if video_data and video_data.get("full_video"):
-                        st.success("Đã tạo xong video đầy đủ!")
-                    else:
-                        st.warning("Không thể tạo video đầy đủ, nhưng có thể đã tạo được video cho một số chương.")
+                submit_job("video", {
+                    "story_data": st.session_state.story_data,
+                    "story_images": st.session_state.story_images,
+                    "story_audio": st.session_state.story_audio,
+                    "output_dir": settings["output_dir"],
+                    "width": width,
+                    "height": height,
+                    "fps": fps
+                }, tag="video")
+            
+            def on_video_result(result):
+                # Lưu video_data vào session_state
+                st.session_state.video_data = result["video_data"]
+            
+            video_result = display_job("video", on_video_result)
+            if video_result:
+                if video_result["video_data"].get("full_video"):
+                    st.success("Đã tạo xong video đầy đủ!")
+                else:
+                    st.warning("Không thể tạo video đầy đủ, nhưng có thể đã tạo được video cho một số chương.")
             
             # Hiển thị video nếu đã tạo
             if 'video_data' in st.session_state:
@@ -607,145 +689,42 @@ def main():
                     "video_fps": fps if 'fps' in locals() else 30
                 }
                 
-                # Hiển thị khung tiến trình
-                progress_container = st.empty()
-                progress_bar = st.progress(0)
-                status_container = st.empty()
-                
-                # Tạo container hiển thị log
-                log_placeholder = create_log_container()
-                update_log(log_placeholder, f"Bắt đầu quy trình tạo nội dung tự động với ý tưởng: {story_concept[:100]}...")
+                # Tạo truyện, hình ảnh, audio và video theo pipeline từng chương trong process riêng:
+                # ảnh/audio của một chương bắt đầu ngay khi chương đó được viết xong
+                submit_job("pipeline", all_in_one_settings, tag="all_in_one")
+        
+        def on_pipeline_result(result):
+            # Lưu kết quả vào session_state
+            st.session_state.story_data = result["story_data"]
+            st.session_state.story_images = result["story_images"]
+            st.session_state.story_audio = result["story_audio"]
+            st.session_state.video_data = result["video_data"]
+        
+        # Trạng thái được đọc lại từ bảng job nên tải lại trang không làm mất tiến trình
+        pipeline_result = display_job("all_in_one", on_pipeline_result)
+        if pipeline_result:
+            video_data = pipeline_result["video_data"]
+            if video_data and video_data.get("full_video"):
+                st.success("🎉 Hoàn thành! Đã tạo xong video đầy đủ!")
+            else:
+                st.warning("⚠️ Không thể tạo video đầy đủ, nhưng có thể đã tạo được video cho một số chương.")
+            
+            # Hiển thị kết quả cuối cùng
+            full_video = video_data.get("full_video") if video_data else None
+            if full_video and os.path.exists(full_video):
+                st.subheader("Video đầy đủ")
+                st.video(full_video)
+                st.download_button(
+                    label="Tải xuống video đầy đủ",
+                    data=open(full_video, "rb").read(),
+                    file_name="full_story.mp4",
+                    mime="video/mp4"
+                )
                 
-                try:
-                    # Bước 1: Tạo truyện
-                    with st.spinner("Bước 1/4: Đang tạo nội dung truyện..."):
-                        status_container.info("Bước 1/4: Đang tạo nội dung truyện...")
-                        update_log(log_placeholder, f"Bắt đầu tạo {num_chapters} chương truyện với {tokens_per_chapter} token mỗi chương")
-                        
-                        story_generator = StoryGenerator()
-                        story_data = story_generator.generate_full_story(
-                            all_in_one_settings["story_concept"],
-                            num_chapters=all_in_one_settings["num_chapters"],
-                            tokens_per_chapter=all_in_one_settings["tokens_per_chapter"],
-                            output_dir=all_in_one_settings["output_dir"]
-                        )
-                        
-                        # Lưu story_data vào session_state
-                        st.session_state.story_data = story_data
-                        progress_bar.progress(25)
-                        status_container.success(f"✅ Đã tạo xong câu chuyện với {all_in_one_settings['num_chapters']} chương!")
-                        update_log(log_placeholder, f"✅ Đã tạo xong câu chuyện với {all_in_one_settings['num_chapters']} chương")
-                        update_log(log_placeholder, f"Đường dẫn file dữ liệu truyện: {all_in_one_settings['output_dir']}/story_data.json")
-                    
-                    # Bước 2: Tạo hình ảnh
-                    with st.spinner("Bước 2/4: Đang tạo hình ảnh minh họa..."):
-                        status_container.info("Bước 2/4: Đang tạo hình ảnh minh họa...")
-                        update_log(log_placeholder, f"Bắt đầu tạo hình ảnh minh họa sử dụng model {all_in_one_settings['image_model']}")
-                        
-                        image_generator = ImageGenerator(model_type=all_in_one_settings["image_model"])
-                        # Thêm các sự kiện vào log
-                        def log_image_event(chapter_num, scene_num, total_scenes):
-                            update_log(log_placeholder, f"Đang tạo hình ảnh {scene_num}/{total_scenes} cho chương {chapter_num}")
-                        
-                        # Trích xuất thông tin nhân vật
-                        update_log(log_placeholder, "Đang phân tích thông tin nhân vật để tạo hình ảnh nhất quán...")
-                        
-                        story_images = image_generator.process_story(
-                            story_data, 
-                            output_dir=all_in_one_settings["output_dir"]
-                        )
-                        
-                        # Lưu story_images vào session_state
-                        st.session_state.story_images = story_images
-                        progress_bar.progress(50)
-                        status_container.success("✅ Đã tạo xong hình ảnh minh họa!")
-                        update_log(log_placeholder, "✅ Đã tạo xong hình ảnh minh họa")
-                        total_images = sum(len(chapter.get("images", [])) for chapter in story_images)
-                        update_log(log_placeholder, f"Tổng cộng đã tạo {total_images} hình ảnh cho {len(story_images)} chương")
-                        update_log(log_placeholder, f"Đường dẫn file dữ liệu hình ảnh: {all_in_one_settings['output_dir']}/images_data.json")
-                    
-                    # Bước 3: Tạo audio
-                    with st.spinner("Bước 3/4: Đang tạo audio..."):
-                        status_container.info("Bước 3/4: Đang tạo audio...")
-                        update_log(log_placeholder, f"Bắt đầu tạo audio sử dụng provider {all_in_one_settings['tts_provider']}")
-                        
-                        audio_generator = AudioGenerator(provider=all_in_one_settings["tts_provider"])
-                        story_audio = audio_generator.process_story(
-                            story_data, 
-                            output_dir=all_in_one_settings["output_dir"]
-                        )
-                        
-                        # Lưu story_audio vào session_state
-                        st.session_state.story_audio = story_audio
-                        progress_bar.progress(75)
-                        status_container.success("✅ Đã tạo xong audio!")
-                        update_log(log_placeholder, "✅ Đã tạo xong audio")
-                        update_log(log_placeholder, f"Đường dẫn file dữ liệu audio: {all_in_one_settings['output_dir']}/audio_data.json")
-                    
-                    # Bước 4: Tạo video
-                    with st.spinner("Bước 4/4: Đang tạo video... Quá trình này có thể mất nhiều thời gian..."):
-                        status_container.info("Bước 4/4: Đang tạo video... Quá trình này có thể mất nhiều thời gian...")
-                        update_log(log_placeholder, f"Bắt đầu tạo video với kích thước {all_in_one_settings['video_width']}x{all_in_one_settings['video_height']}, {all_in_one_settings['video_fps']} FPS")
-                        
-                        video_generator = VideoGenerator(
-                            width=all_in_one_settings["video_width"],
-                            height=all_in_one_settings["video_height"],
-                            fps=all_in_one_settings["video_fps"]
-                        )
-                        video_data = video_generator.create_full_video(
-                            story_data,
-                            story_images,
-                            story_audio,
-                            output_dir=all_in_one_settings["output_dir"]
-                        )
-                        
-                        # Lưu video_data vào session_state
-                        st.session_state.video_data = video_data
-                        progress_bar.progress(100)
-                        
-                        if video_data and video_data.get("full_video"):
-                            status_container.success("🎉 Hoàn thành! Đã tạo xong video đầy đủ!")
-                            update_log(log_placeholder, "🎉 Hoàn thành! Đã tạo xong video đầy đủ")
-                            update_log(log_placeholder, f"Đường dẫn video đầy đủ: {video_data.get('full_video')}")
-                        else:
-                            status_container.warning("⚠️ Không thể tạo video đầy đủ, nhưng có thể đã tạo được video cho một số chương.")
-                            update_log(log_placeholder, "⚠️ Không thể tạo video đầy đủ, nhưng có thể đã tạo được video cho một số chương")
-                            if video_data and video_data.get("chapter_videos"):
-                                for chapter_video in video_data.get("chapter_videos"):
-                                    if chapter_video.get("video_path"):
-                                        update_log(log_placeholder, f"Video chương {chapter_video.get('chapter_num')}: {chapter_video.get('video_path')}")
-                        
-                        # Hiển thị kết quả cuối cùng
-                        if "video_data" in st.session_state and st.session_state.video_data:
-                            all_videos = []
-                            full_video = st.session_state.video_data.get("full_video")
-                            if full_video and os.path.exists(full_video):
-                                st.subheader("Video đầy đủ")
-                                st.video(full_video)
-                                st.download_button(
-                                    label="Tải xuống video đầy đủ",
-                                    data=open(full_video, "rb").read(),
-                                    file_name="full_story.mp4",
-                                    mime="video/mp4"
-                                )
-                                
-                                # Thông tin đường dẫn
-                                st.info(f"Video đã được lưu tại: {os.path.abspath(full_video)}")
-                                all_videos.append(full_video)
-                        
-                        # Đánh giá kết quả
-                        update_log(log_placeholder, "===== KẾT QUẢ CUỐI CÙNG =====")
-                        update_log(log_placeholder, f"- Số chương đã tạo: {len(story_data['chapters'])}")
-                        update_log(log_placeholder, f"- Tổng số hình ảnh: {sum(len(chapter.get('images', [])) for chapter in story_images)}")
-                        update_log(log_placeholder, f"- Tổng số video: {len(all_videos)}")
-                        update_log(log_placeholder, f"- Thời gian hoàn thành: {time.strftime('%H:%M:%S', time.localtime())}")
-                        
-                except Exception as e:
-                    progress_container.empty()
-                    status_container.error(f"❌ Lỗi: {str(e)}")
-                    update_log(log_placeholder, f"❌ Lỗi: {str(e)}")
-                    st.exception(e)
-                    st.info("Bạn có thể thử lại với số chương ít hơn hoặc điều chỉnh các thông số khác.")
+                # Thông tin đường dẫn
+                st.info(f"Video đã được lưu tại: {os.path.abspath(full_video)}")
+            
+            st.caption(f"Thời gian từng bước: {pipeline_result.get('metrics_path')} | Trace: {pipeline_result.get('trace_path')}")
 
     # Tab Tạo Truyện Theo Chương Có Sẵn
     with tab7:
@@ -973,45 +952,63 @@ def main():
             else:
                 output_dir = st.session_state.custom_story_output_dir
             
+            # Các bước chạy trong process riêng (job chạy nền) để không khóa phiên làm việc
+            publish = {
+                "story_title": st.session_state.get("story_title", "My Story"),
+                "series_name": st.session_state.get("current_series", None)
+            }
+            
+            def save_custom_story_data():
+                # Lưu story_data vào file để dùng sau này
+                story_data_path = os.path.join(output_dir, "story_data.json")
+                with open(story_data_path, "w", encoding="utf-8") as f:
+                    json.dump(custom_story_data, f, ensure_ascii=False, indent=2)
+            
+            def on_custom_images_result(result):
+                # Lưu story_images vào session_state
+                st.session_state.custom_story_images = result["story_images"]
+            
+            def on_custom_audio_result(result):
+                # Lưu story_audio vào session_state
+                st.session_state.custom_story_audio = result["story_audio"]
+            
+            def on_custom_video_result(result):
+                # Lưu video_data và video_id vào session_state
+                st.session_state.custom_story_video = result["video_data"]
+                st.session_state.video_id_in_db = result.get("video_id")
+            
+            def on_custom_all_result(result):
+                on_custom_images_result(result)
+                on_custom_audio_result(result)
+                on_custom_video_result(result)
+            
             # Tab 1: Tạo hình ảnh
             with tab_steps[0]:
                 if st.button("Tạo hình ảnh", key="tab7_create_images_btn"):
-                    with st.spinner(f"Đang tạo hình ảnh minh họa với model {image_model}..."):
-                        try:
-                            # Lưu story_data vào file để dùng sau này
-                            story_data_path = os.path.join(output_dir, "story_data.json")
-                            with open(story_data_path, "w", encoding="utf-8") as f:
-                                json.dump(custom_story_data, f, ensure_ascii=False, indent=2)
-                            
-                            # Khởi tạo ImageGenerator
-                            image_generator = ImageGenerator(model_type=image_model)
-                            
-                            # Xử lý tạo hình ảnh
-                            story_images = image_generator.process_story(
-                                custom_story_data, 
-                                output_dir=output_dir
-                            )
-                            
-                            # Lưu story_images vào session_state
-                            st.session_state.custom_story_images = story_images
-                            st.success("Đã tạo xong hình ảnh minh họa!")
-                            
-                            # Hiển thị một số hình ảnh mẫu
-                            if story_images and len(story_images) > 0:
-                                st.subheader("Mẫu hình ảnh đã tạo")
-                                sample_images = []
-                                for chapter in story_images:
-                                    for img in chapter.get("images", [])[:2]:  # Chỉ lấy 2 hình đầu tiên mỗi chương
-                                        if img.get("image_path") and os.path.exists(img.get("image_path")):
-                                            sample_images.append(img.get("image_path"))
-                                
-                                # Hiển thị tối đa 6 hình ảnh mẫu
-                                if sample_images:
-                                    cols = st.columns(3)
-                                    for i, img_path in enumerate(sample_images[:6]):
-                                        cols[i % 3].image(img_path, use_column_width=True)
-                        except Exception as e:
-                            st.error(f"Lỗi khi tạo hình ảnh: {str(e)}")
+                    save_custom_story_data()
+                    submit_job("images", {
+                        "story_data": custom_story_data,
+                        "output_dir": output_dir,
+                        "model_type": image_model
+                    }, tag="custom_images")
+                
+                story_images = display_job("custom_images", on_custom_images_result)
+                if story_images:
+                    st.success("Đã tạo xong hình ảnh minh họa!")
+                    
+                    # Hiển thị một số hình ảnh mẫu
+                    sample_images = []
+                    for chapter in story_images["story_images"]:
+                        for img in chapter.get("images", [])[:2]:  # Chỉ lấy 2 hình đầu tiên mỗi chương
+                            if img.get("image_path") and os.path.exists(img.get("image_path")):
+                                sample_images.append(img.get("image_path"))
+                    
+                    # Hiển thị tối đa 6 hình ảnh mẫu
+                    if sample_images:
+                        st.subheader("Mẫu hình ảnh đã tạo")
+                        cols = st.columns(3)
+                        for i, img_path in enumerate(sample_images[:6]):
+                            cols[i % 3].image(img_path, use_column_width=True)
             
             # Tab 2: Tạo audio
             with tab_steps[1]:
@@ -1019,30 +1016,23 @@ def main():
                     st.warning("Vui lòng tạo hình ảnh trước (bước 1)")
                 else:
                     if st.button("Tạo audio", key="tab7_create_audio_btn"):
-                        with st.spinner(f"Đang tạo audio với provider {tts_provider}..."):
-                            try:
-                                audio_generator = AudioGenerator(provider=tts_provider)
-                                story_audio = audio_generator.process_story(
-                                    custom_story_data, 
-                                    output_dir=output_dir
-                                )
-                                
-                                # Lưu story_audio vào session_state
-                                st.session_state.custom_story_audio = story_audio
-                                st.success("Đã tạo xong audio!")
-                                
-                                # Hiển thị mẫu audio
-                                if story_audio and len(story_audio) > 0:
-                                    st.subheader("Mẫu audio đã tạo")
-                                    for chapter_audio in story_audio[:2]:  # Chỉ hiển thị 2 chương đầu
-                                        chapter_num = chapter_audio["chapter_num"]
-                                        full_audio = chapter_audio.get("full_audio")
-                                        
-                                        if full_audio and os.path.exists(full_audio):
-                                            st.write(f"**Audio cho Chương {chapter_num}:**")
-                                            st.audio(full_audio)
-                            except Exception as e:
-                                st.error(f"Lỗi khi tạo audio: {str(e)}")
+                        submit_job("audio", {
+                            "story_data": custom_story_data,
+                            "output_dir": output_dir,
+                            "provider": tts_provider
+                        }, tag="custom_audio")
+                    
+                    story_audio = display_job("custom_audio", on_custom_audio_result)
+                    if story_audio:
+                        st.success("Đã tạo xong audio!")
+                        
+                        # Hiển thị mẫu audio
+                        st.subheader("Mẫu audio đã tạo")
+                        for chapter_audio in story_audio["story_audio"][:2]:  # Chỉ hiển thị 2 chương đầu
+                            full_audio = chapter_audio.get("full_audio")
+                            if full_audio and os.path.exists(full_audio):
+                                st.write(f"**Audio cho Chương {chapter_audio['chapter_num']}:**")
+                                st.audio(full_audio)
             
             # Tab 3: Tạo video
             with tab_steps[2]:
@@ -1052,138 +1042,45 @@ def main():
                     st.warning("Vui lòng tạo audio trước (bước 2)")
                 else:
                     if st.button("Tạo video", key="tab7_create_video_btn"):
-                        with st.spinner("Đang tạo video... Quá trình này có thể mất nhiều thời gian..."):
-                            try:
-                                video_generator = VideoGenerator(width=width, height=height, fps=fps)
-                                video_data = video_generator.create_full_video(
-                                    custom_story_data,
-                                    st.session_state.custom_story_images,
-                                    st.session_state.custom_story_audio,
-                                    output_dir=output_dir
-                                )
-                                
-                                # Lưu video_data vào session_state
-                                st.session_state.custom_story_video = video_data
-                                
-                                # Lưu thông tin video vào MongoDB
-                                story_title = st.session_state.get("story_title", "My Story")
-                                series_name = st.session_state.get("current_series", None)
-                                
-                                video_id = db_manager.save_video_data(
-                                    video_data,
-                                    story_title,
-                                    series_name
-                                )
-                                
-                                # Cập nhật video_id vào session state
-                                st.session_state.video_id_in_db = video_id
-                                
-                                if video_id:
-                                    st.success(f"Đã tạo video thành công và lưu với ID: {video_id}")
-                                else:
-                                    st.warning("Đã tạo video nhưng không thể lưu vào cơ sở dữ liệu.")
-                                
-                                # Hiển thị video mới
-                                display_videos(video_data, video_id if video_id else None)
-                            except Exception as e:
-                                st.error(f"Lỗi khi tạo video: {str(e)}")
+                        # Render rồi lưu video vào MongoDB hoặc gửi lên Telegram
+                        submit_job("video", {
+                            "story_data": custom_story_data,
+                            "story_images": st.session_state.custom_story_images,
+                            "story_audio": st.session_state.custom_story_audio,
+                            "output_dir": output_dir,
+                            "width": width,
+                            "height": height,
+                            "fps": fps,
+                            "publish": publish
+                        }, tag="custom_video")
+                    
+                    video_result = display_job("custom_video", on_custom_video_result)
+                    if video_result:
+                        if video_result.get("video_id"):
+                            st.success(f"Đã tạo video thành công và lưu với ID: {video_result['video_id']}")
+                        else:
+                            st.warning("Đã tạo video nhưng không thể lưu vào cơ sở dữ liệu.")
             
             # Tab 4: Tất cả các bước
             with tab_steps[3]:
                 if st.button("🚀 Tạo tất cả (hình ảnh, audio, video)", key="tab7_create_all_btn"):
-                    # Tạo container cho log
-                    log_placeholder = create_log_container()
-                    update_log(log_placeholder, "Bắt đầu quy trình tạo truyện và video...")
-                    
-                    # Hiển thị khung tiến trình
-                    progress_bar = st.progress(0)
-                    status_container = st.empty()
-                    
-                    try:
-                        # Bước 1: Tạo hình ảnh
-                        with st.spinner("Bước 1/3: Đang tạo hình ảnh minh họa..."):
-                            status_container.info("Bước 1/3: Đang tạo hình ảnh minh họa...")
-                            update_log(log_placeholder, f"Bắt đầu tạo hình ảnh với model {image_model}...")
-                            
-                            # Lưu story_data vào file
-                            story_data_path = os.path.join(output_dir, "story_data.json")
-                            with open(story_data_path, "w", encoding="utf-8") as f:
-                                json.dump(custom_story_data, f, ensure_ascii=False, indent=2)
-                            
-                            # Khởi tạo ImageGenerator
-                            image_generator = ImageGenerator(model_type=image_model)
-                            
-                            # Xử lý tạo hình ảnh
-                            story_images = image_generator.process_story(
-                                custom_story_data, 
-                                output_dir=output_dir
-                            )
-                            
-                            # Lưu story_images vào session_state
-                            st.session_state.custom_story_images = story_images
-                            progress_bar.progress(33)
-                            update_log(log_placeholder, "✅ Đã tạo xong hình ảnh minh họa!")
-                            
-                        # Bước 2: Tạo audio  
-                        with st.spinner("Bước 2/3: Đang tạo audio..."):
-                            status_container.info("Bước 2/3: Đang tạo audio...")
-                            update_log(log_placeholder, f"Bắt đầu tạo audio với provider {tts_provider}...")
-                            
-                            audio_generator = AudioGenerator(provider=tts_provider)
-                            story_audio = audio_generator.process_story(
-                                custom_story_data, 
-                                output_dir=output_dir
-                            )
-                            
-                            # Lưu story_audio vào session_state
-                            st.session_state.custom_story_audio = story_audio
-                            progress_bar.progress(66)
-                            update_log(log_placeholder, "✅ Đã tạo xong audio!")
-                        
-                        # Bước 3: Tạo video
-                        with st.spinner("Bước 3/3: Đang tạo video..."):
-                            status_container.info("Bước 3/3: Đang tạo video... Quá trình này có thể mất nhiều thời gian...")
-                            update_log(log_placeholder, f"Bắt đầu tạo video với kích thước {width}x{height}, {fps} FPS...")
-                            
-                            video_generator = VideoGenerator(width=width, height=height, fps=fps)
-                            video_data = video_generator.create_full_video(
-                                custom_story_data,
-                                story_images,
-                                story_audio,
-                                output_dir=output_dir
-                            )
-                            
-                            # Lưu video_data vào session_state
-                            st.session_state.custom_story_video = video_data
-                            
-                            # Lưu thông tin video vào MongoDB
-                            story_title = st.session_state.get("story_title", "My Story")
-                            series_name = st.session_state.get("current_series", None)
-                            
-                            video_id = db_manager.save_video_data(
-                                video_data,
-                                story_title,
-                                series_name
-                            )
-                            
-                            # Cập nhật video_id vào session state
-                            st.session_state.video_id_in_db = video_id
-                            
-                            progress_bar.progress(100)
-                            status_container.success("🎉 Hoàn thành tất cả các bước!")
-                            update_log(log_placeholder, "🎉 Hoàn thành tất cả các bước!")
-                            
-                            if video_id:
-                                update_log(log_placeholder, f"Video đã được lưu với ID: {video_id}")
-                            
-                            # Hiển thị video
-                            st.header("Kết quả video")
-                            display_videos(video_data, video_id if video_id else None)
-                            
-                    except Exception as e:
-                        status_container.error(f"❌ Lỗi: {str(e)}")
-                        update_log(log_placeholder, f"❌ Lỗi: {str(e)}")
-                        st.exception(e)
+                    save_custom_story_data()
+                    submit_job("story_media", {
+                        "story_data": custom_story_data,
+                        "output_dir": output_dir,
+                        "image_model": image_model,
+                        "tts_provider": tts_provider,
+                        "width": width,
+                        "height": height,
+                        "fps": fps,
+                        "publish": publish
+                    }, tag="custom_all")
+                
+                all_result = display_job("custom_all", on_custom_all_result)
+                if all_result:
+                    st.success("🎉 Hoàn thành tất cả các bước!")
+                    if all_result.get("video_id"):
+                        st.info(f"Video đã được lưu với ID: {all_result['video_id']}")
             
             # Hiển thị kết quả video nếu đã tạo
             if 'custom_story_video' in st.session_state:
@@ -1202,6 +1099,11 @@ def main():
     - Tạo audio: Google TTS (gTTS), OpenAI TTS
     - Lưu trữ dữ liệu: MongoDB
     """)
+    
+    # Còn job chạy nền: tự chạy lại script sau một khoảng ngắn để cập nhật tiến độ
+    if st.session_state.pop("jobs_running", False):
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
 
 def create_all_in_one_for_custom_chapters():
     """Tạo video từ các chương đã tải lên"""
@@ -1315,89 +1217,28 @@ def create_all_in_one_for_custom_chapters():
         
         update_log(log_placeholder, f"Đã lưu nội dung {len(valid_chapters)} chương.")
         
-        # Xử lý tạo hình ảnh
-        update_log(log_placeholder, "Đang tạo hình ảnh cho truyện...")
-        image_generator = ImageGenerator(model_type=image_model)
-        story_images = image_generator.process_story(story_data, output_dir=output_dir)
-        
-        # Lưu vào session_state
-        st.session_state.custom_story_images = story_images
-        
-        # Xử lý tạo audio
-        update_log(log_placeholder, "Đang tạo audio cho truyện...")
-        try:
-            audio_generator = AudioGenerator(provider=tts_provider)
-            story_audio = audio_generator.process_story(story_data, output_dir=output_dir)
-            
-            # Xử lý tạo video
-            update_log(log_placeholder, "Đang tạo video cho truyện...")
-            video_generator = VideoGenerator()
-            video_data = video_generator.create_full_video(
-                story_data, 
-                story_images, 
-                story_audio, 
-                output_dir=output_dir
-            )
-            
-            # Lưu thông tin video vào session_state
-            st.session_state.custom_story_video = video_data
-            
-            # Lưu vào cơ sở dữ liệu
-            from utils.db_utils import db_manager
-            from utils.telegram_utils import telegram_manager
-            
-            # Khởi tạo video_id với giá trị mặc định
-            video_id = None
-            
-            try:
-                update_log(log_placeholder, "Đang lưu thông tin video vào cơ sở dữ liệu...")
-                
-                # Lưu vào MongoDB nếu đã kết nối
-                if db_manager.is_connected():
-                    video_id = db_manager.save_video_data(video_data, story_title, series_name)
-                    update_log(log_placeholder, f"Đã lưu vào MongoDB với ID: {video_id}")
-                
-                # Nếu MongoDB không khả dụng và Telegram được cấu hình, thử gửi qua Telegram
-                if (not video_id or not db_manager.is_connected()) and telegram_manager.is_configured():
-                    update_log(log_placeholder, "Đang gửi video lên Telegram...")
-                    
-                    # Lấy đường dẫn video đầy đủ
-                    full_video_path = video_data.get("full_video")
-                    
-                    if full_video_path and os.path.exists(full_video_path):
-                        # Tạo caption
-                        caption = f"<b>Tiêu đề:</b> {story_title}"
-                        if series_name:
-                            caption += f"\n<b>Bộ truyện:</b> {series_name}"
-                        
-                        # Gửi video lên Telegram
-                        message_id = telegram_manager.send_video(full_video_path, caption)
-                        
-                        if message_id:
-                            update_log(log_placeholder, f"Đã gửi video thành công lên Telegram với ID: {message_id}")
-                            # Gán video_id nếu chưa có từ save_video_data
-                            if not video_id:
-                                video_id = f"tg_{message_id}"
-                        else:
-                            update_log(log_placeholder, "Không thể gửi video lên Telegram.")
-                    else:
-                        update_log(log_placeholder, f"Không tìm thấy file video đầy đủ tại: {full_video_path}")
-                
-                # Lưu ID vào session state
-                if video_id:
-                    st.session_state.video_id_in_db = video_id
-                
-            except Exception as e:
-                update_log(log_placeholder, f"Lỗi khi lưu video: {str(e)}")
-            
-            # Hiển thị video mới
-            display_videos(video_data, video_id if video_id else None)
-            
-            # Rerun để cập nhật UI
-            st.rerun()
-        except Exception as e:
-            update_log(log_placeholder, f"Lỗi: {str(e)}")
-            update_log(log_placeholder, f"Traceback: {traceback.format_exc()}")
+        # Tạo hình ảnh, audio, video rồi lưu/gửi video trong process riêng (job chạy nền)
+        update_log(log_placeholder, "Đang tạo hình ảnh, audio và video cho truyện...")
+        submit_job("story_media", {
+            "story_data": story_data,
+            "output_dir": output_dir,
+            "image_model": image_model,
+            "tts_provider": tts_provider,
+            "publish": {"story_title": story_title, "series_name": series_name or None}
+        }, tag="custom_chapters_all")
+    
+    def on_custom_chapters_result(result):
+        # Lưu kết quả vào session_state
+        st.session_state.custom_story_images = result["story_images"]
+        st.session_state.custom_story_audio = result["story_audio"]
+        st.session_state.custom_story_video = result["video_data"]
+        if result.get("video_id"):
+            st.session_state.video_id_in_db = result["video_id"]
+    
+    result = display_job("custom_chapters_all", on_custom_chapters_result)
+    if result:
+        # Hiển thị video mới
+        display_videos(result["video_data"], result.get("video_id"))
 
 def display_frames(video_data, story_images, output_dir):
     """Hiển thị các frame hình ảnh, prompt và nút tạo lại ảnh"""
@@ -1440,128 +1281,77 @@ def display_frames(video_data, story_images, output_dir):
                                     st.text_area("Prompt", value=prompt, height=150, key=f"prompt_{chapter_images['chapter_num']}_{idx}")
                                 
                                 # Nút tạo lại ảnh
+                                # Nút tạo lại ảnh (gọi API trong process riêng)
+                                job_tag = f"recreate_image_{chapter_images['chapter_num']}_{idx}"
                                 if st.button("Tạo lại ảnh này", key=f"recreate_{chapter_images['chapter_num']}_{idx}"):
-                                    with st.spinner("Đang tạo lại hình ảnh..."):
-                                        try:
-                                            # Lấy model từ session state hoặc mặc định
-                                            image_model = st.session_state.get("custom_image_model", "gemini")
-                                            
-                                            # Khởi tạo ImageGenerator
-                                            image_generator = ImageGenerator(model_type=image_model)
-                                            
-                                            # Lấy prompt đã chỉnh sửa
-                                            edited_prompt = st.session_state[f"prompt_{chapter_images['chapter_num']}_{idx}"]
-                                            
-                                            # Tạo lại hình ảnh
-                                            new_image_path = image_generator.generate_image(edited_prompt, image_path)
-                                            
-                                            if new_image_path:
-                                                st.success("Đã tạo lại hình ảnh thành công!")
-                                                st.image(new_image_path, caption=f"Frame {idx+1} (Đã tạo lại)")
-                                                
-                                                # Cập nhật đường dẫn ảnh trong session state
-                                                img_data["image_path"] = new_image_path
-                                                img_data["prompt"] = edited_prompt
-                                            else:
-                                                st.error("Không thể tạo lại hình ảnh, vui lòng thử lại.")
-                                        except Exception as e:
-                                            st.error(f"Lỗi khi tạo lại hình ảnh: {str(e)}")
+                                    submit_job("image", {
+                                        # Lấy model từ session state hoặc mặc định
+                                        "model_type": st.session_state.get("custom_image_model", "gemini"),
+                                        # Lấy prompt đã chỉnh sửa
+                                        "prompt": st.session_state[f"prompt_{chapter_images['chapter_num']}_{idx}"],
+                                        "output_path": image_path
+                                    }, tag=job_tag)
+                                
+                                def on_image_result(result, img_data=img_data):
+                                    # Cập nhật đường dẫn ảnh trong session state
+                                    img_data["image_path"] = result["image_path"]
+                                    # Frame chuẩn hóa cũ không còn khớp với ảnh mới
+                                    img_data.pop("normalized_path", None)
+                                    img_data.pop("normalized_size", None)
+                                    img_data["prompt"] = result["prompt"]
+                                
+                                image_result = display_job(job_tag, on_image_result)
+                                if image_result:
+                                    st.success("Đã tạo lại hình ảnh thành công!")
+                                    st.image(image_result["image_path"], caption=f"Frame {idx+1} (Đã tạo lại)")
                         else:
                             with cols[k]:
                                 st.warning(f"Không tìm thấy hình ảnh tại: {image_path}")
     
-    # Thêm nút để tạo lại video sau khi đã chỉnh sửa hình ảnh
+    # Thêm nút để tạo lại video sau khi đã chỉnh sửa hình ảnh (render trong process riêng)
     if st.button("Tạo lại video với hình ảnh đã chỉnh sửa", key="recreate_video"):
-        with st.spinner("Đang tạo lại video... Quá trình này có thể mất nhiều thời gian..."):
-            try:
-                # Khởi tạo VideoGenerator
-                width = st.session_state.get("custom_story_width", 1280)
-                height = st.session_state.get("custom_story_height", 720)
-                fps = st.session_state.get("custom_story_fps", 30)
-                video_generator = VideoGenerator(width=width, height=height, fps=fps)
-                
-                # Lấy dữ liệu story từ session state
-                story_data = None
-                story_audio = None
-                
-                if "custom_chapters" in st.session_state:
-                    # Tạo cấu trúc story_data từ custom_chapters
-                    story_data = {
-                        "concept": st.session_state.get("story_title", "My Story"),
-                        "num_chapters": len(st.session_state.custom_chapters),
-                        "chapters": st.session_state.custom_chapters
-                    }
-                
-                if "custom_story_audio" in st.session_state:
-                    story_audio = st.session_state.custom_story_audio
-                
-                if story_data and story_audio and story_images:
-                    # Tạo lại video
-                    video_data = video_generator.create_full_video(
-                        story_data, 
-                        story_images, 
-                        story_audio, 
-                        output_dir=output_dir
-                    )
-                    
-                    # Cập nhật session state với video mới
-                    st.session_state.custom_story_video = video_data
-                    
-                    # Lưu thông tin video vào MongoDB
-                    story_title = st.session_state.get("story_title", "My Story")
-                    series_name = st.session_state.get("current_series", None)
-                    
-                    # Khởi tạo video_id
-                    video_id = None
-                    
-                    try:
-                        # Lưu vào MongoDB nếu đã kết nối
-                        if db_manager.is_connected():
-                            video_id = db_manager.save_video_data(video_data, story_title, series_name)
-                            st.success(f"Đã lưu video vào MongoDB với ID: {video_id}")
-                        
-                        # Nếu MongoDB không khả dụng và Telegram được cấu hình, thử gửi qua Telegram
-                        if (not video_id or not db_manager.is_connected()) and telegram_manager.is_configured():
-                            st.info("Đang gửi video lên Telegram...")
-                            
-                            # Lấy đường dẫn video đầy đủ
-                            full_video_path = video_data.get("full_video")
-                            
-                            if full_video_path and os.path.exists(full_video_path):
-                                # Tạo caption
-                                caption = f"<b>Tiêu đề:</b> {story_title}"
-                                if series_name:
-                                    caption += f"\n<b>Bộ truyện:</b> {series_name}"
-                                
-                                # Gửi video lên Telegram
-                                message_id = telegram_manager.send_video(full_video_path, caption)
-                                
-                                if message_id:
-                                    st.success(f"Đã gửi video thành công lên Telegram với ID: {message_id}")
-                                    # Gán video_id nếu chưa có từ save_video_data
-                                    if not video_id:
-                                        video_id = f"tg_{message_id}"
-                                else:
-                                    st.warning("Không thể gửi video lên Telegram.")
-                            else:
-                                st.warning(f"Không tìm thấy file video đầy đủ tại: {full_video_path}")
-                        
-                        # Lưu ID vào session state
-                        if video_id:
-                            st.session_state.video_id_in_db = video_id
-                        
-                    except Exception as e:
-                        st.error(f"Lỗi khi lưu video: {str(e)}")
-                    
-                    # Hiển thị video mới
-                    display_videos(video_data, video_id if video_id else None)
-                    
-                    # Rerun để cập nhật UI
-                    st.rerun()
-                else:
-                    st.error("Không có đủ dữ liệu để tạo lại video. Vui lòng tạo video trước.")
-            except Exception as e:
-                st.error(f"Lỗi khi tạo lại video: {str(e)}")
+        # Lấy dữ liệu story từ session state
+        story_data = None
+        story_audio = None
+        
+        if "custom_chapters" in st.session_state:
+            # Tạo cấu trúc story_data từ custom_chapters
+            story_data = {
+                "concept": st.session_state.get("story_title", "My Story"),
+                "num_chapters": len(st.session_state.custom_chapters),
+                "chapters": st.session_state.custom_chapters
+            }
+        
+        if "custom_story_audio" in st.session_state:
+            story_audio = st.session_state.custom_story_audio
+        
+        if story_data and story_audio and story_images:
+            # Tạo lại video rồi lưu vào MongoDB hoặc gửi lên Telegram
+            submit_job("video", {
+                "story_data": story_data,
+                "story_images": story_images,
+                "story_audio": story_audio,
+                "output_dir": output_dir,
+                "width": st.session_state.get("custom_story_width", 1280),
+                "height": st.session_state.get("custom_story_height", 720),
+                "fps": st.session_state.get("custom_story_fps", 30),
+                "publish": {
+                    "story_title": st.session_state.get("story_title", "My Story"),
+                    "series_name": st.session_state.get("current_series", None)
+                }
+            }, tag="recreate_video")
+        else:
+            st.error("Không có đủ dữ liệu để tạo lại video. Vui lòng tạo video trước.")
+    
+    def on_recreate_result(result):
+        # Cập nhật session state với video mới
+        st.session_state.custom_story_video = result["video_data"]
+        if result.get("video_id"):
+            st.session_state.video_id_in_db = result["video_id"]
+        # Rerun để cập nhật UI
+        st.rerun()
+    
+    display_job("recreate_video", on_recreate_result)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,366 @@
+"""Benchmark các bước tạo truyện → ảnh → audio → video với provider giả lập (không cần mạng)
+
+Chạy:
+    python -m benchmarks.pipeline_benchmark --sizes small,medium
+    python -m benchmarks.pipeline_benchmark --save-baseline
+    python -m benchmarks.pipeline_benchmark --baseline benchmarks/baseline.json
+
+Mỗi bước được đo wall time, CPU time (cả process con như ffmpeg), RSS đỉnh và số artifact/giây.
+Kết quả được ghi ra JSON; khi so với baseline, chỉ số nào chậm/tốn hơn quá ngưỡng sẽ làm
+chương trình kết thúc với mã lỗi 1.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Kích thước truyện: số chương × số token mỗi chương × số ảnh mỗi chương
+SIZES = {
+    "small": {"chapters": 1, "tokens": 500, "images": 4},
+    "medium": {"chapters": 3, "tokens": 1500, "images": 8},
+    "large": {"chapters": 6, "tokens": 3000, "images": 16}
+}
+
+STAGES = ["story", "images", "audio", "video"]
+
+# Chỉ số được so với baseline: True nếu giá trị càng lớn càng tốt
+COMPARED_METRICS = {
+    "wall_s": False,
+    "cpu_s": False,
+    "peak_rss_mb": False,
+    "artifacts_per_s": True
+}
+
+# Chênh lệch tuyệt đối nhỏ hơn mức này được xem là nhiễu đo
+MIN_ABSOLUTE_DELTA = {
+    "wall_s": 0.05,
+    "cpu_s": 0.05,
+    "peak_rss_mb": 5.0,
+    "artifacts_per_s": 0.05
+}
+
+STORY_CONCEPT = "Một cô bé cùng chú mèo đi tìm ngọn đèn thần bị đánh cắp khỏi ngôi làng ven sông"
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline tạo truyện và video với provider giả lập")
+    parser.add_argument("--sizes", type=str, default="small",
+                        help=f"Các kích thước cần chạy, cách nhau bởi dấu phẩy ({', '.join(SIZES)})")
+    parser.add_argument("--chapters", type=int, help="Kích thước tùy chỉnh: số chương (thay cho --sizes)")
+    parser.add_argument("--tokens", type=int, default=1000, help="Kích thước tùy chỉnh: số token mỗi chương")
+    parser.add_argument("--images", type=int, default=8, help="Kích thước tùy chỉnh: số ảnh mỗi chương")
+    parser.add_argument("--stages", type=str, default=",".join(STAGES),
+                        help="Các bước cần đo (images/audio cần story, video cần images và audio)")
+    parser.add_argument("--latency_scale", type=float, default=0.05,
+                        help="Hệ số nhân độ trễ của provider giả lập (1.0 = gần với dịch vụ thật)")
+    parser.add_argument("--seed", type=str, default="0", help="Seed của provider giả lập")
+    parser.add_argument("--story_workers", type=int, default=4)
+    parser.add_argument("--image_workers", type=int, default=4)
+    parser.add_argument("--render_workers", type=int, default=1)
+    parser.add_argument("--output", type=str, help="File JSON kết quả (mặc định benchmarks/results/<thời gian>.json)")
+    parser.add_argument("--baseline", type=str, help="File kết quả baseline để so sánh")
+    parser.add_argument("--save-baseline", dest="save_baseline", action="store_true",
+                        help="Ghi kết quả lần chạy này làm baseline (benchmarks/baseline.json nếu không có --baseline)")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="Tỷ lệ chênh lệch tối đa so với baseline trước khi bị coi là regression")
+    parser.add_argument("--keep-output", dest="keep_output", action="store_true",
+                        help="Giữ lại thư mục output của từng lần chạy")
+    parser.add_argument("--verbose", action="store_true", help="Hiển thị log của các generator")
+    return parser.parse_args()
+
+
+def _current_rss():
+    """RSS hiện tại của process (byte), None nếu không đọc được"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss():
+    """RSS đỉnh từ đầu process (byte)"""
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class StageMonitor:
+    """Đo wall time, CPU time và RSS đỉnh của một bước
+
+    RSS được lấy mẫu bằng thread nền vì ru_maxrss chỉ cho biết đỉnh từ đầu process.
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = _current_rss()
+            if rss:
+                self.peak_rss = max(self.peak_rss, rss)
+
+    def __enter__(self):
+        self.peak_rss = _current_rss() or 0
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._times = os.times()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self._start
+        end_times = os.times()
+        self._stop.set()
+        self._sampler.join()
+        self.cpu = (end_times.user - self._times.user) + (end_times.system - self._times.system)
+        self.children_cpu = ((end_times.children_user - self._times.children_user)
+                             + (end_times.children_system - self._times.children_system))
+        if _current_rss() is None:
+            self.peak_rss = _max_rss()
+        return False
+
+    def result(self, artifacts):
+        return {
+            "wall_s": round(self.wall, 4),
+            "cpu_s": round(self.cpu, 4),
+            "children_cpu_s": round(self.children_cpu, 4),
+            "peak_rss_mb": round(self.peak_rss / (1024 * 1024), 1),
+            "artifacts": artifacts,
+            "artifacts_per_s": round(artifacts / self.wall, 3) if self.wall > 0 else None
+        }
+
+
+def run_size(size, args, stages):
+    """Chạy các bước cho một kích thước truyện, trả về chỉ số của từng bước"""
+    from utils.config import DEFAULT_CONFIG
+    from utils.mock_providers import configure_mock
+    from utils.rate_limiter import configure_rate_limit
+    from utils.story_generator import StoryGenerator
+    from utils.image_generator import ImageGenerator
+    from utils.audio_generator import AudioGenerator
+    from utils.video_generator import VideoGenerator
+
+    work_dir = tempfile.mkdtemp(prefix="story_benchmark_")
+    # Cache ảnh đã resize nằm trong thư mục tạm riêng để lần chạy không dùng lại kết quả cũ
+    DEFAULT_CONFIG['temp_dir'] = os.path.join(work_dir, "temp")
+    configure_mock("gemini_text", images_per_chapter=size["images"])
+    # Hạn mức tần suất của provider thật không áp dụng cho provider giả lập (độ trễ đã được thu nhỏ)
+    for name in DEFAULT_CONFIG['rate_limits']:
+        configure_rate_limit(name, None, None)
+
+    normalize_size = None
+    if DEFAULT_CONFIG['normalize_images']:
+        normalize_size = (DEFAULT_CONFIG['video_width'], DEFAULT_CONFIG['video_height'])
+
+    metrics = {}
+    try:
+        with open(os.devnull, "w") as devnull, \
+                (contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)):
+            with StageMonitor() as monitor:
+                story_data = StoryGenerator(max_workers=args.story_workers).generate_full_story(
+                    STORY_CONCEPT,
+                    num_chapters=size["chapters"],
+                    tokens_per_chapter=size["tokens"],
+                    output_dir=work_dir
+                )
+            metrics["story"] = monitor.result(len(story_data["chapters"]))
+
+            if "images" in stages:
+                image_generator = ImageGenerator(
+                    model_type="gemini", max_workers=args.image_workers,
+                    use_cache=False, normalize_size=normalize_size
+                )
+                with StageMonitor() as monitor:
+                    story_images = image_generator.process_story(story_data, output_dir=work_dir)
+                metrics["images"] = monitor.result(sum(
+                    1 for chapter in story_images for img in chapter["images"] if img.get("image_path")
+                ))
+
+            if "audio" in stages:
+                audio_generator = AudioGenerator(provider="google", use_cache=False)
+                with StageMonitor() as monitor:
+                    story_audio = audio_generator.process_story(story_data, output_dir=work_dir)
+                metrics["audio"] = monitor.result(sum(
+                    1 for chapter in story_audio for segment in chapter.get("segments", []) if segment.get("audio_path")
+                ))
+
+            if "video" in stages:
+                video_generator = VideoGenerator(
+                    width=DEFAULT_CONFIG['video_width'],
+                    height=DEFAULT_CONFIG['video_height'],
+                    render_workers=args.render_workers
+                )
+                with StageMonitor() as monitor:
+                    video_data = video_generator.create_full_video(
+                        story_data, story_images, story_audio, output_dir=work_dir
+                    )
+                metrics["video"] = monitor.result(len((video_data or {}).get("chapter_videos", [])))
+    finally:
+        if args.keep_output:
+            print(f"Output được giữ lại tại: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    metrics["total"] = {
+        "wall_s": round(sum(stage["wall_s"] for stage in metrics.values()), 4),
+        "cpu_s": round(sum(stage["cpu_s"] for stage in metrics.values()), 4),
+        "children_cpu_s": round(sum(stage["children_cpu_s"] for stage in metrics.values()), 4),
+        "peak_rss_mb": max(stage["peak_rss_mb"] for stage in metrics.values())
+    }
+    return metrics
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    header = f"{'size':<8} {'stage':<8} {'wall_s':>9} {'cpu_s':>9} {'child_cpu':>10} {'rss_mb':>8} {'artifacts':>10} {'per_s':>8}"
+    print(header)
+    print("-" * len(header))
+    for size_name, stages in results["sizes"].items():
+        for stage, m in stages.items():
+            artifacts = m.get("artifacts", "")
+            per_s = m.get("artifacts_per_s")
+            print(f"{size_name:<8} {stage:<8} {m['wall_s']:>9.3f} {m['cpu_s']:>9.3f} {m['children_cpu_s']:>10.3f} "
+                  f"{m['peak_rss_mb']:>8.1f} {artifacts:>10} {per_s if per_s is not None else '':>8}")
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """So sánh với baseline, trả về danh sách regression (chuỗi mô tả)"""
+    for key in ("latency_scale", "seed"):
+        if baseline["meta"].get(key) != results["meta"].get(key):
+            print(f"Cảnh báo: baseline chạy với {key}={baseline['meta'].get(key)}, "
+                  f"lần này {key}={results['meta'].get(key)}; kết quả có thể không so sánh được")
+
+    regressions = []
+    for size_name, stages in results["sizes"].items():
+        baseline_stages = baseline["sizes"].get(size_name, {})
+        for stage, metrics in stages.items():
+            baseline_metrics = baseline_stages.get(stage)
+            if not baseline_metrics:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                current = metrics.get(metric)
+                previous = baseline_metrics.get(metric)
+                if current is None or not previous:
+                    continue
+                delta = (previous - current) if higher_is_better else (current - previous)
+                if delta > MIN_ABSOLUTE_DELTA[metric] and delta / previous > tolerance:
+                    regressions.append(
+                        f"{size_name}/{stage} {metric}: {previous} → {current} ({(current - previous) / previous:+.0%})"
+                    )
+    return regressions
+
+
+def main():
+    args = parse_arguments()
+
+    # Luôn dùng provider giả lập: benchmark không bao giờ gọi dịch vụ thật
+    os.environ["PROVIDER_MODE"] = "mock"
+    os.environ["MOCK_LATENCY_SCALE"] = str(args.latency_scale)
+    os.environ["MOCK_SEED"] = args.seed
+    sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        print(f"Lỗi: bước không hợp lệ: {', '.join(unknown)}")
+        return 2
+    if "video" in stages and not ("images" in stages and "audio" in stages):
+        print("Lỗi: bước video cần cả images và audio")
+        return 2
+
+    if args.chapters:
+        sizes = {"custom": {"chapters": args.chapters, "tokens": args.tokens, "images": args.images}}
+    else:
+        names = [name.strip() for name in args.sizes.split(",") if name.strip()]
+        unknown = [name for name in names if name not in SIZES]
+        if unknown:
+            print(f"Lỗi: kích thước không hợp lệ: {', '.join(unknown)} (có: {', '.join(SIZES)})")
+            return 2
+        sizes = {name: SIZES[name] for name in names}
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "latency_scale": args.latency_scale,
+            "seed": args.seed,
+            "stages": ["story"] + [stage for stage in stages if stage != "story"],
+            "size_params": sizes,
+            "workers": {
+                "story": args.story_workers,
+                "images": args.image_workers,
+                "render": args.render_workers
+            }
+        },
+        "sizes": {}
+    }
+
+    for size_name, size in sizes.items():
+        print(f"Đang chạy benchmark '{size_name}': {size['chapters']} chương × {size['tokens']} token × {size['images']} ảnh...")
+        results["sizes"][size_name] = run_size(size, args, stages)
+
+    print()
+    print_results(results)
+
+    output_path = args.output or os.path.join(
+        BENCHMARK_DIR, "results", f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nKết quả đã được lưu vào: {output_path}")
+
+    baseline_path = args.baseline or os.path.join(BENCHMARK_DIR, "baseline.json")
+    if args.save_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Đã lưu baseline: {baseline_path}")
+        return 0
+
+    if args.baseline:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nREGRESSION so với baseline {baseline_path} (ngưỡng {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print(f"\nKhông có regression so với baseline (ngưỡng {args.tolerance:.0%})")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
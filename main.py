@@ -6,6 +6,12 @@ from utils.story_generator import StoryGenerator
 from utils.image_generator import ImageGenerator
 from utils.audio_generator import AudioGenerator
 from utils.video_generator import VideoGenerator
+from utils.streaming import ParagraphStream
+from utils.pipeline import StoryPipeline
+from utils.checkpoint import CheckpointManifest
+from utils.metrics import run_metrics
+from utils.tracing import tracer, TracedThreadPoolExecutor
+from utils.governor import governor
 
 def parse_arguments():
     """Xử lý tham số dòng lệnh"""
@@ -20,6 +26,18 @@ def parse_arguments():
                         default=DEFAULT_CONFIG['image_model'], help="Model tạo hình ảnh")
     parser.add_argument("--tts_provider", type=str, choices=["google", "openai"],
                         default=DEFAULT_CONFIG['tts_provider'], help="Provider text-to-speech")
+    parser.add_argument("--story_workers", type=int, default=DEFAULT_CONFIG['story_workers'],
+                        help="Số chương truyện được viết đồng thời")
+    parser.add_argument("--stream", action="store_true",
+                        help="Viết truyện ở chế độ stream, tạo audio ngay trên các đoạn văn đã viết xong")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Chạy theo từng chương: ảnh/audio/video của chương bắt đầu ngay khi chương viết xong")
+    parser.add_argument("--render_workers", type=int, default=DEFAULT_CONFIG['render_workers'],
+                        help="Số process render video chương song song")
+    parser.add_argument("--resume", action="store_true",
+                        help="Tiếp tục lần chạy trước: dùng lại các chương, ảnh, audio, video đã tạo trong checkpoint")
+    parser.add_argument("--governor", action="store_true",
+                        help="Giới hạn slot encode/ảnh/TTS dùng chung với các phiên khác trên máy")
     parser.add_argument("--output_dir", type=str, default=DEFAULT_CONFIG['output_dir'],
                         help="Thư mục lưu kết quả")
     parser.add_argument("--skip_story", action="store_true", help="Bỏ qua bước tạo truyện")
@@ -53,6 +71,61 @@ def read_audio_data(output_dir):
             return json.load(f)
     return None
 
+def create_checkpoint(args):
+    """Tạo checkpoint manifest trong thư mục output"""
+    checkpoint = CheckpointManifest(os.path.join(args.output_dir, "checkpoint.jsonl"), resume=args.resume)
+    if args.resume:
+        print(f"Tiếp tục từ checkpoint: {checkpoint.path}")
+    return checkpoint
+
+def run_pipeline(args, checkpoint=None):
+    """Tạo truyện, hình ảnh, audio và video theo pipeline từng chương"""
+    print("\n=== Chạy pipeline theo từng chương ===")
+    normalize_size = None
+    if DEFAULT_CONFIG['normalize_images']:
+        normalize_size = (DEFAULT_CONFIG['video_width'], DEFAULT_CONFIG['video_height'])
+    
+    audio_generator = AudioGenerator(provider=args.tts_provider, checkpoint=checkpoint)
+    pipeline = StoryPipeline(
+        StoryGenerator(max_workers=args.story_workers, checkpoint=checkpoint),
+        ImageGenerator(model_type=args.image_model, normalize_size=normalize_size, checkpoint=checkpoint),
+        audio_generator,
+        VideoGenerator(
+            width=DEFAULT_CONFIG['video_width'],
+            height=DEFAULT_CONFIG['video_height'],
+            render_workers=args.render_workers,
+            checkpoint=checkpoint
+        ),
+        output_dir=args.output_dir,
+        audio_workers=audio_generator.chapter_workers,
+        stream=args.stream
+    )
+    with run_metrics.measure("step.pipeline"):
+        result = pipeline.run(args.story_concept, args.num_chapters, args.tokens_per_chapter)
+    
+    video_data = result["video_data"]
+    if video_data and video_data.get("full_video"):
+        print(f"\nĐã tạo xong video đầy đủ: {video_data['full_video']}")
+    else:
+        print("\nKhông thể tạo video đầy đủ, nhưng có thể đã tạo được video cho một số chương.")
+    
+    return result
+
+def finish_run(args, checkpoint):
+    """Lưu run_metrics.json và trace.json, in bảng thời gian theo bước và số artifact dùng lại từ checkpoint"""
+    metrics_path = run_metrics.save(args.output_dir)
+    trace_path = tracer.export_chrome_trace(os.path.join(args.output_dir, "trace.json"))
+    print("\n=== Thời gian theo từng bước ===")
+    run_metrics.print_summary()
+    print(f"Chi tiết đo đạc đã được lưu vào: {metrics_path}")
+    print(f"Trace đã được lưu vào: {trace_path} (mở bằng https://ui.perfetto.dev)")
+    print_checkpoint_summary(checkpoint)
+
+def print_checkpoint_summary(checkpoint):
+    """In số artifact được dùng lại từ checkpoint"""
+    if checkpoint.resume:
+        print(f"\nĐã dùng lại {checkpoint.reused} artifact từ checkpoint")
+
 def interactive_mode():
     """Chế độ tương tác với người dùng để nhập tham số"""
     print("=== Chương trình tạo tự động truyện và video ===")
@@ -96,6 +169,12 @@ def interactive_mode():
         "image_model": image_model,
         "tts_provider": tts_provider,
         "output_dir": output_dir,
+        "story_workers": DEFAULT_CONFIG['story_workers'],
+        "render_workers": DEFAULT_CONFIG['render_workers'],
+        "stream": False,
+        "pipeline": False,
+        "resume": False,
+        "governor": False,
         "skip_story": False,
         "skip_images": False,
         "skip_audio": False,
@@ -120,25 +199,55 @@ def main():
         args_dict = interactive_mode()
         args = argparse.Namespace(**args_dict)
     
+    if args.governor:
+        governor.set_enabled(True)
+    
     # Tạo thư mục output
     os.makedirs(args.output_dir, exist_ok=True)
     create_directories()
+    checkpoint = create_checkpoint(args)
+    run_metrics.reset()
+    tracer.reset()
+    
+    # Tạo mọi thứ từ đầu: chạy theo pipeline từng chương thay vì bốn bước tuần tự
+    if args.pipeline and not (args.skip_story or args.skip_images or args.skip_audio or args.skip_video):
+        run_pipeline(args, checkpoint)
+        finish_run(args, checkpoint)
+        print("\n=== Hoàn thành! ===")
+        print(f"Tất cả dữ liệu đã được lưu vào thư mục: {os.path.abspath(args.output_dir)}")
+        return
     
     # Các biến lưu dữ liệu giữa các bước
     story_data = None
     story_images = None
     story_audio = None
     
+    # Chế độ stream: audio của mỗi chương bắt đầu ngay trên các đoạn văn đã viết xong
+    audio_executor = None
+    audio_futures = []
+    paragraph_streams = None
+    if args.stream and not args.skip_story and not args.skip_audio:
+        audio_generator = AudioGenerator(provider=args.tts_provider, checkpoint=checkpoint)
+        audio_dir = os.path.join(args.output_dir, "audio")
+        paragraph_streams = {i: ParagraphStream(i) for i in range(1, args.num_chapters + 1)}
+        audio_executor = TracedThreadPoolExecutor(max_workers=args.num_chapters)
+        audio_futures = [
+            audio_executor.submit(audio_generator.process_chapter_stream, stream, chapter_num, audio_dir)
+            for chapter_num, stream in paragraph_streams.items()
+        ]
+    
     # Bước 1: Tạo truyện
     if not args.skip_story:
         print("\n=== Bước 1: Tạo nội dung truyện ===")
-        story_generator = StoryGenerator()
-        story_data = story_generator.generate_full_story(
-            args.story_concept,
-            num_chapters=args.num_chapters,
-            tokens_per_chapter=args.tokens_per_chapter,
-            output_dir=args.output_dir
-        )
+        story_generator = StoryGenerator(max_workers=args.story_workers, checkpoint=checkpoint)
+        with run_metrics.measure("step.story"):
+            story_data = story_generator.generate_full_story(
+                args.story_concept,
+                num_chapters=args.num_chapters,
+                tokens_per_chapter=args.tokens_per_chapter,
+                output_dir=args.output_dir,
+                paragraph_streams=paragraph_streams
+            )
     else:
         print("\n=== Bỏ qua bước tạo truyện ===")
         story_data = read_story_data(args.output_dir)
@@ -149,8 +258,14 @@ def main():
     # Bước 2: Tạo hình ảnh
     if not args.skip_images:
         print("\n=== Bước 2: Tạo hình ảnh minh họa ===")
-        image_generator = ImageGenerator(model_type=args.image_model)
-        story_images = image_generator.process_story(story_data, output_dir=args.output_dir)
+        normalize_size = None
+        if DEFAULT_CONFIG['normalize_images']:
+            normalize_size = (DEFAULT_CONFIG['video_width'], DEFAULT_CONFIG['video_height'])
+        image_generator = ImageGenerator(
+            model_type=args.image_model, normalize_size=normalize_size, checkpoint=checkpoint
+        )
+        with run_metrics.measure("step.images"):
+            story_images = image_generator.process_story(story_data, output_dir=args.output_dir)
     else:
         print("\n=== Bỏ qua bước tạo hình ảnh ===")
         story_images = read_images_data(args.output_dir)
@@ -159,10 +274,18 @@ def main():
             return
     
     # Bước 3: Tạo audio
-    if not args.skip_audio:
+    if audio_executor:
+        print("\n=== Bước 3: Hoàn tất audio đã tạo trong lúc viết truyện ===")
+        with run_metrics.measure("step.audio"):
+            story_audio = audio_generator.save_story_audio(
+                [future.result() for future in audio_futures], output_dir=args.output_dir
+            )
+        audio_executor.shutdown()
+    elif not args.skip_audio:
         print("\n=== Bước 3: Tạo audio từ text ===")
-        audio_generator = AudioGenerator(provider=args.tts_provider)
-        story_audio = audio_generator.process_story(story_data, output_dir=args.output_dir)
+        audio_generator = AudioGenerator(provider=args.tts_provider, checkpoint=checkpoint)
+        with run_metrics.measure("step.audio"):
+            story_audio = audio_generator.process_story(story_data, output_dir=args.output_dir)
     else:
         print("\n=== Bỏ qua bước tạo audio ===")
         story_audio = read_audio_data(args.output_dir)
@@ -174,10 +297,16 @@ def main():
     if not args.skip_video:
         print("\n=== Bước 4: Tạo video từ audio và hình ảnh ===")
         if story_images and story_audio:
-            video_generator = VideoGenerator()
-            video_data = video_generator.create_full_video(
-                story_data, story_images, story_audio, output_dir=args.output_dir
+            video_generator = VideoGenerator(
+                width=DEFAULT_CONFIG['video_width'],
+                height=DEFAULT_CONFIG['video_height'],
+                render_workers=args.render_workers,
+                checkpoint=checkpoint
             )
+            with run_metrics.measure("step.video"):
+                video_data = video_generator.create_full_video(
+                    story_data, story_images, story_audio, output_dir=args.output_dir
+                )
             
             if video_data and video_data.get("full_video"):
                 print(f"\nĐã tạo xong video đầy đủ: {video_data['full_video']}")
@@ -188,6 +317,7 @@ def main():
     else:
         print("\n=== Bỏ qua bước tạo video ===")
     
+    finish_run(args, checkpoint)
     print("\n=== Hoàn thành! ===")
     print(f"Tất cả dữ liệu đã được lưu vào thư mục: {os.path.abspath(args.output_dir)}")
 
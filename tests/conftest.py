@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Test chỉ dùng provider giả lập (không độ trễ) và không đụng tới file slot dùng chung của máy chủ;
+# phải đặt trước khi import utils vì cấu hình được đọc lúc import
+os.environ["PROVIDER_MODE"] = "mock"
+os.environ["MOCK_LATENCY_SCALE"] = "0"
+os.environ["GOVERNOR_ENABLED"] = "false"
+os.environ["GOVERNOR_DB"] = os.path.join(tempfile.mkdtemp(prefix="governor_test_"), "governor.db")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    """Chạy mỗi test trong thư mục tạm để cache/output (đường dẫn tương đối) không ghi vào repo"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def no_rate_limits(monkeypatch):
+    """Provider giả lập không cần chờ theo hạn mức tần suất của API thật"""
+    from utils import rate_limiter
+
+    monkeypatch.setattr(rate_limiter, "RATE_LIMITS", {})
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    for name in rate_limiter.DEFAULT_CONFIG['rate_limits']:
+        rate_limiter.configure_rate_limit(name, None, None)
@@ -0,0 +1,87 @@
+import pytest
+
+from utils.audio_generator import AudioGenerator, TTS_CHUNK_LIMITS
+from utils.streaming import ParagraphStream
+
+
+@pytest.fixture
+def generator():
+    return AudioGenerator(provider="google", use_cache=False)
+
+
+def test_chunks_pack_whole_sentences(generator):
+    text = "Câu một. Câu hai? Câu ba! Câu bốn…"
+    assert generator.split_text_for_tts(text, max_length=20) == ["Câu một. Câu hai?", "Câu ba! Câu bốn…"]
+
+
+def test_closing_quote_stays_with_sentence(generator):
+    text = '"Đi thôi!" Nó nói. Rồi cả hai lên đường.'
+    assert generator.split_text_for_tts(text, max_length=24) == ['"Đi thôi!" Nó nói.', "Rồi cả hai lên đường."]
+
+
+def test_long_sentence_split_at_clause(generator):
+    sentence = "Trời đã tối, gió thổi mạnh qua rặng tre, còn lũ trẻ vẫn chơi ngoài sân"
+    chunks = generator.split_text_for_tts(sentence, max_length=30)
+    assert chunks[0] == "Trời đã tối,"
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert " ".join(chunks).split() == sentence.split()
+
+
+def test_plan_chunks_respects_provider_limit(generator):
+    text = " ".join(f"Đây là câu số {i} trong chương." for i in range(200))
+    plan = generator.plan_chunks(text)
+
+    assert [chunk["index"] for chunk in plan] == list(range(len(plan)))
+    assert all(chunk["chars"] == len(chunk["text"]) <= TTS_CHUNK_LIMITS["google"] for chunk in plan)
+    assert " ".join(chunk["text"] for chunk in plan) == text
+    # Gom tham lam: thêm câu đầu của đoạn sau sẽ vượt giới hạn
+    for chunk, following in zip(plan, plan[1:]):
+        first_sentence = following["text"].split(".")[0] + "."
+        assert chunk["chars"] + 1 + len(first_sentence) > TTS_CHUNK_LIMITS["google"]
+
+
+def test_line_breaks_end_sentences(generator):
+    assert generator.split_text_for_tts("Tiêu đề\nNội dung chương.", max_length=10) == ["Tiêu đề", "Nội dung", "chương."]
+
+
+def story_paragraphs():
+    return [
+        " ".join(f"Đoạn {p}, câu {i} kể về chuyến đi dài của hai chị em." for i in range(p + 1))
+        for p in range(12)
+    ]
+
+
+@pytest.mark.parametrize("max_length", [60, 200, 500])
+def test_streamed_chunks_match_whole_chapter(generator, max_length):
+    paragraphs = story_paragraphs()
+    chapter_text = "\n\n".join(paragraphs)
+    assert list(generator.iter_chunks(iter(paragraphs), max_length)) == generator.plan_chunks(chapter_text, max_length)
+
+
+def test_chunk_emitted_before_stream_ends(generator):
+    stream = ParagraphStream(chapter_num=1)
+    chunks = generator.iter_chunks(stream, max_length=24)
+    stream.put("Câu thứ nhất khá dài.")
+    stream.put("Câu hai.")
+    # Đoạn đầu được chốt ngay khi câu kế tiếp không vừa, không chờ chương viết xong
+    assert next(chunks)["text"] == "Câu thứ nhất khá dài."
+    stream.close()
+    assert [chunk["text"] for chunk in chunks] == ["Câu hai."]
+
+
+def test_streamed_and_whole_chapter_share_segments(tmp_path):
+    generator = AudioGenerator(provider="google", use_cache=False)
+    paragraphs = story_paragraphs()
+    whole = generator.process_chapter("\n\n".join(paragraphs), 1, output_dir=str(tmp_path / "whole"))
+
+    stream = ParagraphStream(chapter_num=1)
+    for paragraph in paragraphs:
+        stream.put(paragraph)
+    stream.close()
+    streamed = generator.process_chapter_stream(stream, 1, output_dir=str(tmp_path / "streamed"))
+
+    # Cùng văn bản từng đoạn audio, nên khóa cache/checkpoint trùng nhau giữa hai cách chạy
+    assert [segment["segment_text"] for segment in streamed["segments"]] == [
+        segment["segment_text"] for segment in whole["segments"]
+    ]
+    assert len(whole["segments"]) == len(generator.plan_chunks("\n\n".join(paragraphs)))
@@ -0,0 +1,86 @@
+import os
+
+from utils.checkpoint import CheckpointManifest
+
+
+def line_count(path):
+    with open(path, encoding="utf-8") as f:
+        return len(f.readlines())
+
+
+def artifact(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b"data")
+    return str(path)
+
+
+def test_resume_reuses_recorded_artifacts(tmp_path):
+    manifest_path = str(tmp_path / "checkpoint.jsonl")
+    image = artifact(tmp_path, "image.png")
+    checkpoint = CheckpointManifest(manifest_path)
+    input_hash = checkpoint.input_hash("ngọn núi")
+    checkpoint.put("images:chapter_1:image_1", input_hash, {"image_path": image}, [image])
+
+    resumed = CheckpointManifest(manifest_path, resume=True)
+    assert resumed.get("images:chapter_1:image_1", input_hash) == {"image_path": image}
+    assert resumed.reused == 1
+    # Đầu vào đổi hoặc file đã bị xóa thì phải tạo lại
+    assert resumed.get("images:chapter_1:image_1", checkpoint.input_hash("dòng sông")) is None
+    os.remove(image)
+    assert resumed.get("images:chapter_1:image_1", input_hash) is None
+
+
+def test_without_resume_nothing_reused(tmp_path):
+    manifest_path = str(tmp_path / "checkpoint.jsonl")
+    CheckpointManifest(manifest_path).put("story:outline", "hash", ["dàn ý"])
+    assert CheckpointManifest(manifest_path).get("story:outline", "hash") is None
+
+
+def test_each_put_appends_one_line(tmp_path):
+    manifest_path = str(tmp_path / "checkpoint.jsonl")
+    checkpoint = CheckpointManifest(manifest_path)
+    for i in range(5):
+        checkpoint.put(f"audio:chapter_1:segment_{i + 1}", "hash", {"duration": i})
+    assert line_count(manifest_path) == 5
+
+
+def test_new_manifest_replaces_old_on_first_put(tmp_path):
+    manifest_path = str(tmp_path / "checkpoint.jsonl")
+    old = CheckpointManifest(manifest_path)
+    old.put("story:chapter_1", "hash", "chương cũ")
+    old.put("story:chapter_2", "hash", "chương cũ")
+
+    # Lần chạy mới chưa tạo xong artifact nào thì checkpoint cũ vẫn còn
+    fresh = CheckpointManifest(manifest_path)
+    assert line_count(manifest_path) == 2
+    fresh.put("story:chapter_1", "hash", "chương mới")
+    resumed = CheckpointManifest(manifest_path, resume=True)
+    assert resumed.get("story:chapter_1", "hash") == "chương mới"
+    assert resumed.get("story:chapter_2", "hash") is None
+
+
+def test_journal_compacted_on_load(tmp_path):
+    manifest_path = str(tmp_path / "checkpoint.jsonl")
+    checkpoint = CheckpointManifest(manifest_path)
+    checkpoint.put("story:outline", "cũ", ["dàn ý cũ"])
+    checkpoint.put("story:outline", "mới", ["dàn ý mới"])
+    checkpoint.put("story:chapter_1", "hash", "chương 1")
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        f.write('{"id": "story:chapter_2", "input_ha')  # dòng bị ngắt giữa chừng
+
+    resumed = CheckpointManifest(manifest_path, resume=True)
+    assert resumed.get("story:outline", "mới") == ["dàn ý mới"]
+    assert resumed.get("story:chapter_1", "hash") == "chương 1"
+    assert line_count(manifest_path) == 2
+
+
+def test_put_after_interrupted_write_is_kept(tmp_path):
+    manifest_path = str(tmp_path / "checkpoint.jsonl")
+    CheckpointManifest(manifest_path).put("story:chapter_1", "hash", "chương 1")
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        f.write('{"id": "story:chapter_2"')  # lần chạy trước dừng giữa lúc ghi
+
+    CheckpointManifest(manifest_path, resume=True).put("story:chapter_2", "hash", "chương 2")
+    resumed = CheckpointManifest(manifest_path, resume=True)
+    assert resumed.get("story:chapter_1", "hash") == "chương 1"
+    assert resumed.get("story:chapter_2", "hash") == "chương 2"
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from utils.duration_probe import DurationProbe
+from utils.mock_providers import make_mp3
+
+
+def write_mp3(path, duration):
+    path.write_bytes(make_mp3(duration))
+    return str(path)
+
+
+def test_duration_read_from_header_and_remembered(tmp_path, monkeypatch):
+    audio = write_mp3(tmp_path / "audio.mp3", 2.0)
+    probe = DurationProbe(str(tmp_path / "index.jsonl"))
+    assert probe.get_duration(audio) == pytest.approx(2.0, abs=0.1)
+
+    # Lần sau (kể cả process mới) lấy từ index, không đọc lại file
+    monkeypatch.setattr("utils.duration_probe.mp3_duration", lambda path: pytest.fail("đo lại file"))
+    assert DurationProbe(str(tmp_path / "index.jsonl")).get_duration(audio) == probe.get_duration(audio)
+
+
+def test_concurrent_writers_keep_each_others_entries(tmp_path):
+    index_path = str(tmp_path / "index.jsonl")
+    first, second = DurationProbe(index_path), DurationProbe(index_path)
+    first.record(write_mp3(tmp_path / "a.mp3", 1.0), 1.0)
+    second.record(write_mp3(tmp_path / "b.mp3", 1.0), 2.0)
+    first.record(write_mp3(tmp_path / "c.mp3", 1.0), 3.0)
+
+    merged = DurationProbe(index_path)
+    assert sorted(merged._index.values()) == [1.0, 2.0, 3.0]
+
+
+def test_record_appends_one_line(tmp_path):
+    index_path = str(tmp_path / "index.jsonl")
+    probe = DurationProbe(index_path)
+    audio = write_mp3(tmp_path / "a.mp3", 1.0)
+    probe.record(audio, 1.0)
+    probe.record(audio, 1.0)  # không đổi thì không ghi lại
+    probe.record(write_mp3(tmp_path / "b.mp3", 1.0), 2.0)
+
+    with open(index_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+
+
+def test_index_compacted_on_load(tmp_path):
+    index_path = str(tmp_path / "index.jsonl")
+    probe = DurationProbe(index_path)
+    kept = write_mp3(tmp_path / "kept.mp3", 1.0)
+    removed = write_mp3(tmp_path / "removed.mp3", 1.0)
+    probe.record(kept, 1.0)
+    probe.record(kept, 1.5)
+    probe.record(removed, 2.0)
+    os.remove(removed)
+
+    assert DurationProbe(index_path)._index == {DurationProbe._index_key(kept): 1.5}
+    with open(index_path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 1
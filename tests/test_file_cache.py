@@ -0,0 +1,131 @@
+import os
+
+from utils.file_cache import FileCache
+
+
+def test_hit_after_put(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"))
+    key = FileCache.make_key("resize", "abc", 1280, 720)
+
+    assert cache.get(key) is None
+    path = cache.put_bytes(key, b"data", suffix=".png")
+    assert path.endswith(".png")
+    assert cache.get(key) == path
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1, "bytes": 4}
+
+
+def test_entries_survive_new_instance(tmp_path):
+    FileCache(str(tmp_path)).put_bytes("key", b"data", suffix=".mp3")
+    cache = FileCache(str(tmp_path))
+    assert cache.get("key") == os.path.join(str(tmp_path), "key.mp3")
+
+
+def test_link_to_gives_caller_own_copy(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"))
+    cache.put_bytes("key", b"data", suffix=".png")
+    dest = cache.link_to("key", str(tmp_path / "frame.jpg"), keep_suffix=True)
+
+    assert dest == str(tmp_path / "frame.png")
+    # Bản của người gọi vẫn còn khi cache dọn entry
+    cache.clear()
+    with open(dest, "rb") as f:
+        assert f.read() == b"data"
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = FileCache(str(tmp_path), max_bytes=12)
+    cache.put_bytes("a", b"x" * 6)
+    cache.put_bytes("b", b"x" * 6)
+    assert cache.get("a")  # "a" mới được dùng, "b" thành entry ít dùng nhất
+
+    cache.put_bytes("c", b"x" * 6)
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert not os.path.exists(os.path.join(str(tmp_path), "b"))
+    assert cache.stats()["bytes"] == 12
+
+
+def test_entry_evicted_by_other_process_is_a_miss(tmp_path):
+    path = FileCache(str(tmp_path)).put_bytes("key", b"data")
+    cache = FileCache(str(tmp_path))
+    os.remove(path)
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_link_to_when_entry_disappears_midway(tmp_path, monkeypatch):
+    cache = FileCache(str(tmp_path / "cache"))
+    cache.put_bytes("key", b"data")
+    real_link = os.link
+
+    def evicted_then_link(src, dst):
+        # Process khác dọn entry ngay sau khi tra cache
+        os.remove(src)
+        real_link(src, dst)
+
+    monkeypatch.setattr(os, "link", evicted_then_link)
+    assert cache.link_to("key", str(tmp_path / "out")) is None
+    assert cache.stats() == {"hits": 0, "misses": 1, "entries": 0, "bytes": 0}
+
+
+def test_entry_written_by_other_process_is_a_hit(tmp_path):
+    cache = FileCache(str(tmp_path))
+    path = FileCache(str(tmp_path)).put_bytes("key", b"data", suffix=".png")
+    assert cache.get("key") == path
+    assert cache.stats() == {"hits": 1, "misses": 0, "entries": 1, "bytes": 4}
+
+
+def test_byte_cap_shared_between_processes(tmp_path):
+    first = FileCache(str(tmp_path), max_bytes=12)
+    second = FileCache(str(tmp_path), max_bytes=12)
+    first.put_bytes("a", b"x" * 6)
+    second.put_bytes("b", b"x" * 6)
+    first.put_bytes("c", b"x" * 6)
+
+    # Mỗi process chỉ ghi 12 byte nhưng cả thư mục vượt giới hạn: entry cũ nhất bị dọn
+    assert sorted(os.listdir(str(tmp_path))) == [FileCache.ACCESS_LOG, "b", "c"]
+    assert first.stats()["bytes"] == 12
+
+
+def test_recency_shared_between_processes(tmp_path):
+    first = FileCache(str(tmp_path), max_bytes=12)
+    first.put_bytes("a", b"x" * 6)
+    first.put_bytes("b", b"x" * 6)
+    assert FileCache(str(tmp_path)).get("a")  # process khác vừa dùng "a"
+
+    first.put_bytes("c", b"x" * 6)
+    assert first.get("b") is None
+    assert first.get("a") and first.get("c")
+
+
+def test_hit_does_not_touch_linked_session_file(tmp_path):
+    cache = FileCache(str(tmp_path / "cache"))
+    cache.put_bytes("key", b"data", suffix=".png")
+    dest = cache.link_to("key", str(tmp_path / "frame.png"))
+    os.utime(dest, (1_000_000, 1_000_000))
+
+    assert cache.get("key")
+    assert cache.link_to("key", str(tmp_path / "other.png"))
+    assert os.stat(dest).st_mtime == 1_000_000
+
+
+def test_access_log_compacted(tmp_path):
+    cache = FileCache(str(tmp_path))
+    cache.put_bytes("key", b"data")
+    for _ in range(100):
+        cache.get("key")
+    cache.put_bytes("other", b"data")
+
+    with open(os.path.join(str(tmp_path), FileCache.ACCESS_LOG), encoding="utf-8") as f:
+        assert f.read().split() == ["key", "other"]
+
+
+def test_recent_tmp_file_of_other_process_kept(tmp_path):
+    writing = tmp_path / "tmpabc.tmp"
+    writing.write_bytes(b"partial")
+    stale = tmp_path / "tmpold.tmp"
+    stale.write_bytes(b"partial")
+    os.utime(stale, (1_000_000, 1_000_000))
+
+    FileCache(str(tmp_path))
+    assert writing.exists() and not stale.exists()
@@ -0,0 +1,91 @@
+import os
+import threading
+
+import pytest
+
+from utils.config import DEFAULT_CONFIG
+from utils.governor import ResourceGovernor, fair_order
+
+
+@pytest.fixture
+def governor(tmp_path):
+    return ResourceGovernor(db_path=str(tmp_path / "governor.db"), slots={"encode": 1}, poll_interval=0.01,
+                            enabled=True)
+
+
+def test_slot_acquire_and_release(governor):
+    with governor.slot("encode"):
+        status = governor.queue_status()["encode"]
+        assert (status["held"], status["session_held"], status["waiting"]) == (1, 1, 0)
+    assert governor.queue_status()["encode"]["held"] == 0
+
+
+def test_released_on_exception(governor):
+    with pytest.raises(RuntimeError):
+        with governor.slot("encode"):
+            raise RuntimeError("render lỗi")
+    assert governor.queue_status()["encode"]["held"] == 0
+
+
+def test_waits_for_free_slot(governor):
+    holding = threading.Event()
+    release = threading.Event()
+    acquired = threading.Event()
+
+    def holder():
+        with governor.slot("encode"):
+            holding.set()
+            release.wait(5)
+
+    def waiter():
+        with governor.slot("encode"):
+            acquired.set()
+
+    threads = [threading.Thread(target=holder)]
+    threads[0].start()
+    assert holding.wait(5)
+    threads.append(threading.Thread(target=waiter))
+    threads[1].start()
+
+    # Hết slot: yêu cầu thứ hai xếp hàng cho đến khi slot được trả
+    assert not acquired.wait(0.3)
+    assert governor.queue_status()["encode"]["waiting"] == 1
+    release.set()
+    assert acquired.wait(5)
+    for thread in threads:
+        thread.join(5)
+    assert governor.queue_status()["encode"] == {
+        "slots": 1, "held": 0, "waiting": 0, "session_held": 0, "session_waiting": 0, "position": None
+    }
+
+
+def test_unlimited_resource_skips_queue(governor):
+    with governor.slot("tts"):
+        assert "tts" not in governor.queue_status()
+
+
+def test_disabled_governor_does_not_touch_db(tmp_path):
+    db_path = tmp_path / "governor.db"
+    governor = ResourceGovernor(db_path=str(db_path), slots={"encode": 1}, enabled=False)
+    with governor.slot("encode"):
+        with governor.slot("encode"):
+            pass
+    assert not os.path.exists(db_path)
+
+
+def test_fair_order_alternates_sessions():
+    waiting = [(1, "a"), (2, "a"), (3, "a"), (4, "b"), (5, "c")]
+    # Phiên a đang giữ một slot nên các phiên b, c được cấp trước
+    assert fair_order(waiting, {"a": 1}) == [4, 5, 1, 2, 3]
+    assert fair_order(waiting, {}) == [1, 4, 5, 2, 3]
+
+
+@pytest.mark.parametrize("configured, default, server", [(None, False, True), (True, True, True),
+                                                         (False, False, False)])
+def test_enabled_by_default_only_for_server(tmp_path, monkeypatch, configured, default, server):
+    monkeypatch.setitem(DEFAULT_CONFIG, "governor_enabled", configured)
+    governor = ResourceGovernor(db_path=str(tmp_path / "governor.db"))
+    # CLI không giới hạn trừ khi bật rõ ràng; Streamlit và job chạy nền thì có
+    assert governor.enabled is default
+    governor.enable_for_server()
+    assert governor.enabled is server
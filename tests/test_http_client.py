@@ -0,0 +1,90 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from utils import mock_providers
+from utils.http_client import HttpClient, should_retry_error, should_retry_status
+from utils.mock_providers import MOCK_PROFILES, MockProviderServer
+
+STABILITY_PATH = "/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image"
+
+
+@pytest.fixture
+def server():
+    server = MockProviderServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client():
+    return HttpClient(max_retries=2, backoff_base=0.001, backoff_max=0.001)
+
+
+def set_profile(monkeypatch, provider, **settings):
+    profile = {"latency": 0.0, "latency_sigma": 0.0, "error_rate": 0.0, "rate_limit_rate": 0.0}
+    profile.update(settings)
+    monkeypatch.setitem(MOCK_PROFILES, provider, profile)
+
+
+def request_count(server, route):
+    return server.requests.get(route, {}).get("count", 0)
+
+
+def test_get_retries_server_errors(server, client, monkeypatch):
+    set_profile(monkeypatch, "image_download", error_rate=1.0)
+    response = client.get(f"{server.url}/files/1.png")
+    assert response.status_code == 500
+    assert request_count(server, "files") == 3
+
+
+def test_post_does_not_retry_server_errors(server, client, monkeypatch):
+    # 5xx có thể đến sau khi ảnh đã được tạo (và tính phí): gửi lại sẽ tạo ảnh thứ hai
+    set_profile(monkeypatch, "stability", error_rate=1.0)
+    response = client.post(f"{server.url}{STABILITY_PATH}", json={"text_prompts": [{"text": "núi"}]})
+    assert response.status_code == 500
+    assert request_count(server, "stability") == 1
+
+
+def test_post_retries_rate_limit(server, client, monkeypatch):
+    set_profile(monkeypatch, "stability", rate_limit_rate=1.0)
+    response = client.post(f"{server.url}{STABILITY_PATH}", json={"text_prompts": [{"text": "núi"}]})
+    assert response.status_code == 429
+    assert request_count(server, "stability") == 3
+
+
+def test_post_succeeds_without_retry(server, client, monkeypatch):
+    set_profile(monkeypatch, "stability")
+    response = client.post(f"{server.url}{STABILITY_PATH}", json={"text_prompts": [{"text": "núi"}]})
+    assert response.status_code == 200
+    assert response.json()["artifacts"]
+
+
+def test_read_timeout_retried_only_for_get(server, client, monkeypatch):
+    monkeypatch.setattr(mock_providers, "MOCK_LATENCY_SCALE", 1.0)
+    set_profile(monkeypatch, "image_download", latency=0.5)
+    set_profile(monkeypatch, "stability", latency=0.5)
+
+    with pytest.raises(requests.ReadTimeout):
+        client.get(f"{server.url}/files/1.png", timeout=(5, 0.1))
+    assert request_count(server, "files") == 3
+
+    with pytest.raises(requests.ReadTimeout):
+        client.post(f"{server.url}{STABILITY_PATH}", json={}, timeout=(5, 0.1))
+    assert request_count(server, "stability") == 1
+
+
+def test_retry_policy_by_method():
+    not_sent = requests.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "refused")))
+    dropped = requests.ConnectionError(ProtocolError("Connection aborted."))
+
+    for error in (requests.ConnectTimeout(), not_sent):
+        assert should_retry_error("POST", error)
+    for error in (requests.ReadTimeout(), dropped):
+        assert not should_retry_error("POST", error)
+        assert should_retry_error("GET", error)
+
+    assert should_retry_status("POST", 429)
+    assert not should_retry_status("POST", 503)
+    assert should_retry_status("GET", 503)
+    assert not should_retry_status("GET", 404)
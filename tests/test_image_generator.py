@@ -0,0 +1,163 @@
+import json
+import threading
+
+import pytest
+
+from utils.config import DEFAULT_CONFIG
+from utils.file_cache import FileCache
+from utils.image_generator import ImageGenerator
+
+
+@pytest.fixture
+def generator(no_rate_limits):
+    return ImageGenerator(model_type="gemini", use_cache=False)
+
+
+def batch_response(*indexes, fenced=True):
+    items = [{"index": index, "subject": f"chủ thể {index}", "lighting": "hoàng hôn"} for index in indexes]
+    text = json.dumps(items, ensure_ascii=False)
+    return f"Đây là kết quả:\n```json\n{text}\n```" if fenced else text
+
+
+def test_batch_response_parsed_by_index(generator, monkeypatch):
+    # Phản hồi bỏ sót đoạn 2, có index ngoài batch và sai thứ tự
+    monkeypatch.setattr(generator, "_prompt_model_text", lambda *args, **kwargs: batch_response(3, 7, 1))
+    prompts = generator.generate_structured_prompts_batch(["đoạn một", "đoạn hai", "đoạn ba"])
+
+    assert prompts[1] is None
+    assert "Subject: chủ thể 1\nLighting: hoàng hôn" in prompts[0]
+    assert "Subject: chủ thể 3" in prompts[2]
+    assert prompts[0].startswith("Create a detailed illustration for this scene:")
+
+
+def test_batch_failure_falls_back_to_single_prompts(generator, monkeypatch):
+    def broken(stage, prompt, **kwargs):
+        if stage == "image.prompt_batch":
+            return "không phải JSON"
+        return "Subject: ngọn núi"
+
+    monkeypatch.setattr(generator, "_prompt_model_text", broken)
+    monkeypatch.setattr(generator, "_plan_chapter_images", lambda text, num: [("đoạn một", None), ("đoạn hai", None)])
+    assert generator.generate_structured_prompts_batch(["đoạn một", "đoạn hai"]) == [None, None]
+
+    images = generator.process_chapter("nội dung", 1, output_dir="images")
+    assert [image["prompt"].split("\n")[0] for image in images] == [
+        "Create a detailed illustration for this scene: Subject: ngọn núi"
+    ] * 2
+
+
+def test_batch_size_from_output_token_budget(generator, monkeypatch):
+    monkeypatch.setitem(DEFAULT_CONFIG, "prompt_batch_output_tokens", 2000)
+    monkeypatch.setitem(DEFAULT_CONFIG, "prompt_tokens_per_image", 500)
+    assert generator.prompt_batch_size() == 4
+
+    requests = []
+    monkeypatch.setattr(generator, "_request_prompt_batch", lambda batch, num: requests.append(batch) or [None] * len(batch))
+    generator.generate_structured_prompts_batch([f"đoạn {i}" for i in range(10)])
+    assert [len(batch) for batch in requests] == [4, 4, 2]
+
+    monkeypatch.setitem(DEFAULT_CONFIG, "prompt_tokens_per_image", 5000)
+    assert generator.prompt_batch_size() == 1
+
+
+def test_images_start_before_other_batches_return(generator, monkeypatch):
+    monkeypatch.setitem(DEFAULT_CONFIG, "prompt_batch_output_tokens", 1000)
+    monkeypatch.setitem(DEFAULT_CONFIG, "prompt_tokens_per_image", 500)
+    monkeypatch.setattr(generator, "_plan_chapter_images", lambda text, num: [(f"đoạn {i}", None) for i in range(4)])
+
+    first_image_started = threading.Event()
+    started_before_last_batch = []
+
+    def request_batch(batch, chapter_num):
+        if batch[0] != "đoạn 0":
+            # Batch sau chỉ trả về khi ảnh của batch đầu đã bắt đầu tạo
+            started_before_last_batch.append(first_image_started.wait(5))
+        return [f"prompt {segment}" for segment in batch]
+
+    def generate_job(segment_text, chapter_num, output_path, prompt=None):
+        first_image_started.set()
+        return prompt, output_path
+
+    monkeypatch.setattr(generator, "_request_prompt_batch", request_batch)
+    monkeypatch.setattr(generator, "_generate_image_job", generate_job)
+    monkeypatch.setattr("utils.image_generator.detect_image_file_format", lambda path: "png")
+
+    images = generator.process_chapter("nội dung", 1, output_dir="images")
+    assert started_before_last_batch == [True]
+    assert [image["prompt"] for image in images] == [f"prompt đoạn {i}" for i in range(4)]
+
+
+def test_process_chapter_with_mock_provider(generator):
+    text = " ".join(["Lan đi qua cánh đồng lúa chín vàng dưới nắng chiều."] * 40)
+    images = generator.process_chapter(text, 1, output_dir="images")
+    assert images and all(image["prompt"] and image["image_path"] for image in images)
+
+
+def test_cache_key_covers_everything_that_changes_the_image(generator, monkeypatch):
+    key = generator._cache_key("ngọn núi")
+    assert generator._cache_key("ngọn núi") == key
+    assert generator._cache_key("dòng sông") != key
+
+    variants = [("image_format", "webp"), ("image_quality", 50), ("model_params", {"model": "khác"})]
+    for attr, value in variants:
+        with monkeypatch.context() as patch:
+            patch.setattr(generator, attr, value)
+            assert generator._cache_key("ngọn núi") != key, attr
+
+    # Ảnh do provider giả lập tạo không được dùng lại ở chế độ live
+    monkeypatch.setattr("utils.image_generator.get_provider_mode", lambda: "live")
+    assert generator._cache_key("ngọn núi") != key
+
+
+def test_generate_image_reuses_cached_image(generator, tmp_path, monkeypatch):
+    generator.cache = FileCache(str(tmp_path / "cache"))
+    calls = []
+    real_generate = generator.generate_image_gemini
+
+    def counted(prompt, output_path):
+        calls.append(prompt)
+        return real_generate(prompt, output_path)
+
+    monkeypatch.setattr(generator, "generate_image_gemini", counted)
+    first = generator.generate_image("ngọn núi", str(tmp_path / "first.png"))
+    second = generator.generate_image("ngọn núi", str(tmp_path / "second.png"))
+    assert calls == ["ngọn núi"]
+    with open(first, "rb") as a, open(second, "rb") as b:
+        assert a.read() == b.read()
+
+    generator.generate_image("ngọn núi", str(tmp_path / "third.png"), force_regenerate=True)
+    generator.generate_image("dòng sông", str(tmp_path / "fourth.png"))
+    assert calls == ["ngọn núi", "ngọn núi", "dòng sông"]
+
+
+class RecordingCheckpoint:
+    """Checkpoint giả ghi lại mọi lần put"""
+
+    resume = False
+
+    def __init__(self):
+        self.puts = []
+
+    def input_hash(self, *parts):
+        return "hash"
+
+    def get(self, artifact_id, input_hash):
+        return None
+
+    def put(self, artifact_id, input_hash, data, paths=()):
+        self.puts.append((artifact_id, data, list(paths)))
+
+
+def test_each_image_recorded_once_after_normalization(no_rate_limits, monkeypatch):
+    checkpoint = RecordingCheckpoint()
+    generator = ImageGenerator(model_type="gemini", use_cache=False, normalize_size=(320, 180), checkpoint=checkpoint)
+    monkeypatch.setattr(generator, "_plan_chapter_images", lambda text, num: [(f"đoạn {i}", None) for i in range(3)])
+    monkeypatch.setattr(generator, "_request_prompt_batch", lambda batch, num: [f"prompt {s}" for s in batch])
+
+    images = generator.process_chapter("nội dung", 2, output_dir="images")
+
+    assert sorted(artifact_id for artifact_id, _, _ in checkpoint.puts) == [
+        f"images:chapter_2:image_{i}" for i in range(1, 4)
+    ]
+    assert all(data["normalized_path"] and data["normalized_path"] in paths for _, data, paths in checkpoint.puts)
+    assert [image["image_path"] for image in images] == [f"images/chapter_2_image_{i}.png" for i in range(1, 4)]
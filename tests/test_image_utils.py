@@ -0,0 +1,28 @@
+from io import BytesIO
+
+from PIL import Image
+
+from utils.image_utils import detect_image_file_format, save_image_bytes
+from utils.mock_providers import make_png
+
+
+def jpeg_bytes():
+    buffer = BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def test_provider_bytes_kept_under_requested_name(tmp_path):
+    requested = str(tmp_path / "chapter_1_image_1.png")
+    path, image_format = save_image_bytes(jpeg_bytes(), requested)
+
+    # Ảnh JPEG của provider được ghi nguyên vẹn, tên file vẫn là chapter_N_image_M.png
+    assert (path, image_format) == (requested, "jpeg")
+    with open(path, "rb") as f:
+        assert f.read() == jpeg_bytes()
+
+
+def test_target_format_reencodes_and_renames(tmp_path):
+    path, image_format = save_image_bytes(make_png(8, 8), str(tmp_path / "chapter_1_image_1.png"), "webp")
+    assert (path, image_format) == (str(tmp_path / "chapter_1_image_1.webp"), "webp")
+    assert detect_image_file_format(path) == "webp"
@@ -0,0 +1,76 @@
+import os
+import time
+
+import pytest
+
+from utils.job_runner import JobRunner, ACTIVE_STATUSES, FAILED, RUNNING
+from utils.process_utils import pid_alive
+
+SESSION_ID = "0" * 32
+
+
+def wait_for(runner, job_id, predicate, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = runner.get(job_id)
+        if predicate(job):
+            return job
+        time.sleep(0.2)
+    pytest.fail(f"Job {job_id} không đạt trạng thái mong đợi: {runner.get(job_id)}")
+
+
+def test_unknown_kind_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        JobRunner(str(tmp_path / "jobs.db")).submit("unknown", {})
+
+
+def test_cancel_running_job(tmp_path, monkeypatch):
+    # Provider ảnh giả lập chạy chậm để job còn đang chạy lúc bị hủy
+    monkeypatch.setenv("MOCK_LATENCY_SCALE", "100")
+    runner = JobRunner(str(tmp_path / "jobs.db"))
+    job_id = runner.submit("image", {
+        "model_type": "gemini",
+        "prompt": "ngọn núi",
+        "output_path": str(tmp_path / "image.png")
+    }, session_id=SESSION_ID, tag="image")
+
+    job = wait_for(runner, job_id, lambda job: job["status"] == RUNNING)
+    assert runner.latest(SESSION_ID, "image")["id"] == job_id
+
+    assert runner.cancel(job_id)
+    job = runner.get(job_id)
+    assert (job["status"], job["error"]) == (FAILED, "Đã hủy")
+    assert not pid_alive(job["pid"])
+    # Job đã kết thúc thì không hủy lại
+    assert not runner.cancel(job_id)
+
+
+def test_job_result_recorded(tmp_path):
+    runner = JobRunner(str(tmp_path / "jobs.db"))
+    output_path = str(tmp_path / "image.png")
+    job_id = runner.submit("image", {"model_type": "gemini", "prompt": "dòng sông", "output_path": output_path})
+
+    job = wait_for(runner, job_id, lambda job: job["status"] not in ACTIVE_STATUSES)
+    assert job["status"] == "done", job["error"]
+    assert job["result"]["prompt"] == "dòng sông"
+    assert job["result"]["image_path"].startswith(str(tmp_path))
+
+
+def test_exited_worker_dropped(tmp_path):
+    runner = JobRunner(str(tmp_path / "jobs.db"))
+    job_id = runner.submit("image", {
+        "model_type": "gemini",
+        "prompt": "cánh đồng",
+        "output_path": str(tmp_path / "image.png")
+    })
+    wait_for(runner, job_id, lambda job: job["status"] not in ACTIVE_STATUSES)
+    runner._workers[job_id].wait(30)
+    # Đọc lại job sau khi process worker thoát thì runner không còn giữ nó
+    runner.get(job_id)
+    assert job_id not in runner._workers
+
+
+def test_default_jobs_db_is_absolute():
+    from utils.config import DEFAULT_CONFIG
+
+    assert os.path.isabs(DEFAULT_CONFIG['jobs_db'])
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from utils.metrics import RunMetrics, file_size, text_size
+from utils.tracing import tracer
+
+
+@pytest.fixture
+def metrics():
+    tracer.reset()
+    return RunMetrics()
+
+
+def test_measure_records_bytes_and_attributes(metrics):
+    with metrics.measure("image.generate", "image_1.png", bytes_in=text_size("núi"), provider="gemini") as event:
+        event["bytes_out"] = 2048
+
+    (recorded,) = metrics.drain()
+    assert recorded["stage"] == "image.generate" and recorded["name"] == "image_1.png"
+    assert (recorded["bytes_in"], recorded["bytes_out"], recorded["provider"]) == (len("núi".encode()), 2048, "gemini")
+    assert recorded["error"] is None
+    assert recorded["end"] == pytest.approx(recorded["start"] + recorded["duration_s"])
+    assert metrics.drain() == []
+
+
+def test_exception_recorded_and_reraised(metrics):
+    with pytest.raises(ValueError):
+        with metrics.measure("audio.tts"):
+            raise ValueError("hết hạn mức")
+    assert metrics.summary()["audio.tts"]["errors"] == 1
+    assert metrics.drain()[0]["error"] == "ValueError: hết hạn mức"
+
+
+def test_retries_counted_for_current_step(metrics):
+    with metrics.measure("image.generate"):
+        metrics.note_retry()
+        metrics.note_retry()
+    metrics.note_retry()  # ngoài bước đo: không tính vào đâu
+    assert metrics.summary()["image.generate"]["retries"] == 2
+
+
+def test_summary_aggregates_per_stage(metrics):
+    events = [
+        {"stage": "audio.tts", "start": 0.0, "end": 2.0, "duration_s": 2.0},
+        {"stage": "audio.tts", "start": 1.0, "end": 4.0, "duration_s": 3.0},
+        {"stage": "video.encode", "start": 4.0, "end": 14.0, "duration_s": 10.0}
+    ]
+    metrics.merge([dict(event, bytes_in=10, bytes_out=5, retries=0, error=None) for event in events])
+
+    summary = metrics.summary()
+    assert list(summary) == ["video.encode", "audio.tts"]  # sắp theo tổng thời gian
+    tts = summary["audio.tts"]
+    assert (tts["count"], tts["total_s"], tts["span_s"], tts["mean_s"], tts["max_s"]) == (2, 5.0, 4.0, 2.5, 3.0)
+    assert (tts["bytes_in"], tts["bytes_out"]) == (20, 10)
+
+
+def test_events_from_other_process_merged(metrics):
+    child = RunMetrics()
+    with child.measure("video.encode", "chapter_1"):
+        pass
+    metrics.merge(child.drain())
+    assert metrics.summary()["video.encode"]["count"] == 1
+
+
+def test_save_writes_run_metrics(metrics, tmp_path):
+    with metrics.measure("story.chapter", "chapter_1"):
+        pass
+    path = metrics.save(str(tmp_path / "output"))
+    with open(path, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["stages"]["story.chapter"]["count"] == 1
+    assert [event["name"] for event in saved["events"]] == ["chapter_1"]
+
+
+def test_sizes_of_missing_values():
+    assert text_size(None) == 0 and text_size("ă") == 2
+    assert file_size(None) == 0 and file_size("không_có.mp3") == 0
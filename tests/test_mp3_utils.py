@@ -0,0 +1,69 @@
+import math
+import struct
+
+import pytest
+
+from utils.mock_providers import make_mp3
+from utils.mp3_utils import parse_frame_header, mp3_duration, concat_mp3_files
+
+# Frame MPEG-1 Layer III, 128 kbps, 44.1 kHz, mono (cùng loại frame với make_mp3)
+FRAME_HEADER = b"\xff\xfb\x90\xc4"
+FRAME_LENGTH = 417
+FRAME_SECONDS = 1152 / 44100
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_parse_frame_header():
+    info = parse_frame_header(FRAME_HEADER)
+    assert info == {
+        "version": 1,
+        "layer": 3,
+        "bitrate": 128000,
+        "sample_rate": 44100,
+        "channels": 1,
+        "samples": 1152,
+        "frame_length": FRAME_LENGTH
+    }
+
+
+@pytest.mark.parametrize("header", [b"\x00\x00\x00\x00", b"\xff\xfb\xf0\xc4", b"\xff\xfb\x9c\xc4", b"\xff\xfb"])
+def test_parse_frame_header_rejects_invalid(header):
+    # Không có sync word, bitrate index 15, sample rate index 3, header bị cắt
+    assert parse_frame_header(header) is None
+
+
+def test_duration_from_frame_headers(tmp_path):
+    path = write(tmp_path / "audio.mp3", make_mp3(2.0))
+    frames = math.ceil(2.0 / FRAME_SECONDS)
+    assert mp3_duration(path) == pytest.approx(frames * FRAME_SECONDS)
+
+
+def test_duration_skips_id3v2_tag(tmp_path):
+    # Tag ID3v2.3 dài 100 byte (kích thước dạng synchsafe)
+    tag = b"ID3\x03\x00\x00" + bytes([0, 0, 0, 100]) + b"\x00" * 100
+    path = write(tmp_path / "tagged.mp3", tag + make_mp3(1.0))
+    assert mp3_duration(path) == pytest.approx(math.ceil(1.0 / FRAME_SECONDS) * FRAME_SECONDS)
+
+
+def test_duration_from_xing_header(tmp_path):
+    # Side info của MPEG-1 mono dài 17 byte, header Xing nằm ngay sau
+    xing = b"Xing" + struct.pack(">II", 0x1, 1000)
+    first_frame = FRAME_HEADER + b"\x00" * 17 + xing
+    first_frame += b"\x00" * (FRAME_LENGTH - len(first_frame))
+    path = write(tmp_path / "vbr.mp3", first_frame + make_mp3(0.1))
+    assert mp3_duration(path) == pytest.approx(1000 * FRAME_SECONDS)
+
+
+def test_duration_of_non_mp3(tmp_path):
+    assert mp3_duration(write(tmp_path / "not.mp3", b"RIFF" + b"\x00" * 100)) is None
+
+
+def test_concat_keeps_every_frame(tmp_path):
+    first = write(tmp_path / "a.mp3", make_mp3(1.0))
+    second = write(tmp_path / "b.mp3", make_mp3(0.5))
+    output = concat_mp3_files([first, second], str(tmp_path / "full.mp3"))
+    assert mp3_duration(output) == pytest.approx(mp3_duration(first) + mp3_duration(second))
@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.audio_generator import AudioGenerator
+from utils.ffmpeg_utils import ffmpeg_available, ffprobe_available
+from utils.image_generator import ImageGenerator
+from utils.pipeline import StoryPipeline
+from utils.story_generator import StoryGenerator
+from utils.video_generator import VideoGenerator
+
+
+class FakeVideoGenerator:
+    """Bước render giả: ghi lại chương nào được render và với ảnh/audio nào"""
+
+    def __init__(self):
+        self.rendered = {}
+        self._lock = threading.Lock()
+
+    def create_render_executor(self):
+        return ThreadPoolExecutor(max_workers=1)
+
+    def submit_chapter_render(self, executor, chapter, story_images, story_audio, videos_dir):
+        chapter_num = chapter["chapter_num"]
+        with self._lock:
+            self.rendered[chapter_num] = (story_images, story_audio)
+        return executor.submit(os.path.join, videos_dir, f"chapter_{chapter_num}.mp4")
+
+    def concat_chapter_videos(self, chapters, video_paths, output_dir="output"):
+        return {"chapter_videos": video_paths, "full_video": None}
+
+
+def make_pipeline(video_generator, stream=False):
+    return StoryPipeline(
+        StoryGenerator(max_workers=2),
+        ImageGenerator(model_type="gemini", use_cache=False),
+        AudioGenerator(provider="google", use_cache=False),
+        video_generator,
+        output_dir="output",
+        stream=stream
+    )
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_each_chapter_rendered_from_its_own_images_and_audio(no_rate_limits, stream):
+    video_generator = FakeVideoGenerator()
+    events = []
+    result = make_pipeline(video_generator, stream).run("Cô bé và con mèo", 2, 150,
+                                                        on_event=lambda *event: events.append(event))
+
+    assert [chapter["chapter_num"] for chapter in result["story_data"]["chapters"]] == [1, 2]
+    for chapter_num in (1, 2):
+        images, audio = video_generator.rendered[chapter_num]
+        assert images[0]["chapter_num"] == audio[0]["chapter_num"] == chapter_num
+        assert images[0]["images"] and audio[0]["full_audio"]
+        assert ("video", chapter_num, "xong", os.path.join("output", "videos", f"chapter_{chapter_num}.mp4")) in events
+
+    # Các file JSON kết quả giống luồng tuần tự
+    with open(os.path.join("output", "images_data.json"), encoding="utf-8") as f:
+        assert json.load(f) == result["story_images"]
+    with open(os.path.join("output", "audio_data.json"), encoding="utf-8") as f:
+        assert json.load(f) == result["story_audio"]
+
+
+def test_chapter_without_images_skips_render(no_rate_limits, monkeypatch):
+    video_generator = FakeVideoGenerator()
+    pipeline = make_pipeline(video_generator)
+    real_process = pipeline.image_generator.process_story_chapter
+
+    def fail_chapter_two(chapter, images_dir):
+        if chapter["chapter_num"] == 2:
+            raise RuntimeError("provider ảnh lỗi")
+        return real_process(chapter, images_dir)
+
+    monkeypatch.setattr(pipeline.image_generator, "process_story_chapter", fail_chapter_two)
+    events = []
+    result = pipeline.run("Cô bé và con mèo", 2, 150, on_event=lambda *event: events.append(event))
+
+    assert sorted(video_generator.rendered) == [1]
+    assert ("video", 2, "bỏ qua", "thiếu ảnh hoặc audio") in events
+    assert result["story_images"][1] == {"chapter_num": 2, "images": []}
+
+
+@pytest.mark.skipif(not (ffmpeg_available() and ffprobe_available()), reason="cần ffmpeg và ffprobe trong PATH")
+def test_pipeline_renders_full_video(no_rate_limits):
+    video_generator = VideoGenerator(width=320, height=180, fps=10)
+    result = make_pipeline(video_generator).run("Cô bé và con mèo", 2, 150, on_event=lambda *event: None)
+
+    video_data = result["video_data"]
+    assert [video["chapter_num"] for video in video_data["chapter_videos"]] == [1, 2]
+    assert os.path.getsize(video_data["full_video"]) > 0
@@ -0,0 +1,94 @@
+import pytest
+
+from utils import rate_limiter
+from utils.rate_limiter import (TokenBucket, UnlimitedBucket, configure_rate_limit, get_rate_limiter,
+                                parse_rate_limit)
+
+
+class FakeClock:
+    """Đồng hồ giả: time.sleep chỉ cộng thời gian, không chờ thật"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        # Thời gian chờ rất nhỏ (sai số làm tròn) vẫn phải làm đồng hồ tiến lên
+        self.now += max(seconds, 1e-9)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limiter.time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.mark.parametrize("value", ["60/60", "5/1", "1000/60", "2/10", "3"])
+def test_parsed_bucket_never_exceeds_limit(value):
+    rate, capacity = parse_rate_limit(value)
+    count, _, period = value.partition("/")
+    assert capacity >= 1
+    assert capacity + rate * float(period or 1) <= int(count)
+
+
+def test_single_request_per_period():
+    assert parse_rate_limit("1/10") == (0.1, 1)
+
+
+@pytest.mark.parametrize("value", [None, "", "0", "none", " None "])
+def test_unlimited_values(value):
+    assert parse_rate_limit(value) is None
+
+
+@pytest.mark.parametrize("value", ["abc", "-5/60", "5/0", "5/x"])
+def test_invalid_values_rejected(value):
+    with pytest.raises(ValueError):
+        parse_rate_limit(value)
+
+
+def test_bucket_allows_burst_then_waits(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+
+    bucket.acquire()
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_bucket_refill_capped_at_capacity(clock):
+    bucket = TokenBucket(rate=1.0, capacity=2)
+    bucket.acquire(2)
+    clock.now += 100
+    bucket.acquire(2)
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_requests_in_window_within_limit(clock):
+    rate, capacity = parse_rate_limit("10/5")
+    bucket = TokenBucket(rate, capacity)
+    times = []
+    for _ in range(30):
+        bucket.acquire()
+        times.append(clock.now)
+    # Không có cửa sổ 5 giây nào chứa quá 10 request
+    assert all(sum(start <= t < start + 5 for t in times) <= 10 for start in times)
+
+
+def test_configured_limiters_shared(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMITS", {})
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    monkeypatch.setitem(rate_limiter.DEFAULT_CONFIG, "rate_limits", {"stability": "150/10", "broken": "x/y"})
+
+    assert get_rate_limiter("stability") is get_rate_limiter("stability")
+    assert isinstance(get_rate_limiter("stability"), TokenBucket)
+    assert isinstance(get_rate_limiter("broken"), UnlimitedBucket)
+    configure_rate_limit("stability", None, None)
+    assert isinstance(get_rate_limiter("stability"), UnlimitedBucket)
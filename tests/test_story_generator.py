@@ -0,0 +1,80 @@
+import json
+import threading
+
+import pytest
+
+from utils.streaming import ParagraphStream
+from utils.story_generator import StoryGenerator
+
+
+@pytest.fixture
+def generator(no_rate_limits):
+    return StoryGenerator(max_workers=3)
+
+
+def test_outline_covers_every_chapter(generator):
+    outline = generator.generate_outline("Cô bé và con mèo", 3)
+    assert [item["chapter_num"] for item in outline] == [1, 2, 3]
+    assert all(item["summary"] for item in outline)
+
+
+def test_incomplete_outline_rejected(generator, monkeypatch):
+    response = json.dumps([{"chapter_num": 1, "summary": "Mở đầu"}, {"chapter_num": 3, "summary": "Kết"}])
+    monkeypatch.setattr(generator.model, "generate_content",
+                        lambda prompt, **kwargs: type("Response", (), {"text": f"```json\n{response}\n```"}))
+    assert generator.generate_outline("Cô bé và con mèo", 3) is None
+
+
+def test_chapters_written_concurrently_from_outline(generator, monkeypatch):
+    # Cả 3 chương phải cùng đang được viết thì barrier mới mở
+    barrier = threading.Barrier(3, timeout=5)
+    prompts = {}
+
+    def write(story_concept, chapter_num, total_chapters, max_tokens=800, outline=None, paragraph_stream=None):
+        prompts[chapter_num] = outline[chapter_num - 1]["summary"]
+        barrier.wait()
+        return f"Nội dung chương {chapter_num}"
+
+    monkeypatch.setattr(generator, "generate_chapter", write)
+    finished = []
+    story = generator.generate_full_story("Cô bé và con mèo", num_chapters=3, output_dir="story",
+                                          on_chapter=lambda chapter: finished.append(chapter["chapter_num"]))
+
+    assert [chapter["content"] for chapter in story["chapters"]] == [f"Nội dung chương {i}" for i in (1, 2, 3)]
+    assert sorted(finished) == [1, 2, 3]
+    assert all(prompts[i] for i in (1, 2, 3))
+    with open("story/story_data.json", encoding="utf-8") as f:
+        assert json.load(f)["chapters"] == story["chapters"]
+
+
+def test_falls_back_to_sequential_without_outline(generator, monkeypatch):
+    monkeypatch.setattr(generator, "generate_outline", lambda concept, num: None)
+    written = []
+
+    def write(story_concept, chapter_num, total_chapters, max_tokens=800, outline=None, paragraph_stream=None):
+        assert outline is None
+        written.append(chapter_num)
+        return f"Nội dung chương {chapter_num}"
+
+    monkeypatch.setattr(generator, "generate_chapter", write)
+    story = generator.generate_full_story("Cô bé và con mèo", num_chapters=3, output_dir="story")
+    assert written == [1, 2, 3]
+    assert [chapter["chapter_num"] for chapter in story["chapters"]] == [1, 2, 3]
+
+
+def test_streams_closed_when_chapter_fails(generator, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("model lỗi")
+
+    monkeypatch.setattr(generator, "generate_chapter", fail)
+    streams = {i: ParagraphStream(chapter_num=i) for i in (1, 2)}
+    with pytest.raises(RuntimeError):
+        generator.generate_full_story("Cô bé và con mèo", num_chapters=2, output_dir="story", paragraph_streams=streams)
+    assert all(stream.closed for stream in streams.values())
+
+
+def test_streamed_chapter_matches_text(generator):
+    stream = ParagraphStream(chapter_num=1)
+    story = generator.generate_full_story("Cô bé và con mèo", num_chapters=1, tokens_per_chapter=200,
+                                          output_dir="story", paragraph_streams={1: stream})
+    assert " ".join(stream) == " ".join(story["chapters"][0]["content"].split())
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from utils.streaming import split_paragraphs, ParagraphStream
+
+
+def test_split_paragraphs_keeps_unfinished_tail():
+    assert split_paragraphs("Đoạn một.\n\nĐoạn hai.\n  \nĐoạn ba đang") == (["Đoạn một.", "Đoạn hai."], "Đoạn ba đang")
+
+
+def test_split_paragraphs_skips_empty_paragraphs():
+    assert split_paragraphs("\n\n  \n\nMột.\n\n\n\n") == (["Một."], "")
+
+
+def test_split_paragraphs_without_break():
+    assert split_paragraphs("Một dòng\nvẫn cùng đoạn") == ([], "Một dòng\nvẫn cùng đoạn")
+
+
+def test_stream_delivers_paragraphs_while_writing():
+    stream = ParagraphStream(chapter_num=1)
+    received = []
+    first_read = threading.Event()
+
+    def reader():
+        for paragraph in stream:
+            received.append(paragraph)
+            first_read.set()
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    stream.put("Một.")
+    # Người đọc nhận được đoạn đầu trước khi chương viết xong
+    assert first_read.wait(5)
+    stream.put("Hai.")
+    stream.close()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert received == ["Một.", "Hai."]
+    # Lần duyệt sau vẫn nhận đủ các đoạn từ đầu
+    assert list(stream) == ["Một.", "Hai."]
+    assert stream.text() == "Một.\n\nHai."
+
+
+def test_put_after_close_fails():
+    stream = ParagraphStream()
+    stream.close()
+    stream.close()
+    assert stream.closed
+    with pytest.raises(ValueError):
+        stream.put("Muộn.")
@@ -0,0 +1,92 @@
+import json
+import threading
+
+import pytest
+
+from utils.tracing import Tracer, TracedThreadPoolExecutor, traced, tracer
+
+
+@pytest.fixture(autouse=True)
+def fresh_trace():
+    tracer.reset()
+    yield
+    tracer.reset()
+
+
+def spans_by_name():
+    return {span["name"]: span for span in tracer.drain()}
+
+
+def test_nested_spans_linked_to_parent():
+    with tracer.span("pipeline", chapters=2):
+        with tracer.span("story.chapter") as child:
+            child.set_attribute("chapter_num", 1)
+            tracer.add_event("cache_hit", artifact="chapter_1.txt")
+
+    spans = spans_by_name()
+    assert spans["pipeline"]["parent_id"] is None
+    assert spans["story.chapter"]["parent_id"] == spans["pipeline"]["span_id"]
+    assert spans["story.chapter"]["trace_id"] == spans["pipeline"]["trace_id"] == tracer.trace_id
+    assert spans["story.chapter"]["attributes"] == {"chapter_num": 1}
+    assert spans["story.chapter"]["events"][0]["attributes"] == {"artifact": "chapter_1.txt"}
+
+
+def test_error_marks_span_and_propagates():
+    @traced("audio.chapter")
+    def fail():
+        raise RuntimeError("TTS lỗi")
+
+    with pytest.raises(RuntimeError):
+        fail()
+    (span,) = tracer.drain()
+    assert (span["status"], span["attributes"]["error"]) == ("error", "RuntimeError: TTS lỗi")
+
+
+def test_pool_tasks_are_children_of_submitting_span():
+    with tracer.span("image.chapter"):
+        with TracedThreadPoolExecutor(max_workers=2) as executor:
+            for future in [executor.submit(traced("image.generate")(lambda: None)) for _ in range(2)]:
+                future.result()
+
+    spans = tracer.drain()
+    parent = next(span for span in spans if span["name"] == "image.chapter")
+    children = [span for span in spans if span["name"] == "image.generate"]
+    assert len(children) == 2
+    assert all(span["parent_id"] == parent["span_id"] for span in children)
+    assert all(span["thread_id"] != threading.get_ident() for span in children)
+
+
+def test_remote_parent_links_spans_across_processes():
+    with tracer.span("video.render"):
+        context = tracer.current_context()
+
+    # Process con: tracer riêng, span gốc nhận span của process chính làm cha
+    child = Tracer()
+    with child.remote_parent(context):
+        with child.span("video.encode"):
+            pass
+    tracer.merge(child.drain())
+
+    spans = spans_by_name()
+    assert spans["video.encode"]["parent_id"] == spans["video.render"]["span_id"]
+    assert spans["video.encode"]["trace_id"] == spans["video.render"]["trace_id"]
+
+
+def test_chrome_trace_export(tmp_path):
+    with tracer.span("image.chapter"):
+        tracer.add_event("retry")
+        with TracedThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(traced("image.generate")(lambda: None)).result()
+
+    path = tracer.export_chrome_trace(str(tmp_path / "trace.json"))
+    with open(path, encoding="utf-8") as f:
+        trace = json.load(f)
+
+    events = trace["traceEvents"]
+    assert trace["otherData"]["trace_id"] == tracer.trace_id
+    assert sorted(event["name"] for event in events if event["ph"] == "X") == ["image.chapter", "image.generate"]
+    assert [event["name"] for event in events if event["ph"] == "i"] == ["retry"]
+    # Span con ở thread khác được nối bằng một cặp flow event
+    assert sorted(event["ph"] for event in events if event.get("cat") == "flow") == ["f", "s"]
+    assert len([event for event in events if event["ph"] == "M"]) == 2
+    assert min(event["ts"] for event in events if event["ph"] == "X") == 0
@@ -0,0 +1,175 @@
+import os
+from fractions import Fraction
+
+import pytest
+
+from utils.ffmpeg_utils import ffmpeg_available, ffprobe_available, probe_stream_params
+from utils.governor import governor
+from utils.image_utils import image_size
+from utils.metrics import run_metrics
+from utils.mock_providers import make_png, make_mp3
+from utils.video_generator import VideoGenerator, _render_chapter_worker, _stream_param_matches
+
+needs_ffmpeg = pytest.mark.skipif(not ffmpeg_available(), reason="cần ffmpeg trong PATH")
+needs_ffprobe = pytest.mark.skipif(not (ffmpeg_available() and ffprobe_available()),
+                                   reason="cần ffmpeg và ffprobe trong PATH")
+
+
+@pytest.fixture
+def generator(tmp_path):
+    return VideoGenerator(width=320, height=180, fps=10, temp_dir=str(tmp_path))
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_resize_image_fits_frame(generator, tmp_path):
+    source = write(tmp_path / "source.png", make_png(400, 400))
+    output = generator.resize_image(source, str(tmp_path / "frame.png"))
+    assert output == str(tmp_path / "frame.png")
+    assert image_size(output) == (320, 180)
+
+
+def test_resize_image_without_cache_still_resizes(generator, tmp_path, monkeypatch):
+    def broken_cache(*args, **kwargs):
+        raise OSError("cache hỏng")
+
+    monkeypatch.setattr(generator.resize_cache, "link_to", broken_cache)
+    source = write(tmp_path / "source.png", make_png(400, 400))
+    output = generator.resize_image(source, str(tmp_path / "frame.png"))
+    # Không bao giờ trả về ảnh gốc sai kích thước
+    assert output != source
+    assert image_size(output) == (320, 180)
+
+
+def test_resize_image_reports_unreadable_image(generator, tmp_path):
+    source = write(tmp_path / "broken.png", b"not an image")
+    with pytest.raises(Exception):
+        generator.resize_image(source, str(tmp_path / "frame.png"))
+
+
+@needs_ffmpeg
+def test_render_timeline_single_ffmpeg_pass(generator, tmp_path):
+    images = [write(tmp_path / f"image_{i}.png", make_png(400, 300, seed=i)) for i in range(2)]
+    audio = write(tmp_path / "audio.mp3", make_mp3(1.0))
+    output = generator._render_timeline_ffmpeg(
+        [(images[0], 0.5), (images[1], 0.5)], [audio], str(tmp_path / "chapter_1.mp4")
+    )
+    assert os.path.getsize(output) > 0
+    if ffprobe_available():
+        assert probe_stream_params(output) == generator._target_stream_params()
+
+
+def render_chapter_video(generator, tmp_path, name, duration=1.0):
+    image = write(tmp_path / f"{name}.png", make_png(400, 300))
+    audio = write(tmp_path / f"{name}.mp3", make_mp3(duration))
+    return generator._render_timeline_ffmpeg([(image, duration)], [audio], str(tmp_path / f"{name}.mp4"))
+
+
+def test_fractional_fps_matches_probed_rate():
+    target = VideoGenerator(fps=29.97)._target_stream_params()
+    assert target["fps"] == Fraction(2997, 100)
+    assert _stream_param_matches("fps", Fraction(30000, 1001), target["fps"])
+    assert not _stream_param_matches("fps", Fraction(25), target["fps"])
+
+
+@needs_ffprobe
+@pytest.mark.parametrize("fps", [30, 29.97])
+def test_concat_stream_copies_matching_chapters(tmp_path, monkeypatch, fps):
+    generator = VideoGenerator(width=320, height=180, fps=fps, temp_dir=str(tmp_path))
+    videos = [render_chapter_video(generator, tmp_path, f"chapter_{i}") for i in range(2)]
+
+    reencoded = []
+    monkeypatch.setattr(generator, "_normalize_video", lambda *args, **kwargs: reencoded.append(args))
+    output = generator._concat_videos_ffmpeg(videos, str(tmp_path / "full_story.mp4"))
+
+    assert reencoded == []
+    assert probe_stream_params(output) == probe_stream_params(videos[0])
+
+
+@needs_ffprobe
+def test_concat_reencodes_mismatched_chapter(generator, tmp_path, monkeypatch):
+    matching = render_chapter_video(generator, tmp_path, "chapter_1")
+    other_size = VideoGenerator(width=160, height=90, fps=10, temp_dir=str(tmp_path))
+    mismatched = render_chapter_video(other_size, tmp_path, "chapter_2")
+
+    normalized = []
+    original = generator._normalize_video
+
+    def normalize(video_path, output_path, has_audio=True):
+        normalized.append(video_path)
+        return original(video_path, output_path, has_audio)
+
+    monkeypatch.setattr(generator, "_normalize_video", normalize)
+    output = generator._concat_videos_ffmpeg([matching, mismatched], str(tmp_path / "full_story.mp4"))
+
+    assert normalized == [mismatched]
+    params = probe_stream_params(output)
+    assert (params["width"], params["height"]) == (320, 180)
+
+
+def chapter_inputs(tmp_path, chapter_num, duration=1.0):
+    image = write(tmp_path / f"chapter_{chapter_num}_image_1.png", make_png(400, 300, seed=chapter_num))
+    audio = write(tmp_path / f"chapter_{chapter_num}_full.mp3", make_mp3(duration))
+    images = {"chapter_num": chapter_num, "images": [{"image_path": image}]}
+    segments = [{"audio_path": audio, "duration": duration}]
+    return images, {"chapter_num": chapter_num, "segments": segments, "full_audio": audio}
+
+
+def test_worker_settings_split_cores_between_workers():
+    settings = VideoGenerator(render_workers=2)._worker_settings()
+    assert settings["x264_threads"] == max(1, (os.cpu_count() or 1) // 2)
+    assert VideoGenerator(render_workers=2, x264_threads=3)._worker_settings()["x264_threads"] == 3
+
+
+def test_render_worker_uses_parent_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(governor, "session_id", "phiên-chính")
+    monkeypatch.setattr(governor, "enabled", True)
+    settings = VideoGenerator(render_workers=2)._worker_settings()
+    assert (settings["session_id"], settings["governor_enabled"]) == ("phiên-chính", True)
+
+    # Process con spawn bắt đầu với pid-<pid> và cấu hình mặc định
+    monkeypatch.setattr(governor, "session_id", "pid-123")
+    monkeypatch.setattr(governor, "enabled", False)
+    seen = []
+    monkeypatch.setattr(VideoGenerator, "render_chapter",
+                        lambda self, *args: seen.append((governor.session_id, governor.enabled)))
+    _render_chapter_worker(settings, {"chapter_num": 1}, [], [], str(tmp_path))
+    assert seen == [("phiên-chính", True)]
+
+
+@needs_ffmpeg
+def test_render_chapters_on_process_pool(tmp_path):
+    generator = VideoGenerator(width=320, height=180, fps=10, render_workers=2, temp_dir=str(tmp_path))
+    chapters = [{"chapter_num": 1, "title": "Một"}, {"chapter_num": 2, "title": "Hai"}]
+    inputs = [chapter_inputs(tmp_path, chapter["chapter_num"]) for chapter in chapters]
+    videos_dir = tmp_path / "videos"
+    videos_dir.mkdir()
+
+    run_metrics.reset()
+    video_paths = generator._render_chapters_parallel(
+        chapters, [images for images, _ in inputs], [audio for _, audio in inputs], str(videos_dir)
+    )
+
+    assert video_paths == {1: str(videos_dir / "chapter_1.mp4"), 2: str(videos_dir / "chapter_2.mp4")}
+    assert all(os.path.getsize(path) > 0 for path in video_paths.values())
+    # Sự kiện đo trong process con được gộp về process chính
+    assert run_metrics.summary()["video.encode"]["count"] == 2
+
+
+def test_resize_cache_reused_across_generators(generator, tmp_path):
+    source = write(tmp_path / "source.png", make_png(400, 400))
+    first = generator.resize_image(source, str(tmp_path / "first.png"))
+
+    other = VideoGenerator(width=320, height=180, fps=10, temp_dir=str(tmp_path))
+    second = other.resize_image(source, str(tmp_path / "second.png"))
+
+    assert other.resize_cache.stats()["hits"] == 1
+    with open(first, "rb") as a, open(second, "rb") as b:
+        assert a.read() == b.read()
+    # Kích thước khác thì là entry khác
+    small = VideoGenerator(width=160, height=90, fps=10, temp_dir=str(tmp_path))
+    assert image_size(small.resize_image(source, str(tmp_path / "small.png"))) == (160, 90)
+    assert small.resize_cache.stats()["hits"] == 0
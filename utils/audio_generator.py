@@ -1,28 +1,106 @@
 import os
+import re
 import json
 import requests
 import tempfile
 import base64
 from io import BytesIO
 from tqdm import tqdm
-from gtts import gTTS
-from utils.config import GOOGLE_API_KEY, OPENAI_API_KEY
-import ffmpeg
-import subprocess
+from utils.duration_probe import duration_probe
+from utils.ffmpeg_utils import ffmpeg_available, write_concat_list, run_ffmpeg
+from utils.mp3_utils import concat_mp3_files
+import time
+import random
+import threading
+import unicodedata
+from concurrent.futures import as_completed
+from utils.config import DEFAULT_CONFIG
+from utils.file_cache import FileCache
+from utils.providers import get_provider, get_provider_mode
+from utils.metrics import run_metrics, text_size, file_size
+from utils.tracing import tracer, traced, TracedThreadPoolExecutor
+from utils.governor import governor
+
+# Số request TTS đồng thời tối đa cho mỗi provider (dùng chung cho mọi AudioGenerator trong process)
+TTS_CONCURRENCY_LIMITS = {
+    "google": 4,
+    "openai": 8
+}
+
+_provider_semaphores = {}
+_provider_semaphores_lock = threading.Lock()
+
+
+# Số ký tự tối đa cho mỗi request TTS theo provider
+TTS_CHUNK_LIMITS = {
+    "google": 500,  # gTTS tự chia nhỏ bên trong, giữ đoạn vừa phải để thử lại nhanh
+    "openai": 4096
+}
+
+# Một câu: kết thúc bằng . ? ! … hoặc ... (có thể kèm dấu ngoặc đóng) trước khoảng trắng,
+# hoặc kết thúc tại xuống dòng / cuối văn bản
+_SENTENCE_PATTERN = re.compile(r'\S.*?(?:[.!?…]+["”’»)\]]*(?=\s|$)|(?=\n)|$)', re.S)
+
+_tts_cache = None
+_tts_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """Cache audio TTS dùng chung trong process (khởi tạo khi cần)"""
+    global _tts_cache
+    with _tts_cache_lock:
+        if _tts_cache is None:
+            _tts_cache = FileCache(
+                os.path.join(DEFAULT_CONFIG['temp_dir'], "tts_cache"),
+                max_bytes=DEFAULT_CONFIG['tts_cache_max_mb'] * 1024 * 1024
+            )
+        return _tts_cache
+
+
+def normalize_tts_text(text):
+    """Chuẩn hóa văn bản trước khi tạo khóa cache (Unicode NFC, gộp khoảng trắng)"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _get_provider_semaphore(provider):
+    """Lấy semaphore giới hạn số request đồng thời của provider"""
+    with _provider_semaphores_lock:
+        if provider not in _provider_semaphores:
+            limit = TTS_CONCURRENCY_LIMITS.get(provider, 1)
+            _provider_semaphores[provider] = threading.BoundedSemaphore(limit)
+        return _provider_semaphores[provider]
+
 
 class AudioGenerator:
-    def __init__(self, provider="google"):
+    def __init__(self, provider="google", max_workers=None, chapter_workers=2, max_retries=3,
+                 voice="alloy", language_code="vi", speed=1.0, use_cache=True, checkpoint=None):
         """
         Khởi tạo generator với provider được chọn
         provider: 'google' hoặc 'openai'
+        max_workers: số thread tạo audio cho mỗi chương (None = theo giới hạn của provider)
+        chapter_workers: số chương được xử lý đồng thời
+        max_retries: số lần thử lại khi một đoạn tạo audio thất bại
+        voice: giọng đọc (OpenAI)
+        language_code: ngôn ngữ (gTTS)
+        speed: tốc độ đọc (gTTS chỉ hỗ trợ chậm khi speed < 1)
+        use_cache: dùng lại audio đã tạo cho cùng provider/giọng/ngôn ngữ/tốc độ/văn bản
+        checkpoint: CheckpointManifest để ghi lại/dùng lại từng đoạn audio đã tạo
         """
         self.provider = provider
+        self.max_workers = max_workers or TTS_CONCURRENCY_LIMITS.get(provider, 1)
+        self.chapter_workers = max(1, chapter_workers)
+        self.max_retries = max_retries
+        self.voice = voice
+        self.language_code = language_code
+        self.speed = speed
+        self.cache = get_tts_cache() if use_cache else None
+        self.checkpoint = checkpoint
     
     def generate_audio_google(self, text, output_path, language_code="vi", slow=False):
         """Tạo audio từ text sử dụng Google Text-to-Speech (gTTS)"""
         try:
             # Sử dụng gTTS thay vì Google Cloud TTS
-            tts = gTTS(text=text, lang=language_code, slow=slow)
+            tts = get_provider("gtts", text, lang=language_code, slow=slow)
             tts.save(output_path)
             return output_path
             
@@ -33,16 +111,13 @@ class AudioGenerator:
     def generate_audio_openai(self, text, output_path, voice="alloy"):
         """Tạo audio từ text sử dụng OpenAI TTS API"""
         try:
-            if not OPENAI_API_KEY:
-                raise ValueError("Thiếu API key cho OpenAI")
-                
-            import openai
-            openai.api_key = OPENAI_API_KEY
+            speech = get_provider("openai_speech")
             
-            response = openai.audio.speech.create(
+            response = speech.create(
                 model="tts-1",
                 voice=voice,
-                input=text
+                input=text,
+                speed=self.speed
             )
             
             # Lưu file audio
@@ -54,90 +129,249 @@ class AudioGenerator:
             print(f"Lỗi khi tạo audio với OpenAI TTS: {e}")
             return None
     
-    def split_text_for_tts(self, text, max_length=500):
-        """Chia văn bản thành các đoạn phù hợp cho TTS"""
-        if len(text) <= max_length:
-            return [text]
+    def _split_long_sentence(self, sentence, max_length):
+        """Chia một câu dài hơn giới hạn tại dấu phẩy/chấm phẩy hoặc khoảng trắng gần giới hạn nhất"""
+        pieces = []
+        while len(sentence) > max_length:
+            end = max_length
+            clause_pos = max(sentence.rfind(punct, 0, max_length) for punct in [',', ';', ':'])
+            if clause_pos > 0:
+                end = clause_pos + 1
+            else:
+                space_pos = sentence.rfind(' ', 0, max_length)
+                if space_pos > 0:
+                    end = space_pos + 1
+            pieces.append(sentence[:end].strip())
+            sentence = sentence[end:].strip()
+        if sentence:
+            pieces.append(sentence)
+        return pieces
+    
+    def _sentences(self, text, max_length):
+        """Tách văn bản thành các câu, câu dài hơn giới hạn được chia nhỏ"""
+        for match in _SENTENCE_PATTERN.finditer(text):
+            sentence = match.group(0).strip()
+            if not sentence:
+                continue
+            if len(sentence) > max_length:
+                yield from self._split_long_sentence(sentence, max_length)
+            else:
+                yield sentence
+    
+    def iter_chunks(self, paragraphs, max_length=None):
+        """Chia luồng đoạn văn thành các request TTS, trả về từng đoạn ngay khi đoạn đó đầy
         
-        # Tìm vị trí kết thúc câu gần với max_length nhất
-        segments = []
-        start = 0
+        Gom nguyên câu (kết thúc bằng . ? ! … hoặc ..., kể cả dấu ngoặc kép đóng phía sau)
+        vào mỗi đoạn cho đến khi chạm giới hạn ký tự của provider. Câu được gom liền qua ranh giới
+        đoạn văn, nên kết quả giống hệt plan_chunks trên toàn bộ chương: khóa cache và checkpoint
+        của từng đoạn audio không phụ thuộc chương được đọc theo stream hay một lần.
         
-        while start < len(text):
-            if start + max_length >= len(text):
-                segments.append(text[start:])
-                break
-                
-            end = start + max_length
-            
-            # Tìm vị trí kết thúc câu gần nhất
-            for punct in ['.', '?', '!']:
-                punct_pos = text.rfind(punct, start, end)
-                if punct_pos != -1:
-                    end = punct_pos + 1
-                    break
-                    
-            # Nếu không tìm thấy dấu câu, cắt tại khoảng trắng gần nhất
-            if end == start + max_length:
-                space_pos = text.rfind(' ', start, end)
-                if space_pos != -1:
-                    end = space_pos + 1
-            
-            segments.append(text[start:end])
-            start = end
+        Yields:
+            dict {"index", "text", "chars"} theo thứ tự đọc
+        """
+        max_length = max_length or TTS_CHUNK_LIMITS.get(self.provider, 500)
+        
+        # Gom câu tham lam: một đoạn chỉ được chốt khi câu kế tiếp không còn vừa
+        index = 0
+        current = ""
+        for paragraph in paragraphs:
+            for sentence in self._sentences(paragraph, max_length):
+                candidate = f"{current} {sentence}" if current else sentence
+                if len(candidate) <= max_length:
+                    current = candidate
+                    continue
+                yield {"index": index, "text": current, "chars": len(current)}
+                index += 1
+                current = sentence
+        if current:
+            yield {"index": index, "text": current, "chars": len(current)}
+    
+    def plan_chunks(self, text, max_length=None):
+        """Lập kế hoạch chia văn bản thành các request TTS trước khi tạo audio
         
-        return segments
+        Returns:
+            list: [{"index", "text", "chars"}] theo thứ tự đọc (xem iter_chunks)
+        """
+        return list(self.iter_chunks([text], max_length))
+    
+    def split_text_for_tts(self, text, max_length=None):
+        """Chia văn bản thành các đoạn phù hợp cho TTS (giới hạn theo provider nếu không chỉ định)"""
+        return [chunk["text"] for chunk in self.plan_chunks(text, max_length)]
+    
+    def _cache_key(self, text):
+        """Khóa cache của một đoạn audio"""
+        if self.provider == "google":
+            # gTTS không dùng giọng đọc, tốc độ chỉ có bình thường/chậm
+            return FileCache.make_key("tts", get_provider_mode(), self.provider, None, self.language_code,
+                                      self.speed < 1, normalize_tts_text(text))
+        return FileCache.make_key("tts", get_provider_mode(), self.provider, self.voice, None,
+                                  self.speed, normalize_tts_text(text))
     
     def generate_audio(self, text, output_path):
         """Tạo audio từ text sử dụng provider đã chọn"""
+        if self.provider not in ("google", "openai"):
+            raise ValueError(f"Provider không được hỗ trợ: {self.provider}")
+        
+        cache_key = None
+        if self.cache:
+            cache_key = self._cache_key(text)
+            if self.cache.link_to(cache_key, output_path):
+                tracer.add_event("cache_hit", artifact=os.path.basename(output_path))
+                return output_path
+        
+        # File cũ có thể là hard link trỏ vào cache, xóa trước để không ghi đè lên entry trong cache
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        
         if self.provider == "google":
-            return self.generate_audio_google(text, output_path)
-        elif self.provider == "openai":
-            return self.generate_audio_openai(text, output_path)
+            result_path = self.generate_audio_google(text, output_path, self.language_code, slow=self.speed < 1)
         else:
-            raise ValueError(f"Provider không được hỗ trợ: {self.provider}")
+            result_path = self.generate_audio_openai(text, output_path, self.voice)
+        
+        if result_path and self.cache:
+            try:
+                self.cache.put_file(cache_key, result_path, suffix=".mp3")
+            except OSError as e:
+                print(f"Không thể lưu audio vào cache: {e}")
+        
+        return result_path
+    
+    def _synthesize_checkpointed(self, text, output_path, artifact_id):
+        """Tạo audio cho một đoạn rồi ghi ngay vào checkpoint"""
+        result_path = self._synthesize_segment(text, output_path)
+        if result_path and self.checkpoint:
+            self.checkpoint.put(
+                artifact_id,
+                self.checkpoint.input_hash(self._cache_key(text)),
+                {"audio_path": result_path, "duration": duration_probe.get_duration(result_path)},
+                [result_path]
+            )
+        return result_path
+    
+    def _synthesize_segment(self, text, output_path):
+        """Tạo audio cho một đoạn, giới hạn đồng thời theo provider và thử lại khi thất bại"""
+        semaphore = _get_provider_semaphore(self.provider)
+        
+        with run_metrics.measure("audio.tts", os.path.basename(output_path), bytes_in=text_size(text),
+                                 provider=self.provider) as event:
+            for attempt in range(self.max_retries + 1):
+                with semaphore, governor.slot("tts"):
+                    result_path = self.generate_audio(text, output_path)
+                if result_path:
+                    event["bytes_out"] = file_size(result_path)
+                    return result_path
+                
+                if attempt < self.max_retries:
+                    # Exponential backoff có jitter trước khi thử lại
+                    delay = (2 ** attempt) + random.uniform(0, 1)
+                    print(f"Tạo audio thất bại cho {os.path.basename(output_path)}, thử lại sau {delay:.1f}s...")
+                    run_metrics.note_retry()
+                    time.sleep(delay)
+            
+            event["error"] = "không tạo được audio"
+        
+        print(f"Không thể tạo audio cho {os.path.basename(output_path)} sau {self.max_retries + 1} lần thử")
+        return None
     
     def process_chapter(self, chapter_text, chapter_num, output_dir="output/audio"):
         """Xử lý một chương và tạo audio"""
+        return self.process_chapter_stream([chapter_text], chapter_num, output_dir)
+    
+    @traced("audio.chapter")
+    def process_chapter_stream(self, paragraphs, chapter_num, output_dir="output/audio"):
+        """Tạo audio cho một chương từ các đoạn văn, gửi mỗi request TTS ngay khi nhận đủ câu cho request đó
+        
+        Args:
+            paragraphs: iterable các đoạn văn (ví dụ ParagraphStream khi chương còn đang được viết)
+        """
+        tracer.set_attribute("chapter_num", chapter_num)
+        tracer.set_attribute("provider", self.provider)
         os.makedirs(output_dir, exist_ok=True)
         
-        # Chia chương thành nhiều đoạn
-        segments = self.split_text_for_tts(chapter_text)
+        # Tạo audio song song, kết quả được sắp xếp lại theo thứ tự đoạn
+        segments = []
+        max_chars = 0
+        results = {}
+        with TracedThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            # Mỗi request TTS được gửi ngay khi đủ câu, không chờ hết chương; các đoạn giống hệt
+            # khi chia cả chương một lần nên audio trong cache/checkpoint dùng lại được giữa hai cách chạy
+            for chunk in self.iter_chunks(paragraphs):
+                i = chunk["index"]
+                segments.append(chunk["text"])
+                max_chars = max(max_chars, chunk["chars"])
+                output_path = os.path.join(output_dir, f"chapter_{chapter_num}_segment_{i+1}.mp3")
+                
+                artifact_id = f"audio:chapter_{chapter_num}:segment_{i+1}"
+                if self.checkpoint:
+                    input_hash = self.checkpoint.input_hash(self._cache_key(chunk["text"]))
+                    segment_data = self.checkpoint.get(artifact_id, input_hash)
+                    if segment_data:
+                        results[i] = segment_data["audio_path"]
+                        continue
+                
+                futures[executor.submit(self._synthesize_checkpointed, chunk["text"], output_path, artifact_id)] = i
+            
+            print(f"Đang tạo {len(segments)} audio cho chương {chapter_num} (tối đa {max_chars} ký tự/đoạn)...")
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                results[futures[future]] = future.result()
         
         audio_paths = []
-        print(f"Đang tạo {len(segments)} audio cho chương {chapter_num}...")
-        
-        for i, segment in enumerate(tqdm(segments)):
-            output_path = os.path.join(output_dir, f"chapter_{chapter_num}_segment_{i+1}.mp3")
-            
-            result_path = self.generate_audio(segment, output_path)
+        for i, segment in enumerate(segments):
+            result_path = results.get(i)
             if result_path:
                 audio_data = {
                     "segment_index": i,
                     "segment_text": segment,
-                    "audio_path": result_path
+                    "audio_path": result_path,
+                    # Lưu thời lượng ngay khi tạo để bước render không phải đo lại
+                    "duration": duration_probe.get_duration(result_path)
                 }
                 audio_paths.append(audio_data)
         
         # Ghép các đoạn audio thành một file cho toàn bộ chương
         if audio_paths:
+            chapter_audio_path = os.path.join(output_dir, f"chapter_{chapter_num}_full.mp3")
+            
+            # Ghép trực tiếp ở mức stream (không decode/encode lại)
+            segment_files = [audio_data["audio_path"] for audio_data in audio_paths]
+            with run_metrics.measure("audio.merge", f"chapter_{chapter_num}",
+                                     bytes_in=sum(file_size(path) for path in segment_files)) as event:
+                merged = self.merge_audios(segment_files, chapter_audio_path)
+                event["bytes_out"] = file_size(merged)
+                if not merged:
+                    event["error"] = "không ghép được audio bằng stream copy"
+            if merged:
+                return {
+                    "chapter_num": chapter_num,
+                    "segments": audio_paths,
+                    "full_audio": chapter_audio_path,
+                    "full_audio_duration": duration_probe.get_duration(chapter_audio_path)
+                }
+            
+            # Fallback: decode bằng pydub rồi encode lại
             try:
                 from pydub import AudioSegment
                 
                 # Kiểm tra xem ffprobe đã được cài đặt chưa
                 try:
-                    combined = AudioSegment.empty()
-                    for audio_data in audio_paths:
-                        segment = AudioSegment.from_mp3(audio_data["audio_path"])
-                        combined += segment
+                    segments = [AudioSegment.from_mp3(audio_data["audio_path"]) for audio_data in audio_paths]
+                    
+                    # Nối dữ liệu PCM một lần thay vì cộng dồn từng đoạn (mỗi lần += sao chép toàn bộ buffer)
+                    first = segments[0]
+                    segments = [
+                        segment.set_frame_rate(first.frame_rate).set_channels(first.channels).set_sample_width(first.sample_width)
+                        for segment in segments
+                    ]
+                    combined = first._spawn(b"".join(segment.raw_data for segment in segments))
                     
-                    chapter_audio_path = os.path.join(output_dir, f"chapter_{chapter_num}_full.mp3")
                     combined.export(chapter_audio_path, format="mp3")
                     
                     return {
                         "chapter_num": chapter_num,
                         "segments": audio_paths,
-                        "full_audio": chapter_audio_path
+                        "full_audio": chapter_audio_path,
+                        "full_audio_duration": duration_probe.get_duration(chapter_audio_path)
                     }
                 except FileNotFoundError as e:
                     if "ffprobe" in str(e):
@@ -177,30 +411,36 @@ class AudioGenerator:
         audio_dir = os.path.join(output_dir, "audio")
         os.makedirs(audio_dir, exist_ok=True)
         
-        story_audio = []
-        
-        for chapter in story_data["chapters"]:
-            chapter_num = chapter["chapter_num"]
-            chapter_content = chapter["content"]
-            
-            chapter_audio = self.process_chapter(chapter_content, chapter_num, audio_dir)
-            story_audio.append(chapter_audio)
+        # Xử lý nhiều chương đồng thời; tổng số request vẫn bị giới hạn bởi semaphore của provider
+        with TracedThreadPoolExecutor(max_workers=self.chapter_workers) as executor:
+            futures = [
+                executor.submit(self.process_chapter, chapter["content"], chapter["chapter_num"], audio_dir)
+                for chapter in story_data["chapters"]
+            ]
+            story_audio = [future.result() for future in futures]
         
-        # Lưu thông tin audio vào file
+        return self.save_story_audio(story_audio, output_dir)
+    
+    def save_story_audio(self, story_audio, output_dir="output"):
+        """Lưu thông tin audio của cả truyện vào audio_data.json"""
         audio_data_path = os.path.join(output_dir, "audio_data.json")
         with open(audio_data_path, "w", encoding="utf-8") as f:
             json.dump(story_audio, f, ensure_ascii=False, indent=2)
         
-        print(f"Đã tạo xong audio cho {len(story_data['chapters'])} chương.")
+        print(f"Đã tạo xong audio cho {len(story_audio)} chương.")
         print(f"Dữ liệu audio đã được lưu vào: {audio_data_path}")
+        if self.cache:
+            stats = self.cache.stats()
+            print(f"TTS cache: {stats['hits']} hit, {stats['misses']} miss, {stats['entries']} entry ({stats['bytes'] / (1024*1024):.1f} MB)")
         
         return story_audio
     
     def get_audio_duration(self, audio_path):
         """Lấy độ dài của file audio"""
         try:
-            probe = ffmpeg.probe(audio_path)
-            duration = float(probe['format']['duration'])
+            duration = duration_probe.get_duration(audio_path)
+            if duration is None:
+                raise ValueError(f"Không đọc được thời lượng của {audio_path}")
             return duration
         except Exception as e:
             print(f"Lỗi khi lấy thời lượng audio: {e}")
@@ -208,42 +448,36 @@ class AudioGenerator:
             return 5.0  # Ước tính thời lượng trung bình cho mỗi đoạn
             
     def merge_audios(self, audio_files, output_path):
-        """Ghép các file audio"""
+        """Ghép các file audio bằng stream copy, không decode/encode lại
+
+        Dùng concat demuxer của ffmpeg (-c copy) nếu có; nếu không có ffmpeg và tất cả là MP3
+        thì nối trực tiếp các frame MP3. Trả về None nếu không ghép được.
+        """
         if not audio_files:
             return None
             
         try:
-            # Kiểm tra ffprobe có tồn tại không
-            try:
-                subprocess.run(['ffprobe', '-version'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-            except (subprocess.SubprocessError, FileNotFoundError):
-                print("CẢNH BÁO: Không tìm thấy ffprobe, cần cài đặt ffmpeg để ghép audio")
-                print("Bạn có thể tải ffmpeg từ: https://ffmpeg.org/download.html")
-                print("Hoặc sử dụng lệnh: ")
-                print("  - Windows (với Chocolatey): choco install ffmpeg")
-                print("  - macOS (với Homebrew): brew install ffmpeg")
-                print("  - Ubuntu/Debian: sudo apt-get install ffmpeg")
-                
-                # Đánh dấu lỗi để sử dụng các audio segments riêng lẻ sau này
-                return None
-            
-            # Tiếp tục nếu ffprobe tồn tại
-            temp_list_file = "temp_audio_list.txt"
+            if ffmpeg_available():
+                with tempfile.TemporaryDirectory(prefix="audio_concat_") as work_dir:
+                    concat_list = write_concat_list(
+                        [(audio_file, None) for audio_file in audio_files],
+                        os.path.join(work_dir, "audio_list.txt")
+                    )
+                    run_ffmpeg(['-f', 'concat', '-safe', '0', '-i', concat_list, '-c', 'copy', output_path])
+                return output_path
             
-            with open(temp_list_file, "w", encoding="utf-8") as f:
-                for audio_file in audio_files:
-                    f.write(f"file '{audio_file}'\n")
+            if all(audio_file.lower().endswith(".mp3") for audio_file in audio_files):
+                return concat_mp3_files(audio_files, output_path)
             
-            subprocess.run([
-                'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
-                '-i', temp_list_file, '-c', 'copy', output_path
-            ], check=True)
+            print("CẢNH BÁO: Không tìm thấy ffmpeg, cần cài đặt ffmpeg để ghép audio")
+            print("Bạn có thể tải ffmpeg từ: https://ffmpeg.org/download.html")
+            print("Hoặc sử dụng lệnh: ")
+            print("  - Windows (với Chocolatey): choco install ffmpeg")
+            print("  - macOS (với Homebrew): brew install ffmpeg")
+            print("  - Ubuntu/Debian: sudo apt-get install ffmpeg")
             
-            # Xóa file tạm
-            if os.path.exists(temp_list_file):
-                os.remove(temp_list_file)
-                
-            return output_path
+            # Đánh dấu lỗi để sử dụng các audio segments riêng lẻ sau này
+            return None
         except Exception as e:
             print(f"Lỗi khi ghép audio: {e}")
             # Đánh dấu lỗi để sử dụng các audio segments riêng lẻ sau này
@@ -0,0 +1,91 @@
+import os
+import threading
+from utils.file_cache import FileCache
+from utils.journal import append_record, read_records, rewrite_records
+from utils.providers import get_provider_mode
+
+
+class CheckpointManifest:
+    """Manifest ghi lại từng artifact đã tạo xong (chương, ảnh, đoạn audio, video chương)
+
+    Mỗi entry gồm hash của đầu vào tạo ra artifact, dữ liệu kết quả và các file liên quan.
+    Manifest là một journal JSONL: mỗi artifact xong được ghi nối thêm một dòng (không ghi lại cả
+    manifest), nên khi chạy lại với resume=True chỉ những artifact còn thiếu, đã bị xóa file hoặc
+    có đầu vào thay đổi mới phải tạo lại. Journal được thu gọn khi nạp lại.
+    """
+
+    def __init__(self, path, resume=False):
+        """
+        path: đường dẫn file checkpoint.jsonl
+        resume: dùng lại các artifact đã ghi trong manifest (False = bắt đầu manifest mới)
+        """
+        self.path = path
+        self.resume = resume
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._entries = self._load() if resume else {}
+        # Manifest mới chỉ thay manifest cũ khi có artifact đầu tiên, để lần chạy lỗi ngay từ đầu
+        # không làm mất checkpoint của lần trước
+        self._fresh = not resume
+
+    def _load(self):
+        """Đọc journal (entry ghi sau thay entry trước cùng artifact) rồi thu gọn nếu có entry cũ"""
+        records, damaged = read_records(self.path)
+        entries = {}
+        for record in records:
+            try:
+                entries[record["id"]] = {
+                    "input_hash": record["input_hash"],
+                    "data": record["data"],
+                    "paths": record["paths"]
+                }
+            except (KeyError, TypeError):
+                continue
+
+        if damaged or len(records) > len(entries):
+            try:
+                rewrite_records(self.path, [self._record(artifact_id, entry) for artifact_id, entry in entries.items()])
+            except OSError as e:
+                print(f"Không thể thu gọn checkpoint: {e}")
+        return entries
+
+    @staticmethod
+    def _record(artifact_id, entry):
+        return {"id": artifact_id, **entry}
+
+    @staticmethod
+    def input_hash(*parts):
+        """Hash đầu vào của một artifact (artifact tạo bởi provider giả lập không dùng lại ở chế độ live)"""
+        return FileCache.make_key("checkpoint", get_provider_mode(), *parts)
+
+    def get(self, artifact_id, input_hash):
+        """Trả về dữ liệu đã lưu của artifact nếu còn dùng được, None nếu phải tạo lại"""
+        if not self.resume:
+            return None
+        with self._lock:
+            entry = self._entries.get(artifact_id)
+        if not entry or entry["input_hash"] != input_hash:
+            return None
+        if not all(path and os.path.exists(path) for path in entry["paths"]):
+            return None
+        with self._lock:
+            self.reused += 1
+        return entry["data"]
+
+    def put(self, artifact_id, input_hash, data, paths=()):
+        """Ghi nhận một artifact vừa tạo xong và ghi nối thêm vào journal ngay"""
+        entry = {
+            "input_hash": input_hash,
+            "data": data,
+            "paths": [path for path in paths if path]
+        }
+        with self._lock:
+            self._entries[artifact_id] = entry
+            try:
+                if self._fresh:
+                    rewrite_records(self.path, [self._record(artifact_id, entry)])
+                    self._fresh = False
+                else:
+                    append_record(self.path, self._record(artifact_id, entry))
+            except OSError as e:
+                print(f"Không thể lưu checkpoint: {e}")
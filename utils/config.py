@@ -34,11 +34,21 @@ TELEGRAM_BOT_TOKEN = get_env_var('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHAT_ID = get_env_var('TELEGRAM_CHAT_ID')
 TELEGRAM_ENABLED = get_env_var('TELEGRAM_ENABLED', 'true').lower() == 'true'
 
+# Chế độ provider: 'live' gọi dịch vụ thật, 'mock' dùng provider giả lập chạy offline
+PROVIDER_MODE = get_env_var('PROVIDER_MODE', 'live').lower()
+
+# Thư mục gốc của dự án (không phụ thuộc thư mục hiện tại khi chạy app.py hay main.py)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 print(f"CONFIG - GOOGLE_API_KEY: {'Có giá trị' if GOOGLE_API_KEY else 'Không có giá trị'}")
 print(f"CONFIG - TELEGRAM_BOT_TOKEN: {'Có giá trị' if TELEGRAM_BOT_TOKEN else 'Không có giá trị'}")
 
 # Kiểm tra các API key cần thiết
 def validate_api_keys():
+    # Provider giả lập không cần API key
+    if PROVIDER_MODE == 'mock':
+        return
+    
     missing_keys = []
     
     if not GOOGLE_API_KEY:
@@ -48,12 +58,57 @@ def validate_api_keys():
         raise ValueError(f"Thiếu các API keys sau: {', '.join(missing_keys)}. Vui lòng thêm vào file .env")
 
 # Cấu hình mặc định
+# Hạn mức tần suất đã công bố của các provider, dạng "N/T" = tối đa N request mỗi T giây
+# - Gemini API (https://ai.google.dev/gemini-api/docs/rate-limits): gemini-2.0-flash 15 RPM ở free tier,
+#   2000/10000/30000 RPM ở tier 1/2/3; model thử nghiệm gemini-2.0-flash-exp-image-generation 10 RPM
+# - Stability AI (https://platform.stability.ai/docs/getting-started/rate-limits): 150 request mỗi 10 giây
+# - ZhipuAI (CogView4) giới hạn số request đồng thời chứ không giới hạn tần suất, đã có image_slots
+GEMINI_TIER = get_env_var('GEMINI_TIER', 'free').lower()
+GEMINI_TEXT_RATE_LIMITS = {'free': '15/60', 'tier1': '2000/60', 'tier2': '10000/60', 'tier3': '30000/60'}
+RATE_LIMIT_DEFAULTS = {
+    'gemini_text': GEMINI_TEXT_RATE_LIMITS.get(GEMINI_TIER, GEMINI_TEXT_RATE_LIMITS['free']),
+    'gemini': '10/60',
+    'stable_diffusion': '150/10',
+    'cogview4': 'none'
+}
+
 DEFAULT_CONFIG = {
     'num_chapters': 1,
     'tokens_per_chapter': 2000,
     'image_model': 'gemini',  # 'gemini', 'stable_diffusion', or 'cogview4'
     'tts_provider': 'google',  # 'google' or 'openai'
+    'story_workers': 4,  # Số chương truyện được viết đồng thời (theo dàn ý)
+    'render_workers': 1,  # Số process render video chương song song
+    'resize_cache_max_mb': 512,  # Dung lượng tối đa của cache ảnh đã resize
+    'tts_cache_max_mb': 1024,  # Dung lượng tối đa của cache audio TTS
+    'image_cache_max_mb': 1024,  # Dung lượng tối đa của cache ảnh đã tạo
+    'image_format': None,  # None = giữ định dạng gốc của provider, hoặc 'webp' / 'jpeg'
+    'image_quality': 90,  # Chất lượng khi mã hóa lại sang webp/jpeg
+    'normalize_images': True,  # Crop/resize sẵn ảnh theo kích thước video ngay khi tạo ảnh
+    'prompt_batch_output_tokens': 8192,  # Giới hạn token đầu ra của mỗi lần gọi LLM tạo prompt ảnh theo batch
+    'prompt_tokens_per_image': 500,  # Ước lượng (dư) token đầu ra của một prompt ảnh: ≤ 200 từ + khóa JSON
+    'video_width': 1280,
+    'video_height': 720,
     'output_dir': 'output',
+    # Bảng job chạy nền của giao diện Streamlit (SQLite); đường dẫn tuyệt đối để app khởi động từ thư mục
+    # khác vẫn thấy các job đã tạo, đổi bằng biến môi trường JOBS_DB
+    'jobs_db': get_env_var('JOBS_DB', os.path.join(PROJECT_DIR, 'output', 'jobs.db')),
+    # Slot tài nguyên dùng chung giữa các phiên/process (SQLite); đường dẫn tuyệt đối để CLI và app
+    # chạy từ thư mục khác nhau vẫn dùng chung một file, đổi bằng biến môi trường GOVERNOR_DB
+    'governor_db': get_env_var('GOVERNOR_DB', os.path.join(PROJECT_DIR, 'output', 'governor.db')),
+    # Giới hạn slot dùng chung: None = chỉ bật cho giao diện Streamlit và job chạy nền (CLI bật bằng --governor),
+    # GOVERNOR_ENABLED=true/false bật/tắt ở mọi nơi
+    'governor_enabled': {'true': True, 'false': False}.get(str(get_env_var('GOVERNOR_ENABLED', '')).lower()),
+    'job_slots': 2,  # Số job chạy nền cùng lúc trên máy chủ (0 = không giới hạn)
+    'encode_slots': 2,  # Số video chương được encode cùng lúc trên máy chủ
+    'image_slots': 8,  # Số lần gọi API tạo ảnh cùng lúc trên máy chủ
+    'tts_slots': 8,  # Số lần gọi TTS cùng lúc trên máy chủ
+    'gemini_tier': GEMINI_TIER,  # 'free', 'tier1', 'tier2' hoặc 'tier3' (đổi bằng GEMINI_TIER)
+    # Giới hạn tần suất gọi API của từng provider ("N/T" hoặc "none"), đổi bằng RATE_LIMIT_<TÊN>,
+    # ví dụ RATE_LIMIT_GEMINI_TEXT=1000/60
+    'rate_limits': {
+        name: get_env_var(f'RATE_LIMIT_{name.upper()}', default) for name, default in RATE_LIMIT_DEFAULTS.items()
+    },
     'temp_dir': 'temp'
 }
 
@@ -0,0 +1,93 @@
+import os
+import threading
+import subprocess
+from utils.config import DEFAULT_CONFIG
+from utils.ffmpeg_utils import ffprobe_available
+from utils.journal import append_record, read_records, rewrite_records
+from utils.mp3_utils import mp3_duration
+
+
+class DurationProbe:
+    """Lấy thời lượng file audio/video chỉ từ header, có ghi nhớ lâu dài
+
+    Kết quả được lưu theo (đường dẫn, mtime, kích thước) trong một journal JSONL chỉ ghi nối thêm,
+    nên file nào đã đo một lần sẽ không phải đo lại ở các lần render sau. Mỗi lần ghi chỉ thêm
+    một dòng, nên các process render chạy song song không làm mất kết quả của nhau; journal
+    được thu gọn khi nạp.
+    """
+
+    def __init__(self, index_path=None):
+        self.index_path = index_path or os.path.join(DEFAULT_CONFIG['temp_dir'], "duration_index.jsonl")
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+
+    def _load_index(self):
+        """Đọc journal (bản ghi sau ghi đè bản ghi trước), bỏ các file không còn tồn tại rồi thu gọn"""
+        records, damaged = read_records(self.index_path)
+        index = {}
+        for record in records:
+            try:
+                index[record["key"]] = record["duration"]
+            except (KeyError, TypeError):
+                continue
+        index = {key: value for key, value in index.items() if os.path.exists(key.rsplit("|", 2)[0])}
+
+        if damaged or len(records) > len(index):
+            try:
+                rewrite_records(self.index_path, [{"key": key, "duration": value} for key, value in index.items()])
+            except OSError as e:
+                print(f"Không thể thu gọn duration index: {e}")
+        return index
+
+    @staticmethod
+    def _index_key(path):
+        stat = os.stat(path)
+        return f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}"
+
+    def _probe_ffprobe(self, path):
+        """Đọc thời lượng từ container bằng ffprobe (không decode)"""
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if result.returncode != 0:
+            return None
+        try:
+            return float(result.stdout.decode("utf-8").strip())
+        except ValueError:
+            return None
+
+    def get_duration(self, path):
+        """Trả về thời lượng (giây) của file, None nếu không xác định được"""
+        key = self._index_key(path)
+        with self._lock:
+            if key in self._index:
+                return self._index[key]
+
+        duration = None
+        if path.lower().endswith(".mp3"):
+            duration = mp3_duration(path)
+        if duration is None and ffprobe_available():
+            duration = self._probe_ffprobe(path)
+        if duration is None:
+            return None
+
+        self.record(path, duration)
+        return duration
+
+    def record(self, path, duration):
+        """Ghi nhận thời lượng đã biết của một file (ví dụ ngay khi vừa tạo file)"""
+        key = self._index_key(path)
+        with self._lock:
+            if self._index.get(key) == duration:
+                return
+            self._index[key] = duration
+        try:
+            append_record(self.index_path, {"key": key, "duration": duration})
+        except OSError as e:
+            print(f"Không thể lưu duration index: {e}")
+
+
+# Tạo instance mặc định
+duration_probe = DurationProbe()
@@ -0,0 +1,92 @@
+import os
+import json
+import shutil
+import subprocess
+from fractions import Fraction
+
+
+def ffmpeg_available():
+    """Kiểm tra ffmpeg đã được cài đặt (có trong PATH) hay chưa"""
+    return shutil.which("ffmpeg") is not None
+
+
+def ffprobe_available():
+    """Kiểm tra ffprobe đã được cài đặt (có trong PATH) hay chưa"""
+    return shutil.which("ffprobe") is not None
+
+
+def escape_concat_path(path):
+    """Chuẩn hóa đường dẫn để ghi vào file danh sách của concat demuxer"""
+    path = os.path.abspath(path).replace("\\", "/")
+    return path.replace("'", "'\\''")
+
+
+def write_concat_list(entries, list_path):
+    """Ghi file danh sách cho concat demuxer của ffmpeg
+
+    Args:
+        entries: danh sách (đường dẫn, thời lượng); thời lượng = None nếu không cần
+        list_path: đường dẫn file danh sách cần ghi
+
+    Returns:
+        list_path
+    """
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write("ffconcat version 1.0\n")
+        for path, duration in entries:
+            f.write(f"file '{escape_concat_path(path)}'\n")
+            if duration is not None:
+                f.write(f"duration {duration:.3f}\n")
+    return list_path
+
+
+def run_ffmpeg(args):
+    """Chạy ffmpeg với các tham số cho trước, raise RuntimeError nếu thất bại"""
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"] + [str(arg) for arg in args]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        stderr = result.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"ffmpeg lỗi (mã {result.returncode}): {stderr[-1000:]}")
+    return result
+
+
+def probe_stream_params(path):
+    """Đọc các tham số stream chính (codec, kích thước, fps, audio) bằng ffprobe
+
+    Returns:
+        dict: tham số của stream video và audio đầu tiên; giá trị None nếu không có stream
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries",
+        "stream=codec_type,codec_name,width,height,r_frame_rate,pix_fmt,sample_rate,channels",
+        "-of", "json", path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        stderr = result.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"ffprobe lỗi (mã {result.returncode}): {stderr[-1000:]}")
+
+    streams = json.loads(result.stdout.decode("utf-8")).get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    params = {
+        "video_codec": None, "width": None, "height": None, "fps": None, "pix_fmt": None,
+        "audio_codec": None, "sample_rate": None, "channels": None
+    }
+    if video:
+        params.update({
+            "video_codec": video.get("codec_name"),
+            "width": video.get("width"),
+            "height": video.get("height"),
+            "fps": Fraction(video["r_frame_rate"]) if video.get("r_frame_rate") else None,
+            "pix_fmt": video.get("pix_fmt")
+        })
+    if audio:
+        params.update({
+            "audio_codec": audio.get("codec_name"),
+            "sample_rate": int(audio["sample_rate"]) if audio.get("sample_rate") else None,
+            "channels": audio.get("channels")
+        })
+    return params
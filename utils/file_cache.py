@@ -0,0 +1,300 @@
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Ghi nhớ hash của file theo (đường dẫn, mtime, kích thước) để không phải đọc lại file
+_file_digest_memo = {}
+_file_digest_lock = threading.Lock()
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Tính SHA-256 nội dung file, có ghi nhớ theo đường dẫn + mtime + kích thước"""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    with _file_digest_lock:
+        digest = _file_digest_memo.get(memo_key)
+    if digest:
+        return digest
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    with _file_digest_lock:
+        _file_digest_memo[memo_key] = digest
+    return digest
+
+
+class FileCache:
+    """Cache file trên đĩa theo khóa nội dung, tự dọn theo LRU khi vượt dung lượng tối đa
+
+    Mỗi entry là một file `<key><suffix>` trong cache_dir. Thứ tự LRU được ghi vào access log
+    (file `.access.log` chỉ ghi nối thêm) dùng chung giữa các lần chạy và các process; không
+    dùng mtime vì entry được hard link ra thư mục phiên, đổi mtime entry là đổi mtime cả file
+    của phiên. Giới hạn dung lượng được tính trên toàn bộ thư mục cache (quét đĩa mỗi lần ghi),
+    nên đúng cả khi nhiều process cùng ghi vào một cache.
+    Process khác dùng chung thư mục có thể dọn một entry bất kỳ lúc nào, nên file cần dùng lâu
+    hơn một lần đọc phải được đưa ra thư mục riêng bằng link_to.
+    """
+
+    ACCESS_LOG = ".access.log"
+    # File tạm cũ hơn ngưỡng này mới là file sót lại; file mới hơn có thể đang được process khác ghi
+    STALE_TMP_SECONDS = 3600
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (tên file, kích thước), từ ít dùng đến mới dùng
+        self._total_bytes = 0
+        self._access_log_path = os.path.join(cache_dir, self.ACCESS_LOG)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with self._lock:
+            self._scan()
+
+    @staticmethod
+    def make_key(*parts):
+        """Tạo khóa cache từ các thành phần (chuỗi, số, dict...)"""
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _read_access_log(self):
+        """Đọc access log, trả về (key -> vị trí lần dùng gần nhất, số dòng)"""
+        order = {}
+        count = 0
+        try:
+            with open(self._access_log_path, "r", encoding="utf-8") as f:
+                for count, line in enumerate(f, 1):
+                    key = line.strip()
+                    if key:
+                        order[key] = count
+        except OSError:
+            pass
+        return order, count
+
+    def _touch(self, key):
+        """Ghi nhận key vừa được dùng (ghi nối thêm một dòng, an toàn khi nhiều process cùng ghi)"""
+        try:
+            with open(self._access_log_path, "a", encoding="utf-8") as f:
+                f.write(f"{key}\n")
+        except OSError:
+            pass
+
+    def _scan(self):
+        """Quét thư mục cache: dựng lại danh sách entry theo thứ tự LRU và tổng dung lượng trên đĩa
+
+        Entry chưa có trong access log (ví dụ cache tạo từ phiên bản cũ) được xếp trước theo mtime.
+        File tạm còn sót từ lần chạy bị ngắt được xóa. Gọi khi đang giữ self._lock.
+        """
+        order, log_lines = self._read_access_log()
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("."):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path):
+                continue
+            if name.endswith(".tmp"):
+                if now - stat.st_mtime > self.STALE_TMP_SECONDS:
+                    self._remove_file(name)
+                continue
+            key = name.split(".", 1)[0]
+            rank = (1, order[key]) if key in order else (0, stat.st_mtime)
+            entries.append((rank, key, name, stat.st_size))
+
+        self._entries.clear()
+        self._total_bytes = 0
+        for _, key, name, size in sorted(entries):
+            self._entries[key] = (name, size)
+            self._total_bytes += size
+
+        # Access log chỉ ghi nối thêm nên được thu gọn khi quá dài so với số entry
+        if log_lines > 2 * len(self._entries) + 64:
+            self._compact_access_log()
+
+    def _compact_access_log(self):
+        """Ghi lại access log chỉ với lần dùng gần nhất của các entry còn trên đĩa"""
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.writelines(f"{key}\n" for key in self._entries)
+            os.replace(tmp_path, self._access_log_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _files_for_key(self, key):
+        """Liệt kê các file của key trên đĩa (kể cả do process khác ghi): [(mtime, tên file, kích thước)]"""
+        files = []
+        for path in glob.glob(os.path.join(glob.escape(self.cache_dir), f"{key}*")):
+            name = os.path.basename(path)
+            if name != key and not name.startswith(f"{key}."):
+                continue
+            if name.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name, stat.st_size))
+        return files
+
+    def _find_on_disk(self, key):
+        """Tìm entry của key trên đĩa; trả về (tên file, kích thước) của bản mới nhất hoặc None"""
+        files = self._files_for_key(key)
+        return max(files)[1:] if files else None
+
+    def get(self, key):
+        """Trả về đường dẫn file trong cache hoặc None nếu không có"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not os.path.exists(os.path.join(self.cache_dir, entry[0])):
+                # File đã bị process khác dọn
+                self._total_bytes -= entry[1]
+                del self._entries[key]
+                entry = None
+            if not entry:
+                # Entry có thể do process khác dùng chung thư mục ghi vào
+                entry = self._find_on_disk(key)
+                if entry:
+                    self._entries[key] = entry
+                    self._total_bytes += entry[1]
+            if not entry:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self._touch(key)
+            return os.path.join(self.cache_dir, entry[0])
+
+    def put_bytes(self, key, data, suffix=""):
+        """Lưu dữ liệu bytes vào cache và trả về đường dẫn file trong cache"""
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return self._commit(key, tmp_path, suffix)
+
+    def put_file(self, key, src_path, suffix=""):
+        """Sao chép một file vào cache và trả về đường dẫn file trong cache"""
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        os.close(fd)
+        shutil.copyfile(src_path, tmp_path)
+        return self._commit(key, tmp_path, suffix)
+
+    def _commit(self, key, tmp_path, suffix):
+        """Đổi tên file tạm thành entry (atomic) rồi dọn cache nếu thư mục vượt dung lượng"""
+        name = f"{key}{suffix}"
+        path = os.path.join(self.cache_dir, name)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            # Bỏ bản cũ của key nếu phần mở rộng khác (ví dụ ảnh đổi định dạng)
+            for _, old_name, _ in self._files_for_key(key):
+                if old_name != name:
+                    self._remove_file(old_name)
+            self._touch(key)
+            self._evict()
+        return path
+
+    def link_to(self, key, dest_path, keep_suffix=False):
+        """Đưa file trong cache ra dest_path (hard link, nếu không được thì sao chép)
+
+        keep_suffix=True thay phần mở rộng của dest_path bằng phần mở rộng của entry.
+
+        Returns:
+            đường dẫn đích nếu cache có entry, None nếu không
+        """
+        path = self.get(key)
+        if not path:
+            return None
+
+        if keep_suffix:
+            name = os.path.basename(path)
+            suffix = name[name.index("."):] if "." in name else ""
+            dest_path = os.path.splitext(dest_path)[0] + suffix
+
+        if os.path.abspath(path) == os.path.abspath(dest_path):
+            return dest_path
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        try:
+            try:
+                os.link(path, dest_path)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                shutil.copyfile(path, dest_path)
+        except FileNotFoundError:
+            if os.path.exists(path):
+                raise
+            # Entry bị process khác dọn ngay sau khi tra cache: coi như không có trong cache
+            self._forget(key)
+            return None
+        return dest_path
+
+    def _forget(self, key):
+        """Bỏ entry mà file đã bị process khác xóa, tính lần tra cache vừa rồi là miss"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self._total_bytes -= entry[1]
+            self.hits -= 1
+            self.misses += 1
+
+    def _evict(self):
+        """Xóa các entry ít dùng nhất cho đến khi tổng dung lượng thư mục cache nằm trong giới hạn
+
+        Dung lượng được quét lại từ đĩa nên tính cả entry do các process khác ghi. Hai process
+        cùng dọn một lúc chỉ có thể xóa trùng một file (lỗi được bỏ qua).
+        """
+        self._scan()
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, (name, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._remove_file(name)
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+
+    def stats(self):
+        """Thống kê hit/miss và dung lượng hiện tại của cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes
+            }
+
+    def clear(self):
+        """Xóa toàn bộ entry trong cache (kể cả entry do process khác ghi) và access log"""
+        with self._lock:
+            self._scan()
+            for name, _ in self._entries.values():
+                self._remove_file(name)
+            self._remove_file(self.ACCESS_LOG)
+            self._entries.clear()
+            self._total_bytes = 0
@@ -0,0 +1,231 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from utils.config import DEFAULT_CONFIG
+from utils.tracing import tracer
+from utils.process_utils import pid_alive
+
+# Các loại tài nguyên được giới hạn: job chạy nền, encode video, lần gọi API tạo ảnh, lần gọi TTS
+RESOURCES = ("job", "encode", "image", "tts")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS slot_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    resource TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    held INTEGER NOT NULL DEFAULT 0,
+    requested_at REAL NOT NULL,
+    acquired_at REAL
+);
+CREATE INDEX IF NOT EXISTS slot_requests_resource ON slot_requests (resource, held, id);
+"""
+
+
+def fair_order(waiting, held_by_session):
+    """Thứ tự cấp slot cho các yêu cầu đang chờ, chia đều giữa các phiên
+
+    Mỗi lượt cấp cho phiên đang giữ ít slot nhất (cùng số slot thì phiên chờ lâu hơn trước),
+    nên một phiên gửi nhiều yêu cầu không chiếm hết slot của các phiên khác.
+
+    Args:
+        waiting: danh sách (request_id, session_id) theo thứ tự gửi
+        held_by_session: dict session_id -> số slot đang giữ
+
+    Returns:
+        list: request_id theo thứ tự sẽ được cấp slot
+    """
+    held = dict(held_by_session)
+    queues = {}
+    for request_id, session_id in waiting:
+        queues.setdefault(session_id, []).append(request_id)
+
+    order = []
+    while queues:
+        session_id = min(queues, key=lambda session: (held.get(session, 0), queues[session][0]))
+        order.append(queues[session_id].pop(0))
+        held[session_id] = held.get(session_id, 0) + 1
+        if not queues[session_id]:
+            del queues[session_id]
+    return order
+
+
+class ResourceGovernor:
+    """Giới hạn số job, encode, lần gọi tạo ảnh và TTS chạy cùng lúc trên cả máy chủ
+
+    Slot được ghi trong một file SQLite dùng chung, nên giới hạn áp dụng cho mọi thread, mọi
+    phiên Streamlit, process job chạy nền và process render. Khi hết slot, các yêu cầu xếp
+    hàng và được cấp lần lượt chia đều theo phiên (xem fair_order). Slot của process đã dừng
+    được tự thu hồi.
+    """
+
+    def __init__(self, db_path=None, slots=None, poll_interval=0.05, enabled=None):
+        """
+        db_path: đường dẫn file SQLite (mặc định DEFAULT_CONFIG['governor_db'])
+        slots: dict tài nguyên -> số slot (mặc định DEFAULT_CONFIG['<tài nguyên>_slots'], 0 = không giới hạn)
+        poll_interval: thời gian chờ ban đầu giữa hai lần kiểm tra slot (giây)
+        enabled: False = không giới hạn gì (mặc định DEFAULT_CONFIG['governor_enabled'], None = tắt)
+        """
+        self.db_path = db_path or DEFAULT_CONFIG['governor_db']
+        self.slots = dict(slots) if slots is not None else {
+            resource: DEFAULT_CONFIG.get(f"{resource}_slots", 0) for resource in RESOURCES
+        }
+        self.poll_interval = poll_interval
+        self.enabled = bool(DEFAULT_CONFIG.get('governor_enabled')) if enabled is None else enabled
+        self.session_id = f"pid-{os.getpid()}"
+        self._schema_ready = False
+        self._lock = threading.Lock()
+
+    def set_session(self, session_id):
+        """Phiên làm việc của process hiện tại (slot được chia đều theo phiên)"""
+        self.session_id = session_id
+
+    def set_enabled(self, enabled):
+        """Bật/tắt giới hạn slot trong process hiện tại (ví dụ lần chạy CLI với --governor)"""
+        self.enabled = enabled
+
+    def enable_for_server(self):
+        """Bật giới hạn slot cho process phục vụ nhiều người dùng (Streamlit, job chạy nền)
+
+        Vẫn tắt nếu GOVERNOR_ENABLED=false.
+        """
+        self.enabled = DEFAULT_CONFIG.get('governor_enabled') is not False
+
+    def configure(self, resource, slots):
+        """Thay đổi số slot của một tài nguyên (0 = không giới hạn)"""
+        self.slots[resource] = slots
+
+    def _connect(self):
+        # Tự quản lý transaction để dùng BEGIN IMMEDIATE khi cấp slot
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        with self._lock:
+            if not self._schema_ready:
+                os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                self._schema_ready = True
+        return conn
+
+    @staticmethod
+    def _remove_dead(conn):
+        """Thu hồi slot và yêu cầu của các process đã dừng"""
+        pids = [row[0] for row in conn.execute("SELECT DISTINCT pid FROM slot_requests")]
+        dead = [pid for pid in pids if not pid_alive(pid)]
+        if dead:
+            conn.executemany("DELETE FROM slot_requests WHERE pid = ?", [(pid,) for pid in dead])
+
+    @staticmethod
+    def _resource_state(conn, resource):
+        """(số slot đang giữ theo phiên, danh sách (request_id, session_id) đang chờ)"""
+        held_by_session = dict(conn.execute(
+            "SELECT session_id, COUNT(*) FROM slot_requests WHERE resource = ? AND held = 1 GROUP BY session_id",
+            (resource,)
+        ).fetchall())
+        waiting = conn.execute(
+            "SELECT id, session_id FROM slot_requests WHERE resource = ? AND held = 0 ORDER BY id", (resource,)
+        ).fetchall()
+        return held_by_session, waiting
+
+    def _request(self, resource):
+        """Ghi yêu cầu slot vào hàng đợi, trả về request_id (None nếu không dùng được file SQLite)"""
+        try:
+            conn = self._connect()
+            try:
+                cursor = conn.execute(
+                    "INSERT INTO slot_requests (resource, session_id, pid, requested_at) VALUES (?, ?, ?, ?)",
+                    (resource, self.session_id, os.getpid(), time.time())
+                )
+                return cursor.lastrowid
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"Không thể dùng bộ điều phối tài nguyên, chạy không giới hạn: {e}")
+            return None
+
+    def _try_acquire(self, request_id, resource, limit):
+        """Nhận slot nếu yêu cầu nằm trong số yêu cầu được cấp tiếp theo"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._remove_dead(conn)
+                held_by_session, waiting = self._resource_state(conn, resource)
+                free = limit - sum(held_by_session.values())
+                granted = free > 0 and request_id in fair_order(waiting, held_by_session)[:free]
+                if granted:
+                    conn.execute("UPDATE slot_requests SET held = 1, acquired_at = ? WHERE id = ?",
+                                 (time.time(), request_id))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return granted
+        finally:
+            conn.close()
+
+    def _release(self, request_id):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM slot_requests WHERE id = ?", (request_id,))
+        finally:
+            conn.close()
+
+    @contextmanager
+    def slot(self, resource):
+        """Giữ một slot của tài nguyên trong khối lệnh, chờ theo hàng đợi nếu đã hết slot"""
+        limit = self.slots.get(resource, 0) if self.enabled else 0
+        request_id = self._request(resource) if limit > 0 else None
+        if request_id is None:
+            yield
+            return
+
+        try:
+            start = time.monotonic()
+            delay = self.poll_interval
+            while not self._try_acquire(request_id, resource, limit):
+                time.sleep(delay)
+                delay = min(delay * 1.5, 1.0)
+            waited = time.monotonic() - start
+            if waited >= self.poll_interval:
+                tracer.add_event("slot_wait", resource=resource, wait_s=round(waited, 3))
+            yield
+        finally:
+            self._release(request_id)
+
+    def queue_status(self, session_id=None):
+        """Trạng thái hàng đợi của từng tài nguyên có giới hạn
+
+        Returns:
+            dict: tài nguyên -> {slots, held, waiting, session_held, session_waiting,
+                  position (vị trí của yêu cầu đầu tiên của phiên trong hàng đợi, None nếu không chờ)}
+        """
+        session_id = session_id or self.session_id
+        status = {}
+        conn = self._connect()
+        try:
+            for resource, limit in self.slots.items():
+                if limit <= 0:
+                    continue
+                held_by_session, waiting = self._resource_state(conn, resource)
+                sessions = dict(waiting)
+                order = fair_order(waiting, held_by_session)
+                position = next(
+                    (index + 1 for index, request_id in enumerate(order) if sessions[request_id] == session_id), None
+                )
+                status[resource] = {
+                    "slots": limit,
+                    "held": sum(held_by_session.values()),
+                    "waiting": len(waiting),
+                    "session_held": held_by_session.get(session_id, 0),
+                    "session_waiting": sum(1 for _, waiting_session in waiting if waiting_session == session_id),
+                    "position": position
+                }
+        finally:
+            conn.close()
+        return status
+
+
+# Tạo instance mặc định
+governor = ResourceGovernor()
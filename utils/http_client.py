@@ -0,0 +1,179 @@
+import time
+import random
+import threading
+import email.utils
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from utils.metrics import run_metrics
+
+# Timeout mặc định (giây): (kết nối, đọc)
+DEFAULT_TIMEOUT = (10, 120)
+
+# Số kết nối đồng thời tối đa tới mỗi host
+HOST_CONCURRENCY_LIMITS = {
+    "api.stability.ai": 4,
+    "api.telegram.org": 2
+}
+DEFAULT_HOST_CONCURRENCY = 8
+
+# Mã lỗi HTTP nên thử lại
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Method gửi lại nhiều lần vẫn cho cùng kết quả. POST/PATCH (tạo ảnh, gửi tin nhắn Telegram...)
+# chỉ được thử lại khi chắc chắn server chưa nhận request
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+def _request_not_sent(error):
+    """Lỗi xảy ra trước khi request được gửi đi (không kết nối được tới server)"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # requests bọc lỗi urllib3: MaxRetryError(reason=NewConnectionError) khi chưa mở được kết nối
+    reason = getattr(error.args[0], "reason", error.args[0])
+    return isinstance(reason, NewConnectionError)
+
+
+def should_retry_error(method, error):
+    """Có nên thử lại request sau lỗi kết nối/timeout không
+
+    Với method không idempotent, ReadTimeout hay kết nối bị ngắt giữa chừng có thể xảy ra sau khi
+    server đã xử lý request (ảnh đã tạo, tin nhắn đã gửi), nên chỉ thử lại khi request chưa được gửi.
+    """
+    if method.upper() in IDEMPOTENT_METHODS:
+        return isinstance(error, (requests.ConnectionError, requests.Timeout))
+    return _request_not_sent(error)
+
+
+def should_retry_status(method, status_code):
+    """Có nên thử lại request khi nhận mã lỗi status_code không
+
+    Với method không idempotent chỉ thử lại 429 (server từ chối vì giới hạn tần suất, chưa xử lý
+    request); lỗi 5xx có thể đến sau khi request đã được xử lý một phần.
+    """
+    if method.upper() in IDEMPOTENT_METHODS:
+        return status_code in RETRY_STATUS_CODES
+    return status_code == 429
+
+
+def parse_retry_after(value):
+    """Đọc header Retry-After (số giây hoặc HTTP-date), trả về số giây cần chờ hoặc None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class HttpClient:
+    """Transport HTTP dùng chung cho các provider
+
+    Giữ kết nối keep-alive trong một Session dùng chung, luôn đặt timeout kết nối/đọc,
+    giới hạn số kết nối đồng thời theo host và thử lại với exponential backoff có jitter
+    (tôn trọng Retry-After khi bị 429/503). POST/PATCH chỉ được thử lại khi request chưa
+    được gửi đi hoặc bị 429 (xem should_retry_error, should_retry_status).
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_retries=3, backoff_base=1.0, backoff_max=60.0):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        pool_size = max([DEFAULT_HOST_CONCURRENCY] + list(HOST_CONCURRENCY_LIMITS.values()))
+        # Việc thử lại do HttpClient đảm nhận, adapter không tự thử lại
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._host_semaphores = {}
+        self._host_semaphores_lock = threading.Lock()
+
+    def _get_host_semaphore(self, url):
+        """Lấy semaphore giới hạn số kết nối đồng thời tới host của url"""
+        host = urlparse(url).hostname or ""
+        with self._host_semaphores_lock:
+            if host not in self._host_semaphores:
+                limit = HOST_CONCURRENCY_LIMITS.get(host, DEFAULT_HOST_CONCURRENCY)
+                self._host_semaphores[host] = threading.BoundedSemaphore(limit)
+            return self._host_semaphores[host]
+
+    def _backoff_delay(self, attempt, response=None):
+        """Thời gian chờ trước lần thử tiếp theo: Retry-After nếu có, nếu không thì backoff có jitter"""
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return delay + random.uniform(0, delay / 2)
+
+    @staticmethod
+    def _rewind_files(files):
+        """Đưa con trỏ các file upload về đầu để gửi lại ở lần thử sau"""
+        if not files:
+            return
+        values = files.values() if isinstance(files, dict) else [item[1] for item in files]
+        for value in values:
+            file_obj = value[1] if isinstance(value, (tuple, list)) else value
+            if hasattr(file_obj, "seek"):
+                file_obj.seek(0)
+
+    def request(self, method, url, timeout=None, max_retries=None, **kwargs):
+        """Gửi request, thử lại khi lỗi kết nối/timeout hoặc gặp mã lỗi tạm thời (theo method)
+
+        Returns:
+            requests.Response của lần thử cuối (có thể là response lỗi nếu hết số lần thử)
+
+        Raises:
+            requests.RequestException nếu lần thử cuối vẫn lỗi kết nối/timeout
+        """
+        timeout = timeout or self.timeout
+        max_retries = self.max_retries if max_retries is None else max_retries
+        semaphore = self._get_host_semaphore(url)
+
+        for attempt in range(max_retries + 1):
+            if attempt:
+                self._rewind_files(kwargs.get("files"))
+
+            try:
+                with semaphore:
+                    response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= max_retries or not should_retry_error(method, e):
+                    raise
+                delay = self._backoff_delay(attempt)
+                print(f"Lỗi kết nối tới {urlparse(url).hostname} ({e.__class__.__name__}), thử lại sau {delay:.1f}s...")
+                run_metrics.note_retry()
+                time.sleep(delay)
+                continue
+
+            if attempt >= max_retries or not should_retry_status(method, response.status_code):
+                return response
+
+            delay = self._backoff_delay(attempt, response)
+            print(f"{urlparse(url).hostname} trả về {response.status_code}, thử lại sau {delay:.1f}s...")
+            response.close()
+            run_metrics.note_retry()
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+# Tạo instance mặc định
+http_client = HttpClient()
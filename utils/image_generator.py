@@ -1,44 +1,103 @@
 import os
 import json
+import hashlib
 import base64
-import requests
-import google.generativeai as genai
-from io import BytesIO
-from PIL import Image
 from tqdm import tqdm
 import re
-from utils.config import GOOGLE_API_KEY, OPENAI_API_KEY, STABILITY_API_KEY, ZHIPUAI_API_KEY
+import threading
+from concurrent.futures import as_completed, wait, FIRST_COMPLETED
+from utils.config import STABILITY_API_KEY, DEFAULT_CONFIG
+from utils.rate_limiter import get_rate_limiter
+from utils.file_cache import FileCache
+from utils.http_client import http_client, DEFAULT_TIMEOUT
+from utils.image_utils import save_image_bytes, detect_image_file_format, normalize_image_file
+from utils.providers import get_provider, get_provider_mode
+from utils.metrics import run_metrics, text_size, file_size
+from utils.tracing import tracer, traced, TracedThreadPoolExecutor
+from utils.governor import governor
+
+# Tham số gọi API của từng model (cũng là một phần của khóa cache ảnh)
+IMAGE_MODEL_PARAMS = {
+    "gemini": {"model": "gemini-2.0-flash-exp-image-generation"},
+    "stable_diffusion": {
+        "engine": "stable-diffusion-v1-5",
+        "cfg_scale": 7,
+        "height": 512,
+        "width": 512,
+        "samples": 1,
+        "steps": 30
+    },
+    "cogview4": {"model": "cogview-4"}
+}
+
+_image_cache = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache():
+    """Cache ảnh đã tạo dùng chung trong process (khởi tạo khi cần)"""
+    global _image_cache
+    with _image_cache_lock:
+        if _image_cache is None:
+            _image_cache = FileCache(
+                os.path.join(DEFAULT_CONFIG['temp_dir'], "image_cache"),
+                max_bytes=DEFAULT_CONFIG['image_cache_max_mb'] * 1024 * 1024
+            )
+        return _image_cache
 
 class ImageGenerator:
-    def __init__(self, model_type="gemini"):
+    def __init__(self, model_type="gemini", max_workers=4, use_cache=True, normalize_size=None, normalize_workers=2,
+                 checkpoint=None):
         """
         Khởi tạo generator với model được chọn
         model_type: 'gemini', 'stable_diffusion', hoặc 'cogview4'
+        max_workers: số ảnh được tạo đồng thời trong một chương (tốc độ gọi API vẫn bị giới hạn theo provider)
+        use_cache: dùng lại ảnh đã tạo cho cùng model, tham số và prompt
+        normalize_size: (width, height) của video; nếu có, mỗi ảnh được crop/resize sẵn thành frame
+                        đúng kích thước này ngay khi tạo xong (None = để bước render tự resize)
+        normalize_workers: số thread chuẩn hóa ảnh chạy nền trong lúc các ảnh khác đang được tạo
+        checkpoint: CheckpointManifest để ghi lại/dùng lại từng ảnh đã tạo
         """
         self.model_type = model_type
+        self.max_workers = max(1, max_workers)
+        self.normalize_size = tuple(normalize_size) if normalize_size else None
+        self.normalize_workers = max(1, normalize_workers)
+        self.checkpoint = checkpoint
         self.characters_info = {}  # Lưu trữ thông tin nhân vật để đảm bảo tính nhất quán
+        self.model_params = dict(IMAGE_MODEL_PARAMS.get(model_type, {}))
+        self.cache = get_image_cache() if use_cache else None
+        # Định dạng lưu ảnh: None = giữ nguyên định dạng provider trả về
+        self.image_format = DEFAULT_CONFIG['image_format']
+        self.image_quality = DEFAULT_CONFIG['image_quality']
         
         if model_type == "gemini":
-            genai.configure(api_key=GOOGLE_API_KEY)
-            self.model = genai.GenerativeModel("gemini-2.0-flash-exp-image-generation")
+            self.model = get_provider("gemini", self.model_params["model"])
         elif model_type == "stable_diffusion":
-            if not STABILITY_API_KEY:
+            if not STABILITY_API_KEY and get_provider_mode() == "live":
                 raise ValueError("Thiếu API key cho Stability AI")
             # Sử dụng API Stability AI
-            self.api_host = 'https://api.stability.ai'
+            self.api_host = get_provider("stability_api")
             self.api_key = STABILITY_API_KEY
         elif model_type == "cogview4":
-            if not ZHIPUAI_API_KEY:
-                raise ValueError("Thiếu API key cho ZhipuAI (CogView4)")
             # Sử dụng API ZhipuAI cho CogView4
-            import zhipuai
-            zhipuai.api_key = ZHIPUAI_API_KEY
-            self.zhipuai = zhipuai
+            # Dùng một client cho mọi ảnh để giữ kết nối, thử lại khi lỗi được giao cho SDK
+            self.zhipuai_client = get_provider(
+                "zhipuai",
+                timeout=DEFAULT_TIMEOUT[1],
+                max_retries=http_client.max_retries
+            )
         else:
             raise ValueError(f"Model không được hỗ trợ: {model_type}")
         
         # Khởi tạo prompt model
-        self.prompt_model = genai.GenerativeModel("gemini-2.0-flash")
+        self.prompt_model = get_provider("gemini", "gemini-2.0-flash")
+    
+    def _prompt_model_text(self, stage, prompt, **kwargs):
+        """Gọi prompt model, ghi thời gian và dung lượng vào run_metrics, trả về văn bản phản hồi"""
+        with run_metrics.measure(stage, bytes_in=text_size(prompt)) as event:
+            response_text = self.prompt_model.generate_content(prompt, **kwargs).text
+            event["bytes_out"] = text_size(response_text)
+        return response_text
     
     def _extract_character_info(self, story_data):
         """Phân tích nội dung truyện để trích xuất thông tin nhân vật và ngữ cảnh"""
@@ -104,8 +163,8 @@ class ImageGenerator:
             """
             
             try:
-                response = self.prompt_model.generate_content(prompt)
-                response_text = response.text
+                get_rate_limiter("gemini_text").acquire()
+                response_text = self._prompt_model_text("image.analysis", prompt)
                 
                 # Trích xuất phần JSON
                 json_match = re.search(r'```json\s*({.*?})\s*```', response_text, re.DOTALL)
@@ -158,8 +217,8 @@ class ImageGenerator:
             """
             
             try:
-                response = self.prompt_model.generate_content(prompt)
-                response_text = response.text
+                get_rate_limiter("gemini_text").acquire()
+                response_text = self._prompt_model_text("image.analysis", prompt)
                 
                 # Trích xuất phần JSON
                 json_match = re.search(r'```json\s*({.*?})\s*```', response_text, re.DOTALL)
@@ -256,72 +315,172 @@ class ImageGenerator:
             Trả về prompt đơn giản, chỉ chứa thông tin tối thiểu cần thiết, không quá 200 từ.
             """
             
-            response = self.prompt_model.generate_content(prompt_request)
-            base_prompt = response.text.strip()
-            
-            # Thêm thông tin nhân vật nhất quán
-            character_info = ""
-            if self.characters_info and "characters" in self.characters_info:
-                for character in self.characters_info["characters"]:
-                    if character["name"].lower() in segment.lower():
-                        character_info += f"Character {character['name']}: {character['gender']}, {character['appearance']}. "
-            
-            # Thêm thông tin về bối cảnh và phong cách
-            setting_info = ""
-            style_info = ""
-            
-            if "setting" in self.characters_info:
-                setting = self.characters_info["setting"]
-                setting_details = []
-                
-                if setting.get("era"):
-                    setting_details.append(f"Time period: {setting['era']}")
-                if setting.get("location"):
-                    setting_details.append(f"Location: {setting['location']}")
-                if setting.get("culture"):
-                    setting_details.append(f"Cultural elements: {setting['culture']}")
-                if setting.get("environment"):
-                    setting_details.append(f"Environment: {setting['environment']}")
-                if setting.get("atmosphere"):
-                    setting_details.append(f"Atmosphere: {setting['atmosphere']}")
-                
-                if setting_details:
-                    setting_info = "Setting: " + ". ".join(setting_details) + ". "
-            
-            if "style" in self.characters_info:
-                style = self.characters_info["style"]
-                style_details = []
-                
-                if style.get("genre"):
-                    style_details.append(f"Genre: {style['genre']}")
-                if style.get("color_tone"):
-                    style_details.append(f"Color tone: {style['color_tone']}")
-                if style.get("art_style"):
-                    style_details.append(f"Art style: {style['art_style']}")
-                
-                if style_details:
-                    style_info = "Style: " + ". ".join(style_details) + ". "
-            
-            # Kết hợp thông tin
-            final_prompt = f"{base_prompt}\n\n{character_info}\n\n{setting_info}\n\n{style_info}"
-            
-            # Tối ưu hóa prompt cho từng model
-            if self.model_type == "cogview4":
-                final_prompt = f"High quality, detailed illustration. {final_prompt}"
-            elif self.model_type == "stable_diffusion":
-                final_prompt = f"Detailed and realistic illustration. {final_prompt}"
-            elif self.model_type == "gemini":
-                final_prompt = f"Create a detailed illustration for this scene: {final_prompt}"
+            get_rate_limiter("gemini_text").acquire()
+            base_prompt = self._prompt_model_text("image.prompt", prompt_request).strip()
             
-            return final_prompt
+            return self._finalize_prompt(base_prompt, segment)
             
         except Exception as e:
             print(f"Lỗi khi tạo prompt có cấu trúc: {e}")
             return f"Illustration of: {segment[:200]}"
     
+    def _finalize_prompt(self, base_prompt, segment):
+        """Thêm thông tin nhân vật, bối cảnh, phong cách và tiền tố theo model vào prompt cơ sở"""
+        # Thêm thông tin nhân vật nhất quán
+        character_info = ""
+        if self.characters_info and "characters" in self.characters_info:
+            for character in self.characters_info["characters"]:
+                if character["name"].lower() in segment.lower():
+                    character_info += f"Character {character['name']}: {character['gender']}, {character['appearance']}. "
+        
+        # Thêm thông tin về bối cảnh và phong cách
+        setting_info = ""
+        style_info = ""
+        
+        if "setting" in self.characters_info:
+            setting = self.characters_info["setting"]
+            setting_details = []
+            
+            if setting.get("era"):
+                setting_details.append(f"Time period: {setting['era']}")
+            if setting.get("location"):
+                setting_details.append(f"Location: {setting['location']}")
+            if setting.get("culture"):
+                setting_details.append(f"Cultural elements: {setting['culture']}")
+            if setting.get("environment"):
+                setting_details.append(f"Environment: {setting['environment']}")
+            if setting.get("atmosphere"):
+                setting_details.append(f"Atmosphere: {setting['atmosphere']}")
+            
+            if setting_details:
+                setting_info = "Setting: " + ". ".join(setting_details) + ". "
+        
+        if "style" in self.characters_info:
+            style = self.characters_info["style"]
+            style_details = []
+            
+            if style.get("genre"):
+                style_details.append(f"Genre: {style['genre']}")
+            if style.get("color_tone"):
+                style_details.append(f"Color tone: {style['color_tone']}")
+            if style.get("art_style"):
+                style_details.append(f"Art style: {style['art_style']}")
+            
+            if style_details:
+                style_info = "Style: " + ". ".join(style_details) + ". "
+        
+        # Kết hợp thông tin
+        final_prompt = f"{base_prompt}\n\n{character_info}\n\n{setting_info}\n\n{style_info}"
+        
+        # Tối ưu hóa prompt cho từng model
+        if self.model_type == "cogview4":
+            final_prompt = f"High quality, detailed illustration. {final_prompt}"
+        elif self.model_type == "stable_diffusion":
+            final_prompt = f"Detailed and realistic illustration. {final_prompt}"
+        elif self.model_type == "gemini":
+            final_prompt = f"Create a detailed illustration for this scene: {final_prompt}"
+        
+        return final_prompt
+    
+    def _parse_json_response(self, response_text):
+        """Lấy phần JSON (object hoặc array) từ phản hồi của LLM"""
+        json_match = re.search(r'```(?:json)?\s*([\[{].*?[\]}])\s*```', response_text, re.DOTALL)
+        if json_match:
+            response_text = json_match.group(1)
+        return json.loads(response_text.strip())
+    
+    def prompt_batch_size(self):
+        """Số đoạn mỗi batch prompt sao cho phản hồi (ước lượng theo token) vừa giới hạn đầu ra của LLM"""
+        return max(1, DEFAULT_CONFIG['prompt_batch_output_tokens'] // DEFAULT_CONFIG['prompt_tokens_per_image'])
+    
+    def generate_structured_prompts_batch(self, segments, chapter_num=1, batch_size=None):
+        """Tạo prompt có cấu trúc cho nhiều đoạn bằng một lần gọi LLM mỗi batch
+        
+        Returns:
+            list: prompt hoàn chỉnh cho từng đoạn theo thứ tự, None với đoạn không nhận được
+            kết quả (khi đó cần gọi generate_structured_prompt riêng cho đoạn đó)
+        """
+        batch_size = batch_size or self.prompt_batch_size()
+        prompts = []
+        for batch_start in range(0, len(segments), batch_size):
+            prompts.extend(self._request_prompt_batch(segments[batch_start:batch_start + batch_size], chapter_num))
+        return prompts
+    
+    def _request_prompt_batch(self, batch, chapter_num=1):
+        """Gọi LLM một lần để tạo prompt cho một batch đoạn văn, None với đoạn không nhận được kết quả"""
+        prompts = [None] * len(batch)
+        numbered_segments = "\n\n".join(
+            f"[{i + 1}] {segment}" for i, segment in enumerate(batch)
+        )
+        prompt_request = f"""
+        Đọc từng đoạn văn bản được đánh số dưới đây và tạo cho MỖI đoạn một prompt có cấu trúc để tạo hình ảnh minh họa.
+        Mỗi prompt gồm các phần sau:
+        
+        1. subject: Mô tả chủ thể chính của hình ảnh (nhân vật, cảnh vật chính)
+        2. action: Mô tả hành động hoặc tình huống đang diễn ra
+        3. background: Mô tả bối cảnh, phong cảnh, môi trường xung quanh
+        4. lighting: Mô tả ánh sáng, thời gian trong ngày
+        5. style: Chọn một phong cách nghệ thuật phù hợp (ví dụ: tranh vẽ truyện tranh, phong cách anime, tranh sơn dầu, ảnh chân dung, v.v.)
+        6. atmosphere: Không khí, tâm trạng, cảm xúc của cảnh
+        
+        Các đoạn văn bản:
+        {numbered_segments}
+        
+        Kết quả trả về phải là một mảng JSON, mỗi phần tử ứng với một đoạn:
+        [
+            {{
+                "index": số_thứ_tự_đoạn,
+                "subject": "...",
+                "action": "...",
+                "background": "...",
+                "lighting": "...",
+                "style": "...",
+                "atmosphere": "..."
+            }},
+            ...
+        ]
+        
+        Mỗi prompt đơn giản, chỉ chứa thông tin tối thiểu cần thiết, không quá 200 từ.
+        Chỉ trả về JSON, không thêm giải thích.
+        """
+        
+        try:
+            get_rate_limiter("gemini_text").acquire()
+            response_text = self._prompt_model_text(
+                "image.prompt_batch", prompt_request,
+                generation_config={"max_output_tokens": DEFAULT_CONFIG['prompt_batch_output_tokens']}
+            )
+            items = self._parse_json_response(response_text)
+            
+            for item in items:
+                index = int(item.get("index", 0)) - 1
+                if not 0 <= index < len(batch):
+                    continue
+                
+                base_prompt = "\n".join(
+                    f"{label}: {item[key]}"
+                    for key, label in [
+                        ("subject", "Subject"), ("action", "Action"), ("background", "Background"),
+                        ("lighting", "Lighting"), ("style", "Style"), ("atmosphere", "Atmosphere")
+                    ]
+                    if item.get(key)
+                )
+                if base_prompt:
+                    prompts[index] = self._finalize_prompt(base_prompt, batch[index])
+        except Exception as e:
+            print(f"Lỗi khi tạo prompt theo batch cho chương {chapter_num}: {e}")
+        
+        missing = sum(1 for prompt in prompts if prompt is None)
+        if missing:
+            print(f"Có {missing}/{len(batch)} prompt sẽ được tạo riêng cho từng ảnh")
+        
+        return prompts
+    
     def generate_image_gemini(self, prompt, output_path):
         """Tạo hình ảnh sử dụng Gemini image generation"""
         try:
+            get_rate_limiter("gemini").acquire()
+            
             response = self.model.generate_content(prompt)
             
             if not response.parts:
@@ -332,9 +491,8 @@ class ImageGenerator:
                 if part.inline_data and part.inline_data.mime_type.startswith('image/'):
                     # Lưu hình ảnh
                     image_data = base64.b64decode(part.inline_data.data)
-                    image = Image.open(BytesIO(image_data))
-                    image.save(output_path)
-                    return output_path
+                    result_path, _ = save_image_bytes(image_data, output_path, self.image_format, self.image_quality)
+                    return result_path
             
             print("Không nhận được hình ảnh trong phản hồi")
             return None
@@ -345,7 +503,10 @@ class ImageGenerator:
     def generate_image_stable_diffusion(self, prompt, output_path):
         """Tạo hình ảnh sử dụng Stable Diffusion API"""
         try:
-            url = f"{self.api_host}/v1/generation/stable-diffusion-v1-5/text-to-image"
+            get_rate_limiter("stable_diffusion").acquire()
+            
+            params = self.model_params
+            url = f"{self.api_host}/v1/generation/{params['engine']}/text-to-image"
             
             headers = {
                 "Content-Type": "application/json",
@@ -355,14 +516,14 @@ class ImageGenerator:
             
             payload = {
                 "text_prompts": [{"text": prompt}],
-                "cfg_scale": 7,
-                "height": 512,
-                "width": 512,
-                "samples": 1,
-                "steps": 30,
+                "cfg_scale": params["cfg_scale"],
+                "height": params["height"],
+                "width": params["width"],
+                "samples": params["samples"],
+                "steps": params["steps"],
             }
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = http_client.post(url, headers=headers, json=payload)
             
             if response.status_code != 200:
                 print(f"Lỗi khi tạo hình ảnh với Stable Diffusion: {response.text}")
@@ -372,9 +533,8 @@ class ImageGenerator:
             
             if "artifacts" in data and len(data["artifacts"]) > 0:
                 image_data = base64.b64decode(data["artifacts"][0]["base64"])
-                image = Image.open(BytesIO(image_data))
-                image.save(output_path)
-                return output_path
+                result_path, _ = save_image_bytes(image_data, output_path, self.image_format, self.image_quality)
+                return result_path
             
             return None
             
@@ -385,13 +545,10 @@ class ImageGenerator:
     def generate_image_cogview4(self, prompt, output_path):
         """Tạo hình ảnh sử dụng CogView4 API"""
         try:
-            # Sửa lại cách gọi API ZhipuAI cho phù hợp với phiên bản mới
-            import zhipuai
+            get_rate_limiter("cogview4").acquire()
             
-            # Sử dụng ZhipuAI API theo cách mới
-            client = zhipuai.ZhipuAI(api_key=ZHIPUAI_API_KEY)
-            response = client.images.generations(
-                model="cogview-4",
+            response = self.zhipuai_client.images.generations(
+                model=self.model_params["model"],
                 prompt=prompt
             )
             
@@ -399,11 +556,12 @@ class ImageGenerator:
                 image_url = response.data[0].url
                 
                 # Tải hình ảnh từ URL
-                img_response = requests.get(image_url)
+                img_response = http_client.get(image_url)
                 if img_response.status_code == 200:
-                    with open(output_path, "wb") as f:
-                        f.write(img_response.content)
-                    return output_path
+                    result_path, _ = save_image_bytes(
+                        img_response.content, output_path, self.image_format, self.image_quality
+                    )
+                    return result_path
             
             print("Không nhận được hình ảnh trong phản hồi CogView4")
             return None
@@ -411,25 +569,71 @@ class ImageGenerator:
         except Exception as e:
             print(f"Lỗi khi tạo hình ảnh với CogView4: {e}")
             # Fallback sang Gemini nếu CogView4 có lỗi
+            tracer.add_event("fallback", from_provider="cogview4", to_provider="gemini", error=str(e))
             print("Chuyển sang sử dụng Gemini để tạo hình ảnh...")
             return self.generate_image_gemini(prompt, output_path)
     
-    def generate_image(self, prompt, output_path):
-        """Tạo hình ảnh từ prompt sử dụng model đã chọn"""
-        if self.model_type == "gemini":
-            return self.generate_image_gemini(prompt, output_path)
-        elif self.model_type == "stable_diffusion":
-            return self.generate_image_stable_diffusion(prompt, output_path)
-        elif self.model_type == "cogview4":
-            return self.generate_image_cogview4(prompt, output_path)
+    def _cache_key(self, prompt):
+        """Khóa cache của một ảnh: chế độ provider, model, tham số của model và hash của prompt hoàn chỉnh"""
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return FileCache.make_key("image", get_provider_mode(), self.model_type, self.model_params,
+                                  self.image_format, self.image_quality, prompt_hash)
     
-    def process_chapter(self, chapter_text, chapter_num, output_dir="output/images"):
-        """Xử lý một chương và tạo nhiều hình ảnh"""
-        os.makedirs(output_dir, exist_ok=True)
+    def generate_image(self, prompt, output_path, force_regenerate=False):
+        """Tạo hình ảnh từ prompt sử dụng model đã chọn
         
-        if not isinstance(chapter_text, str):
-            print(f"Lỗi: Nội dung chapter không phải là string, mà là {type(chapter_text)}")
-            chapter_text = str(chapter_text)
+        Ảnh đã tạo cho cùng model, tham số và prompt được lấy lại từ cache;
+        force_regenerate=True luôn gọi API và thay thế ảnh trong cache.
+        """
+        cache_key = None
+        if self.cache:
+            cache_key = self._cache_key(prompt)
+            if not force_regenerate:
+                cached_path = self.cache.link_to(cache_key, output_path, keep_suffix=bool(self.image_format))
+                if cached_path:
+                    tracer.add_event("cache_hit", artifact=os.path.basename(cached_path))
+                    return cached_path
+        
+        # File cũ có thể là hard link trỏ vào cache, xóa trước để không ghi đè lên entry trong cache
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        
+        # Chờ slot tạo ảnh dùng chung của máy chủ trước khi đo thời gian gọi API
+        with governor.slot("image"), run_metrics.measure("image.generate", os.path.basename(output_path),
+                                                         bytes_in=text_size(prompt),
+                                                         provider=self.model_type) as event:
+            if self.model_type == "gemini":
+                result_path = self.generate_image_gemini(prompt, output_path)
+            elif self.model_type == "stable_diffusion":
+                result_path = self.generate_image_stable_diffusion(prompt, output_path)
+            elif self.model_type == "cogview4":
+                result_path = self.generate_image_cogview4(prompt, output_path)
+            else:
+                result_path = None
+            
+            event["bytes_out"] = file_size(result_path)
+            if not result_path:
+                event["error"] = "không tạo được hình ảnh"
+        
+        if result_path and self.cache:
+            try:
+                self.cache.put_file(cache_key, result_path, suffix=os.path.splitext(result_path)[1])
+            except OSError as e:
+                print(f"Không thể lưu ảnh vào cache: {e}")
+        
+        return result_path
+    
+    def _plan_chapter_images(self, chapter_text, chapter_num):
+        """Phân tích chương và lập danh sách ảnh cần tạo: [(đoạn văn bản, mô tả cảnh hoặc None)]"""
+        plan_id = f"images:chapter_{chapter_num}:plan"
+        plan_hash = None
+        if self.checkpoint:
+            # Kết quả phân tích của LLM thay đổi giữa các lần gọi, dùng lại để các ảnh đã tạo vẫn khớp
+            plan_hash = self.checkpoint.input_hash(chapter_text)
+            jobs = self.checkpoint.get(plan_id, plan_hash)
+            if jobs is not None:
+                print(f"Dùng lại danh sách ảnh của chương {chapter_num} từ checkpoint")
+                return [tuple(job) for job in jobs]
         
         # Phân tích chương để xác định số lượng hình ảnh phù hợp
         analysis = self.analyze_chapter_for_image_count(chapter_text, chapter_num)
@@ -439,19 +643,17 @@ class ImageGenerator:
         # Chia chương thành nhiều đoạn
         segments = self.split_text_to_segments(chapter_text)
         
-        # Nếu có cảnh được phân tích, sử dụng chúng
+        # Chuẩn bị danh sách ảnh cần tạo: (đoạn văn bản, mô tả cảnh hoặc None)
+        jobs = []
         if scenes:
+            # Nếu có cảnh được phân tích, sử dụng chúng
             print(f"Sử dụng {len(scenes)} cảnh đã phân tích cho chương {chapter_num}")
             # Lọc và sắp xếp cảnh theo mức độ quan trọng
             sorted_scenes = sorted(scenes, key=lambda x: int(x.get("importance", 1)), reverse=True)
             # Giới hạn số lượng cảnh theo image_count
             selected_scenes = sorted_scenes[:image_count]
             
-            # Tạo mô tả cho từng cảnh
-            image_paths = []
-            print(f"Đang tạo {len(selected_scenes)} hình ảnh cho chương {chapter_num}...")
-            
-            for i, scene in enumerate(tqdm(selected_scenes)):
+            for scene in selected_scenes:
                 scene_description = scene.get("description", "")
                 # Tìm đoạn văn bản tương ứng với mô tả cảnh
                 best_segment = ""
@@ -464,84 +666,235 @@ class ImageGenerator:
                 if not best_segment:
                     best_segment = scene_description
                 
-                prompt = self.generate_structured_prompt(best_segment, chapter_num)
-                output_path = os.path.join(output_dir, f"chapter_{chapter_num}_image_{i+1}.png")
-                
-                result_path = self.generate_image(prompt, output_path)
-                if result_path:
-                    image_data = {
-                        "segment_index": i,
-                        "segment_text": best_segment,
-                        "scene_description": scene_description,
-                        "prompt": prompt,
-                        "image_path": result_path
-                    }
-                    image_paths.append(image_data)
-            
-            return image_paths
+                jobs.append((best_segment, scene_description))
         else:
             # Sử dụng phương pháp chia đoạn nếu không có cảnh được phân tích
             # Giới hạn số đoạn theo image_count
-            segments = segments[:image_count]
-            
-            image_paths = []
-            print(f"Đang tạo {len(segments)} hình ảnh cho chương {chapter_num}...")
-            
-            for i, segment in enumerate(tqdm(segments)):
-                prompt = self.generate_structured_prompt(segment, chapter_num)
-                output_path = os.path.join(output_dir, f"chapter_{chapter_num}_image_{i+1}.png")
-                
-                result_path = self.generate_image(prompt, output_path)
-                if result_path:
-                    image_data = {
-                        "segment_index": i,
-                        "segment_text": segment,
-                        "prompt": prompt,
-                        "image_path": result_path
-                    }
-                    image_paths.append(image_data)
-            
-            return image_paths
+            jobs = [(segment, None) for segment in segments[:image_count]]
+        
+        if self.checkpoint:
+            self.checkpoint.put(plan_id, plan_hash, jobs)
+        return jobs
     
-    def process_story(self, story_data, output_dir="output"):
-        """Xử lý toàn bộ câu chuyện và tạo hình ảnh cho mỗi chương"""
-        images_dir = os.path.join(output_dir, "images")
-        os.makedirs(images_dir, exist_ok=True)
+    def _image_input_hash(self, segment_text, scene_description):
+        """Hash các đầu vào quyết định nội dung một ảnh (dùng cho checkpoint)"""
+        return self.checkpoint.input_hash(
+            self.model_type, self.model_params, self.image_format, self.image_quality,
+            self.normalize_size, self.characters_info, segment_text, scene_description
+        )
+    
+    def _record_image(self, chapter_num, image_data):
+        """Ghi ảnh vừa tạo xong vào checkpoint"""
+        if not self.checkpoint:
+            return
+        i = image_data["segment_index"]
+        self.checkpoint.put(
+            f"images:chapter_{chapter_num}:image_{i+1}",
+            self._image_input_hash(image_data["segment_text"], image_data.get("scene_description")),
+            image_data,
+            [image_data["image_path"], image_data.get("normalized_path")]
+        )
+    
+    @traced("image.chapter")
+    def process_chapter(self, chapter_text, chapter_num, output_dir="output/images"):
+        """Xử lý một chương và tạo nhiều hình ảnh"""
+        tracer.set_attribute("chapter_num", chapter_num)
+        tracer.set_attribute("provider", self.model_type)
+        os.makedirs(output_dir, exist_ok=True)
         
-        # Phân tích truyện để trích xuất thông tin nhân vật
-        print("Đang phân tích thông tin nhân vật để tạo hình ảnh nhất quán...")
-        self.characters_info = self._extract_character_info(story_data)
+        if not isinstance(chapter_text, str):
+            print(f"Lỗi: Nội dung chapter không phải là string, mà là {type(chapter_text)}")
+            chapter_text = str(chapter_text)
+        
+        jobs = self._plan_chapter_images(chapter_text, chapter_num)
+        
+        # Ảnh đã có trong checkpoint (đầu vào không đổi, file còn tồn tại) không cần tạo lại
+        reused = {}
+        if self.checkpoint:
+            for i, (segment_text, scene_description) in enumerate(jobs):
+                image_data = self.checkpoint.get(
+                    f"images:chapter_{chapter_num}:image_{i+1}",
+                    self._image_input_hash(segment_text, scene_description)
+                )
+                if image_data:
+                    reused[i] = image_data
+        pending = [i for i in range(len(jobs)) if i not in reused]
+        
+        if reused:
+            print(f"Dùng lại {len(reused)} hình ảnh từ checkpoint, cần tạo {len(pending)} hình ảnh cho chương {chapter_num}...")
+        else:
+            print(f"Đang tạo {len(jobs)} hình ảnh cho chương {chapter_num}...")
+        
+        # Prompt cho các ảnh còn thiếu được tạo theo batch, mỗi batch một lần gọi LLM chạy song song;
+        # batch nào xong thì ảnh của batch đó được gửi tạo ngay, không chờ các batch còn lại.
+        # Ảnh nào chưa có prompt sẽ tạo prompt riêng trong worker, song song với các ảnh khác đang chờ API
+        batch_size = self.prompt_batch_size()
+        batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+        
+        results = {}
+        images = {}
+        finalize_futures = {}
+        normalize_executor = TracedThreadPoolExecutor(max_workers=self.normalize_workers) if self.normalize_size else None
+        with TracedThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                TracedThreadPoolExecutor(max_workers=max(1, min(len(batches), self.max_workers))) as prompt_executor:
+            batch_futures = {
+                prompt_executor.submit(self._request_prompt_batch, [jobs[i][0] for i in batch], chapter_num): batch
+                for batch in batches
+            }
+            futures = {}
+            waiting = set(batch_futures)
+            with tqdm(total=len(pending)) as progress:
+                while waiting:
+                    done, waiting = wait(waiting, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in batch_futures:
+                            for i, prompt in zip(batch_futures[future], future.result()):
+                                segment_text, scene_description = jobs[i]
+                                output_path = os.path.join(output_dir, f"chapter_{chapter_num}_image_{i+1}.png")
+                                image_future = executor.submit(
+                                    self._generate_image_job, segment_text, chapter_num, output_path, prompt
+                                )
+                                futures[image_future] = i
+                                waiting.add(image_future)
+                            continue
+                        
+                        i = futures[future]
+                        results[i] = future.result()
+                        progress.update(1)
+                        if not results[i][1]:
+                            continue
+                        if normalize_executor:
+                            # Chuẩn hóa ảnh vừa tạo xong trong nền, song song với các ảnh còn đang chờ API
+                            finalize_futures[i] = normalize_executor.submit(
+                                self._finalize_image, chapter_num, i, jobs[i], *results[i]
+                            )
+                        else:
+                            images[i] = self._finalize_image(chapter_num, i, jobs[i], *results[i])
+        
+        if normalize_executor:
+            normalize_executor.shutdown(wait=True)
+        
+        # Ghép kết quả theo đúng thứ tự ảnh
+        image_paths = []
+        for i in range(len(jobs)):
+            if i in reused:
+                image_paths.append(reused[i])
+            elif i in finalize_futures:
+                image_paths.append(finalize_futures[i].result())
+            elif i in images:
+                image_paths.append(images[i])
+        
+        return image_paths
+    
+    def _finalize_image(self, chapter_num, i, job, prompt, result_path):
+        """Chuẩn hóa ảnh vừa tạo (nếu cần) rồi ghi vào checkpoint một lần, trả về dữ liệu của ảnh"""
+        normalized_path = self.normalize_image(result_path) if self.normalize_size else None
+        image_data = self._image_data(i, job, prompt, result_path, normalized_path)
+        self._record_image(chapter_num, image_data)
+        return image_data
+    
+    def _image_data(self, i, job, prompt, result_path, normalized_path=None):
+        """Dữ liệu của một ảnh trong images_data.json"""
+        segment_text, scene_description = job
+        image_data = {
+            "segment_index": i,
+            "segment_text": segment_text
+        }
+        if scene_description is not None:
+            image_data["scene_description"] = scene_description
+        image_data["prompt"] = prompt
+        image_data["image_path"] = result_path
+        image_data["image_format"] = detect_image_file_format(result_path)
+        if normalized_path:
+            image_data["normalized_path"] = normalized_path
+            image_data["normalized_size"] = list(self.normalize_size)
+        return image_data
+    
+    def normalize_image(self, image_path):
+        """Tạo frame sẵn sàng để render cho một ảnh, trả về đường dẫn frame hoặc None nếu lỗi"""
+        width, height = self.normalize_size
+        output_path = f"{os.path.splitext(image_path)[0]}_{width}x{height}.png"
+        try:
+            with run_metrics.measure("image.normalize", os.path.basename(image_path),
+                                     bytes_in=file_size(image_path)) as event:
+                normalize_image_file(image_path, output_path, width, height)
+                event["bytes_out"] = file_size(output_path)
+            return output_path
+        except Exception as e:
+            print(f"Lỗi khi chuẩn hóa hình ảnh {os.path.basename(image_path)}: {e}")
+            return None
+    
+    def _generate_image_job(self, segment_text, chapter_num, output_path, prompt=None):
+        """Tạo hình ảnh cho một đoạn (tạo prompt nếu chưa có), trả về (prompt, đường dẫn ảnh hoặc None)"""
+        try:
+            if not prompt:
+                prompt = self.generate_structured_prompt(segment_text, chapter_num)
+            return prompt, self.generate_image(prompt, output_path)
+        except Exception as e:
+            print(f"Lỗi khi tạo hình ảnh {os.path.basename(output_path)}: {e}")
+            return None, None
+    
+    def prepare_story(self, story_data, output_dir="output"):
+        """Trích xuất thông tin nhân vật (từ chương đầu tiên) và lưu characters_info.json"""
+        characters_info = None
+        if self.checkpoint:
+            input_hash = self.checkpoint.input_hash(story_data["chapters"][0]["content"])
+            characters_info = self.checkpoint.get("images:characters", input_hash)
+        
+        if characters_info is not None:
+            print("Dùng lại thông tin nhân vật từ checkpoint")
+            self.characters_info = characters_info
+        else:
+            # Phân tích truyện để trích xuất thông tin nhân vật
+            print("Đang phân tích thông tin nhân vật để tạo hình ảnh nhất quán...")
+            self.characters_info = self._extract_character_info(story_data)
+            # Không ghi lại kết quả mặc định khi phân tích lỗi, để lần chạy sau thử lại
+            if self.checkpoint and any(self.characters_info.values()):
+                self.checkpoint.put("images:characters", input_hash, self.characters_info)
         
         # Lưu thông tin nhân vật để sử dụng sau này
         characters_file = os.path.join(output_dir, "characters_info.json")
         with open(characters_file, "w", encoding="utf-8") as f:
             json.dump(self.characters_info, f, ensure_ascii=False, indent=2)
         
-        story_images = []
+        return self.characters_info
+    
+    def process_story_chapter(self, chapter, images_dir):
+        """Tạo hình ảnh cho một chương của truyện (cần gọi prepare_story trước)"""
+        chapter_num = chapter["chapter_num"]
+        chapter_content = chapter["content"]
         
-        for chapter in story_data["chapters"]:
-            chapter_num = chapter["chapter_num"]
-            chapter_content = chapter["content"]
-            
-            # Đảm bảo chapter_content là string
-            if not isinstance(chapter_content, str):
-                print(f"Cảnh báo: Nội dung chapter {chapter_num} không phải string")
-                chapter_content = str(chapter_content)
-            
-            chapter_images = self.process_chapter(chapter_content, chapter_num, images_dir)
-            
-            # Thêm thông tin về hình ảnh vào dữ liệu chương
-            story_images.append({
-                "chapter_num": chapter_num,
-                "images": chapter_images
-            })
+        # Đảm bảo chapter_content là string
+        if not isinstance(chapter_content, str):
+            print(f"Cảnh báo: Nội dung chapter {chapter_num} không phải string")
+            chapter_content = str(chapter_content)
+        
+        chapter_images = self.process_chapter(chapter_content, chapter_num, images_dir)
+        
+        # Thêm thông tin về hình ảnh vào dữ liệu chương
+        return {
+            "chapter_num": chapter_num,
+            "images": chapter_images
+        }
+    
+    def process_story(self, story_data, output_dir="output"):
+        """Xử lý toàn bộ câu chuyện và tạo hình ảnh cho mỗi chương"""
+        images_dir = os.path.join(output_dir, "images")
+        os.makedirs(images_dir, exist_ok=True)
         
-        # Lưu thông tin hình ảnh vào file
+        self.prepare_story(story_data, output_dir)
+        
+        story_images = [self.process_story_chapter(chapter, images_dir) for chapter in story_data["chapters"]]
+        
+        return self.save_story_images(story_images, output_dir)
+    
+    def save_story_images(self, story_images, output_dir="output"):
+        """Lưu thông tin hình ảnh của cả truyện vào images_data.json"""
         images_data_path = os.path.join(output_dir, "images_data.json")
         with open(images_data_path, "w", encoding="utf-8") as f:
             json.dump(story_images, f, ensure_ascii=False, indent=2)
         
-        print(f"Đã tạo xong hình ảnh cho {len(story_data['chapters'])} chương.")
+        print(f"Đã tạo xong hình ảnh cho {len(story_images)} chương.")
         print(f"Dữ liệu hình ảnh đã được lưu vào: {images_data_path}")
         
         return story_images 
\ No newline at end of file
@@ -0,0 +1,119 @@
+import os
+import tempfile
+from io import BytesIO
+from PIL import Image
+
+# Phần mở rộng file theo định dạng ảnh
+IMAGE_EXTENSIONS = {
+    "png": ".png",
+    "jpeg": ".jpg",
+    "webp": ".webp",
+    "gif": ".gif"
+}
+
+
+def detect_image_format(data):
+    """Nhận diện định dạng ảnh từ các byte đầu (magic bytes), None nếu không nhận ra"""
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def detect_image_file_format(path):
+    """Nhận diện định dạng của file ảnh chỉ bằng cách đọc header"""
+    with open(path, "rb") as f:
+        return detect_image_format(f.read(12))
+
+
+def encode_image(data, target_format, quality=90):
+    """Mã hóa lại ảnh sang target_format ('webp' hoặc 'jpeg') với chất lượng cho trước"""
+    image = Image.open(BytesIO(data))
+    if target_format == "jpeg" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format=target_format.upper(), quality=quality)
+    return buffer.getvalue()
+
+
+def fit_to_frame(img, width, height, resample_name="LANCZOS"):
+    """Crop ảnh ở giữa theo tỷ lệ khung hình rồi resize đúng kích thước (width, height)"""
+    # Tính toán tỷ lệ khung hình
+    img_ratio = img.width / img.height
+    target_ratio = width / height
+
+    if img_ratio > target_ratio:
+        # Ảnh rộng hơn so với tỷ lệ target
+        new_width = int(img.height * target_ratio)
+        left = (img.width - new_width) // 2
+        img = img.crop((left, 0, left + new_width, img.height))
+    else:
+        # Ảnh cao hơn so với tỷ lệ target
+        new_height = int(img.width / target_ratio)
+        top = (img.height - new_height) // 2
+        img = img.crop((0, top, img.width, top + new_height))
+
+    # Resize ảnh theo kích thước video
+    return img.resize((width, height), getattr(Image, resample_name))
+
+
+def image_size(path):
+    """Đọc kích thước ảnh từ header (không decode toàn bộ ảnh)"""
+    with Image.open(path) as img:
+        return img.size
+
+
+def _write_atomic(data, output_path):
+    """Ghi file tạm rồi đổi tên: không ghi đè lên file cũ có thể là hard link trỏ vào cache"""
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(output_path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def normalize_image_file(image_path, output_path, width, height, resample_name="LANCZOS"):
+    """Tạo frame sẵn sàng để render (PNG đúng kích thước video) từ một ảnh
+
+    Returns:
+        output_path
+    """
+    with Image.open(image_path) as img:
+        frame = fit_to_frame(img, width, height, resample_name)
+    buffer = BytesIO()
+    frame.save(buffer, format="PNG")
+    _write_atomic(buffer.getvalue(), output_path)
+    return output_path
+
+
+def save_image_bytes(data, output_path, target_format=None, quality=90):
+    """Ghi ảnh do provider trả về xuống đĩa, giữ nguyên định dạng gốc nếu không cần đổi
+
+    Khi giữ định dạng gốc, file được ghi đúng tên người gọi yêu cầu (chapter_N_image_M.png) để
+    các bước sau và công cụ bên ngoài tìm ảnh theo tên vẫn thấy; định dạng thực tế được trả về.
+    Nếu có target_format thì ảnh chỉ được decode/encode một lần sang định dạng đó và phần mở rộng
+    được đổi theo định dạng mới.
+
+    Returns:
+        (đường dẫn file đã ghi, định dạng ảnh)
+    """
+    image_format = detect_image_format(data)
+    if image_format is None:
+        raise ValueError("Dữ liệu trả về không phải định dạng ảnh được hỗ trợ")
+
+    if target_format and target_format != image_format:
+        data = encode_image(data, target_format, quality)
+        image_format = target_format
+
+    if target_format:
+        output_path = os.path.splitext(output_path)[0] + IMAGE_EXTENSIONS[image_format]
+    _write_atomic(data, output_path)
+    return output_path, image_format
@@ -0,0 +1,454 @@
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+import traceback
+import subprocess
+from utils.config import DEFAULT_CONFIG
+from utils.metrics import run_metrics
+from utils.tracing import tracer
+from utils.governor import governor
+from utils.process_utils import pid_alive, new_process_group_kwargs, terminate_process_tree
+
+# Trạng thái của một job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Hàm chạy job theo loại job
+_JOBS = {}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    session_id TEXT,
+    tag TEXT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    pid INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, tag, created_at);
+CREATE TABLE IF NOT EXISTS job_logs (
+    job_id TEXT NOT NULL,
+    time REAL NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_logs_job ON job_logs (job_id, time);
+"""
+
+
+def register_job(kind, func):
+    """Đăng ký hàm chạy job loại kind: func(job, **params) trả về kết quả (dict lưu được dạng JSON)"""
+    _JOBS[kind] = func
+
+
+class JobContext:
+    """Đối tượng truyền cho hàm chạy job để báo tiến độ và ghi log vào bảng job"""
+
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.job_id = job_id
+
+    def log(self, message):
+        """Ghi một dòng log (UI đọc lại qua JobRunner.logs)"""
+        print(message, flush=True)
+        with self.runner._connect() as conn:
+            conn.execute("INSERT INTO job_logs (job_id, time, message) VALUES (?, ?, ?)",
+                         (self.job_id, time.time(), message))
+
+    def progress(self, value, message=None):
+        """Cập nhật tiến độ (0-1) và thông báo trạng thái ngắn"""
+        with self.runner._connect() as conn:
+            if message is None:
+                conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (value, self.job_id))
+            else:
+                conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ?",
+                             (value, message, self.job_id))
+
+
+class JobRunner:
+    """Chạy các job nặng (pipeline, render video) trong process riêng với bảng job SQLite
+
+    Mỗi job được ghi vào bảng jobs (queued/running/done/failed) cùng tham số, tiến độ, log và
+    kết quả, rồi chạy bằng một process `python -m utils.job_runner <job_id>` tách khỏi
+    Streamlit. Job vẫn chạy khi trình duyệt tải lại trang hay mất kết nối; UI chỉ đọc trạng
+    thái từ bảng và gắn lại vào job của phiên làm việc.
+    """
+
+    def __init__(self, db_path=None):
+        """
+        db_path: đường dẫn file SQLite (mặc định DEFAULT_CONFIG['jobs_db'])
+        """
+        self.db_path = db_path or DEFAULT_CONFIG['jobs_db']
+        self.log_dir = os.path.join(os.path.dirname(os.path.abspath(self.db_path)), "jobs")
+        os.makedirs(self.log_dir, exist_ok=True)
+        # Process worker do process này khởi động (để thu hồi khi kết thúc)
+        self._workers = {}
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row_to_job(row):
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def submit(self, kind, params, session_id=None, tag=None):
+        """Thêm job vào bảng và khởi động process worker, trả về job_id
+
+        session_id, tag: phiên làm việc và vị trí trên UI đã tạo job (để gắn lại bằng latest)
+        """
+        if kind not in _JOBS:
+            raise ValueError(f"Loại job không được hỗ trợ: {kind}")
+
+        job_id = uuid.uuid4().hex[:12]
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, session_id, tag, kind, params, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, session_id, tag, kind, json.dumps(params, ensure_ascii=False), QUEUED, time.time())
+            )
+
+        # Worker import được utils.* dù thư mục làm việc là thư mục khác
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [project_dir, env.get("PYTHONPATH")]))
+        with open(self.log_path(job_id), "ab") as log_file:
+            worker = subprocess.Popen(
+                [sys.executable, "-m", "utils.job_runner", job_id, "--db", os.path.abspath(self.db_path)],
+                stdout=log_file, stderr=subprocess.STDOUT, env=env, **new_process_group_kwargs()
+            )
+        self._reap_workers()
+        self._workers[job_id] = worker
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET pid = ? WHERE id = ?", (worker.pid, job_id))
+        return job_id
+    
+    def _reap_workers(self):
+        """Bỏ các process worker đã thoát khỏi danh sách (poll cũng thu hồi process con đã kết thúc)"""
+        for job_id, worker in list(self._workers.items()):
+            if worker.poll() is not None:
+                self._workers.pop(job_id, None)
+
+    def log_path(self, job_id):
+        """File ghi stdout/stderr của process worker"""
+        return os.path.join(self.log_dir, f"{job_id}.log")
+
+    def _check_worker(self, job):
+        """Đánh dấu job lỗi nếu process worker đã dừng mà job chưa kết thúc"""
+        worker = self._workers.get(job["id"])
+        if worker is not None:
+            alive = worker.poll() is None
+            if not alive:
+                # Process worker đã thoát (poll đã thu hồi nó) thì không cần giữ lại
+                self._workers.pop(job["id"], None)
+        elif job["pid"] is None:
+            # Job vừa được thêm, process worker đang được khởi động
+            alive = time.time() - job["created_at"] < 60
+        else:
+            alive = pid_alive(job["pid"])
+        if alive or job["status"] not in ACTIVE_STATUSES:
+            return job
+
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)",
+                (FAILED, f"Process worker đã dừng đột ngột (xem {self.log_path(job['id'])})", time.time(),
+                 job["id"], *ACTIVE_STATUSES)
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job["id"],)).fetchone()
+        return self._row_to_job(row)
+
+    def get(self, job_id):
+        """Thông tin job (params/result đã giải mã JSON), None nếu không có"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._check_worker(self._row_to_job(row)) if row else None
+
+    def latest(self, session_id, tag=None):
+        """Job mới nhất của phiên làm việc (lọc theo tag nếu có)"""
+        query = "SELECT * FROM jobs WHERE session_id = ?"
+        args = [session_id]
+        if tag:
+            query += " AND tag = ?"
+            args.append(tag)
+        with self._connect() as conn:
+            row = conn.execute(query + " ORDER BY created_at DESC LIMIT 1", args).fetchone()
+        return self._check_worker(self._row_to_job(row)) if row else None
+
+    def logs(self, job_id, limit=200):
+        """Các dòng log gần nhất của job, theo thứ tự thời gian"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT time, message FROM job_logs WHERE job_id = ? ORDER BY time DESC, rowid DESC LIMIT ?",
+                (job_id, limit)
+            ).fetchall()
+        return [
+            f"[{time.strftime('%H:%M:%S', time.localtime(row['time']))}] {row['message']}"
+            for row in reversed(rows)
+        ]
+
+    def cancel(self, job_id):
+        """Dừng process worker của job đang chạy và đánh dấu job lỗi"""
+        job = self.get(job_id)
+        if not job or job["status"] not in ACTIVE_STATUSES:
+            return False
+        # Worker chạy trong nhóm process riêng, dừng cả các process render con của nó
+        terminate_process_tree(job["pid"])
+        worker = self._workers.pop(job_id, None)
+        if worker is not None:
+            try:
+                worker.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)",
+                (FAILED, "Đã hủy", time.time(), job_id, *ACTIVE_STATUSES)
+            )
+        return True
+
+    def run(self, job_id):
+        """Chạy job trong process hiện tại (được gọi trong process worker)
+
+        Job ở trạng thái queued cho đến khi nhận được slot "job" của bộ điều phối tài nguyên.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["status"] != QUEUED:
+            print(f"Job {job_id} không ở trạng thái chờ chạy")
+            return False
+        job = self._row_to_job(row)
+
+        # Slot job/encode/ảnh/TTS được chia đều theo phiên đã tạo job
+        governor.set_session(job["session_id"] or job_id)
+        with governor.slot("job"):
+            with self._connect() as conn:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = ?, pid = ?, started_at = ? WHERE id = ? AND status = ?",
+                    (RUNNING, os.getpid(), time.time(), job_id, QUEUED)
+                )
+            if cursor.rowcount == 0:
+                print(f"Job {job_id} đã bị hủy trong lúc chờ")
+                return False
+            return self._execute(job)
+
+    def _execute(self, job):
+        """Chạy hàm của job và ghi kết quả hoặc lỗi vào bảng"""
+        job_id = job["id"]
+        context = JobContext(self, job_id)
+        try:
+            result = _JOBS[job["kind"]](context, **job["params"])
+        except Exception as e:
+            context.log(f"Lỗi: {e}")
+            traceback.print_exc()
+            with self._connect() as conn:
+                conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                             (FAILED, f"{e.__class__.__name__}: {e}", time.time(), job_id))
+            return False
+
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = 1, result = ?, finished_at = ? WHERE id = ?",
+                (DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id)
+            )
+        return True
+
+
+def _run_pipeline_job(job, story_concept, num_chapters, tokens_per_chapter, image_model, tts_provider,
+                      output_dir, video_width=1280, video_height=720, video_fps=30):
+    """Job "pipeline": tạo truyện, hình ảnh, audio và video theo pipeline từng chương"""
+    from utils.story_generator import StoryGenerator
+    from utils.image_generator import ImageGenerator
+    from utils.audio_generator import AudioGenerator
+    from utils.video_generator import VideoGenerator
+    from utils.pipeline import StoryPipeline
+
+    job.log(f"Bắt đầu tạo {num_chapters} chương truyện với {tokens_per_chapter} token mỗi chương")
+    job.log(f"Model hình ảnh: {image_model}, provider TTS: {tts_provider}")
+    job.log(f"Video: {video_width}x{video_height}, {video_fps} FPS")
+
+    pipeline = StoryPipeline(
+        StoryGenerator(),
+        ImageGenerator(model_type=image_model, normalize_size=(video_width, video_height)),
+        AudioGenerator(provider=tts_provider),
+        VideoGenerator(width=video_width, height=video_height, fps=video_fps),
+        output_dir=output_dir
+    )
+
+    # Mỗi chương qua 4 bước (truyện, ảnh, audio, video)
+    completed_steps = []
+    total_steps = num_chapters * 4
+
+    def on_pipeline_event(stage, chapter_num, status, detail=None):
+        message = f"[{stage}] chương {chapter_num}: {status}" if chapter_num else f"[{stage}] {status}"
+        if detail:
+            message += f" ({detail})"
+        job.log(message)
+        if chapter_num and status in ("xong", "lỗi", "bỏ qua"):
+            completed_steps.append((stage, chapter_num))
+            job.progress(min(0.99, len(completed_steps) / total_steps), message)
+
+    run_metrics.reset()
+    tracer.reset()
+    result = pipeline.run(story_concept, num_chapters, tokens_per_chapter, on_event=on_pipeline_event)
+    result["metrics_path"] = run_metrics.save(output_dir)
+    result["trace_path"] = tracer.export_chrome_trace(os.path.join(output_dir, "trace.json"))
+    job.log(f"Thời gian từng bước đã được lưu vào: {result['metrics_path']}")
+
+    job.log("===== KẾT QUẢ CUỐI CÙNG =====")
+    job.log(f"- Số chương đã tạo: {len(result['story_data']['chapters'])}")
+    job.log(f"- Tổng số hình ảnh: {sum(len(chapter.get('images', [])) for chapter in result['story_images'])}")
+    job.log(f"- Video đầy đủ: {(result['video_data'] or {}).get('full_video')}")
+    return result
+
+
+def _publish_video(job, video_data, story_title, series_name=None):
+    """Lưu video vào MongoDB, hoặc gửi lên Telegram nếu MongoDB không khả dụng; trả về video_id"""
+    from utils.db_utils import db_manager
+    from utils.telegram_utils import telegram_manager
+
+    video_id = None
+    try:
+        if db_manager.is_connected():
+            video_id = db_manager.save_video_data(video_data, story_title, series_name)
+            job.log(f"Đã lưu video vào MongoDB với ID: {video_id}")
+
+        if (not video_id or not db_manager.is_connected()) and telegram_manager.is_configured():
+            full_video_path = video_data.get("full_video")
+            if full_video_path and os.path.exists(full_video_path):
+                job.progress(0.95, "Đang gửi video lên Telegram...")
+                caption = f"<b>Tiêu đề:</b> {story_title}"
+                if series_name:
+                    caption += f"\n<b>Bộ truyện:</b> {series_name}"
+
+                message_id = telegram_manager.send_video(full_video_path, caption)
+                if message_id:
+                    job.log(f"Đã gửi video thành công lên Telegram với ID: {message_id}")
+                    if not video_id:
+                        video_id = f"tg_{message_id}"
+                else:
+                    job.log("Không thể gửi video lên Telegram.")
+            else:
+                job.log(f"Không tìm thấy file video đầy đủ tại: {full_video_path}")
+    except Exception as e:
+        job.log(f"Lỗi khi lưu video: {e}")
+    return video_id
+
+
+def _run_video_job(job, story_data, story_images, story_audio, output_dir, width=1280, height=720, fps=30,
+                   publish=None):
+    """Job "video": render video các chương và ghép full_story.mp4
+
+    publish: {"story_title", "series_name"} để lưu video vào MongoDB/Telegram sau khi render
+    """
+    from utils.video_generator import VideoGenerator
+
+    job.log(f"Đang tạo video cho {len(story_data['chapters'])} chương...")
+    video_generator = VideoGenerator(width=width, height=height, fps=fps)
+    video_data = video_generator.create_full_video(story_data, story_images, story_audio, output_dir=output_dir)
+    if video_data.get("full_video"):
+        job.log(f"Đã tạo video đầy đủ: {video_data['full_video']}")
+    else:
+        job.log("Không thể tạo video đầy đủ, nhưng có thể đã tạo được video cho một số chương.")
+
+    video_id = None
+    if publish and video_data.get("chapter_videos"):
+        video_id = _publish_video(job, video_data, publish.get("story_title", "My Story"), publish.get("series_name"))
+    return {"video_data": video_data, "video_id": video_id}
+
+
+def _run_images_job(job, story_data, output_dir, model_type):
+    """Job "images": tạo hình ảnh minh họa cho các chương của truyện"""
+    from utils.image_generator import ImageGenerator
+
+    job.log(f"Đang tạo hình ảnh minh họa cho {len(story_data['chapters'])} chương với model {model_type}...")
+    story_images = ImageGenerator(model_type=model_type).process_story(story_data, output_dir=output_dir)
+    job.log(f"Đã tạo xong {sum(len(chapter.get('images', [])) for chapter in story_images)} hình ảnh minh họa")
+    return {"story_images": story_images}
+
+
+def _run_image_job(job, model_type, prompt, output_path):
+    """Job "image": tạo lại một ảnh từ prompt (luôn gọi API và thay ảnh trong cache)"""
+    from utils.image_generator import ImageGenerator
+
+    image_path = ImageGenerator(model_type=model_type).generate_image(prompt, output_path, force_regenerate=True)
+    if not image_path:
+        raise RuntimeError("Không thể tạo lại hình ảnh")
+    job.log(f"Đã tạo lại hình ảnh: {image_path}")
+    return {"image_path": image_path, "prompt": prompt}
+
+
+def _run_audio_job(job, story_data, output_dir, provider):
+    """Job "audio": tạo audio cho các chương của truyện"""
+    from utils.audio_generator import AudioGenerator
+
+    job.log(f"Đang tạo audio cho {len(story_data['chapters'])} chương với provider {provider}...")
+    story_audio = AudioGenerator(provider=provider).process_story(story_data, output_dir=output_dir)
+    job.log("Đã tạo xong audio")
+    return {"story_audio": story_audio}
+
+
+def _run_story_media_job(job, story_data, output_dir, image_model, tts_provider, width=1280, height=720, fps=30,
+                         publish=None):
+    """Job "story_media": tạo hình ảnh, audio rồi video cho truyện đã có nội dung (các chương có sẵn)"""
+    job.progress(0, "Bước 1/3: Đang tạo hình ảnh minh họa...")
+    story_images = _run_images_job(job, story_data, output_dir, image_model)["story_images"]
+
+    job.progress(1 / 3, "Bước 2/3: Đang tạo audio...")
+    story_audio = _run_audio_job(job, story_data, output_dir, tts_provider)["story_audio"]
+
+    job.progress(2 / 3, "Bước 3/3: Đang tạo video...")
+    result = _run_video_job(job, story_data, story_images, story_audio, output_dir, width, height, fps, publish)
+    result.update(story_images=story_images, story_audio=story_audio)
+    return result
+
+
+register_job("pipeline", _run_pipeline_job)
+register_job("video", _run_video_job)
+register_job("images", _run_images_job)
+register_job("image", _run_image_job)
+register_job("audio", _run_audio_job)
+register_job("story_media", _run_story_media_job)
+
+
+# Tạo instance mặc định (chỉ khi cần để không tạo file jobs.db lúc import)
+_job_runner = None
+
+
+def get_job_runner():
+    """JobRunner dùng chung trong process"""
+    global _job_runner
+    if _job_runner is None:
+        _job_runner = JobRunner()
+    return _job_runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chạy một job đã được ghi trong bảng job")
+    parser.add_argument("job_id", type=str)
+    parser.add_argument("--db", type=str, default=None, help="Đường dẫn file SQLite của bảng job")
+    args = parser.parse_args()
+
+    # Job chạy nền phục vụ giao diện Streamlit nên luôn chia slot với các phiên khác
+    governor.enable_for_server()
+    sys.exit(0 if JobRunner(args.db).run(args.job_id) else 1)
@@ -0,0 +1,52 @@
+import os
+import json
+import tempfile
+
+
+def append_record(path, record):
+    """Ghi nối thêm một bản ghi JSON vào journal (một dòng, một lần ghi)
+
+    File được mở với O_APPEND nên nhiều process cùng ghi vào một journal không ghi đè
+    bản ghi của nhau, và chi phí mỗi lần ghi không tăng theo kích thước journal.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def read_records(path):
+    """Đọc các bản ghi trong journal theo thứ tự ghi, bỏ qua dòng hỏng (ví dụ bị ngắt giữa chừng)
+
+    Returns:
+        (danh sách bản ghi, True nếu journal có dòng hỏng và cần được ghi lại trước khi ghi nối thêm)
+    """
+    records = []
+    damaged = False
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    damaged = damaged or bool(line.strip())
+                    continue
+                # Dòng cuối thiếu xuống dòng thì bản ghi nối thêm sau sẽ dính vào nó
+                damaged = damaged or not line.endswith("\n")
+    except OSError:
+        pass
+    return records, damaged
+
+
+def rewrite_records(path, records):
+    """Thu gọn journal: ghi lại chỉ các bản ghi còn dùng (ghi file tạm rồi đổi tên)"""
+    journal_dir = os.path.dirname(path) or "."
+    os.makedirs(journal_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=journal_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from utils.tracing import tracer
+
+# Sự kiện đang được đo trong luồng hiện tại (để lớp transport ghi nhận số lần thử lại)
+_current_event = contextvars.ContextVar("current_metric_event", default=None)
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class RunMetrics:
+    """Ghi lại thời gian, dung lượng vào/ra, số lần thử lại và lỗi của từng bước trong một lần chạy
+
+    Mỗi lần gọi provider hoặc bước xử lý (viết chương, tạo prompt, tạo ảnh, TTS, resize, encode,
+    ghép video, upload) là một sự kiện; kết quả được lưu vào run_metrics.json cạnh story_data.json.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Bắt đầu một lần chạy mới"""
+        with self._lock:
+            self._events = []
+            self.started_at = time.time()
+
+    @contextmanager
+    def measure(self, stage, name=None, bytes_in=0, **attrs):
+        """Đo một bước: trả về dict sự kiện để cập nhật bytes_out/error/thuộc tính khác
+
+        Exception thoát ra khỏi khối được ghi vào error rồi ném lại. Mỗi bước đo cũng là một
+        span trong trace của lần chạy (xem utils.tracing).
+        """
+        event = {
+            "stage": stage,
+            "name": name,
+            "start": time.time(),
+            "end": None,
+            "duration_s": None,
+            "bytes_in": bytes_in,
+            "bytes_out": 0,
+            "retries": 0,
+            "error": None
+        }
+        event.update(attrs)
+        token = _current_event.set(event)
+        start = time.perf_counter()
+        try:
+            with tracer.span(stage, **attrs) as span:
+                try:
+                    yield event
+                finally:
+                    span.attributes.update(
+                        name=name, bytes_in=event["bytes_in"], bytes_out=event["bytes_out"], retries=event["retries"]
+                    )
+                    if event["error"]:
+                        span.status = "error"
+                        span.set_attribute("error", event["error"])
+        except Exception as e:
+            event["error"] = f"{e.__class__.__name__}: {e}"
+            raise
+        finally:
+            _current_event.reset(token)
+            event["duration_s"] = round(time.perf_counter() - start, 4)
+            event["end"] = event["start"] + event["duration_s"]
+            with self._lock:
+                self._events.append(event)
+
+    @staticmethod
+    def note_retry():
+        """Ghi nhận một lần thử lại cho bước đang được đo trong luồng hiện tại"""
+        event = _current_event.get()
+        if event is not None:
+            event["retries"] += 1
+        tracer.add_event("retry")
+
+    def drain(self):
+        """Lấy và xóa các sự kiện đã ghi (để gửi từ process con về process chính)"""
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    def merge(self, events):
+        """Thêm các sự kiện ghi ở process khác"""
+        with self._lock:
+            self._events.extend(events)
+
+    def summary(self):
+        """Tổng hợp theo bước: số lần, lỗi, thử lại, tổng/trung bình/p95/max thời gian, byte vào/ra"""
+        with self._lock:
+            events = list(self._events)
+
+        stages = {}
+        for event in events:
+            stages.setdefault(event["stage"], []).append(event)
+
+        summary = {}
+        for stage, stage_events in stages.items():
+            durations = [event["duration_s"] for event in stage_events]
+            summary[stage] = {
+                "count": len(stage_events),
+                "errors": sum(1 for event in stage_events if event["error"]),
+                "retries": sum(event["retries"] for event in stage_events),
+                "total_s": round(sum(durations), 3),
+                # Khoảng thời gian thực từ lúc bắt đầu đến lúc kết thúc (các lần gọi có thể chạy song song)
+                "span_s": round(max(event["end"] for event in stage_events)
+                                - min(event["start"] for event in stage_events), 3),
+                "mean_s": round(sum(durations) / len(durations), 3),
+                "p95_s": round(_percentile(durations, 0.95), 3),
+                "max_s": round(max(durations), 3),
+                "bytes_in": sum(event["bytes_in"] or 0 for event in stage_events),
+                "bytes_out": sum(event["bytes_out"] or 0 for event in stage_events)
+            }
+        return dict(sorted(summary.items(), key=lambda item: item[1]["total_s"], reverse=True))
+
+    def save(self, output_dir):
+        """Lưu run_metrics.json vào output_dir, trả về đường dẫn file"""
+        finished_at = time.time()
+        with self._lock:
+            events = sorted(self._events, key=lambda event: event["start"])
+
+        metrics_path = os.path.join(output_dir, "run_metrics.json")
+        os.makedirs(output_dir, exist_ok=True)
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+                "finished_at": datetime.fromtimestamp(finished_at).isoformat(timespec="seconds"),
+                "wall_s": round(finished_at - self.started_at, 3),
+                "stages": self.summary(),
+                "events": events
+            }, f, ensure_ascii=False, indent=2)
+        return metrics_path
+
+    def print_summary(self):
+        """In bảng tổng hợp thời gian theo bước"""
+        summary = self.summary()
+        if not summary:
+            return
+
+        header = (f"{'Bước':<18} {'Số lần':>7} {'Lỗi':>5} {'Thử lại':>8} {'Tổng (s)':>10} "
+                  f"{'Thực (s)':>10} {'TB (s)':>8} {'p95 (s)':>8} {'MB vào':>8} {'MB ra':>8}")
+        print(header)
+        print("-" * len(header))
+        for stage, row in summary.items():
+            print(f"{stage:<18} {row['count']:>7} {row['errors']:>5} {row['retries']:>8} {row['total_s']:>10.2f} "
+                  f"{row['span_s']:>10.2f} {row['mean_s']:>8.2f} {row['p95_s']:>8.2f} "
+                  f"{row['bytes_in'] / (1024 * 1024):>8.2f} {row['bytes_out'] / (1024 * 1024):>8.2f}")
+        print(f"Tổng thời gian chạy: {time.time() - self.started_at:.1f}s")
+
+
+def text_size(text):
+    """Số byte UTF-8 của văn bản (None = 0)"""
+    return len(text.encode("utf-8")) if text else 0
+
+
+def file_size(path):
+    """Kích thước file (0 nếu không có file)"""
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+# Tạo instance mặc định
+run_metrics = RunMetrics()
@@ -0,0 +1,490 @@
+import re
+import json
+import math
+import time
+import zlib
+import base64
+import random
+import struct
+import hashlib
+import argparse
+import threading
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from utils.config import get_env_var
+
+# Hồ sơ mặc định của từng provider giả lập
+#   latency: độ trễ trung vị (giây) trước khi có phản hồi (với text stream là thời gian tới đoạn đầu tiên)
+#   latency_sigma: độ phân tán của phân phối log-normal quanh trung vị (0 = độ trễ cố định)
+#   error_rate: tỷ lệ request lỗi (500 / exception)
+#   rate_limit_rate: tỷ lệ request bị từ chối vì vượt giới hạn (429 kèm Retry-After)
+#   images_per_chapter: số cảnh trả về khi phân tích chương (None = khoảng 60 từ một ảnh)
+MOCK_PROFILES = {
+    "gemini_text": {"latency": 0.8, "latency_sigma": 0.3, "error_rate": 0.0, "rate_limit_rate": 0.0,
+                    "words_per_second": 80, "images_per_chapter": None},
+    "gemini_image": {"latency": 6.0, "latency_sigma": 0.3, "error_rate": 0.0, "rate_limit_rate": 0.0,
+                     "width": 1024, "height": 1024},
+    "stability": {"latency": 5.0, "latency_sigma": 0.25, "error_rate": 0.0, "rate_limit_rate": 0.0},
+    "cogview4": {"latency": 8.0, "latency_sigma": 0.3, "error_rate": 0.0, "rate_limit_rate": 0.0,
+                 "width": 1024, "height": 1024},
+    "image_download": {"latency": 0.2, "latency_sigma": 0.5, "error_rate": 0.0, "rate_limit_rate": 0.0},
+    "openai_tts": {"latency": 1.5, "latency_sigma": 0.3, "error_rate": 0.0, "rate_limit_rate": 0.0,
+                   "words_per_second": 2.5},
+    "gtts": {"latency": 1.0, "latency_sigma": 0.4, "error_rate": 0.0, "rate_limit_rate": 0.0,
+             "words_per_second": 2.2},
+    "telegram": {"latency": 0.3, "latency_sigma": 0.3, "error_rate": 0.0, "rate_limit_rate": 0.0}
+}
+
+# Hệ số nhân cho mọi độ trễ (ví dụ 0.01 để chạy thử nhanh), seed để kết quả lặp lại được
+MOCK_LATENCY_SCALE = float(get_env_var('MOCK_LATENCY_SCALE', '1.0'))
+MOCK_SEED = get_env_var('MOCK_SEED', '0')
+MOCK_RETRY_AFTER = 1
+
+# Ghi đè hồ sơ qua biến môi trường, ví dụ MOCK_PROFILES='{"stability": {"rate_limit_rate": 0.2}}'
+for _name, _overrides in json.loads(get_env_var('MOCK_PROFILES', '{}')).items():
+    MOCK_PROFILES.setdefault(_name, {}).update(_overrides)
+
+_call_counts = {}
+_call_counts_lock = threading.Lock()
+
+_WORDS = (
+    "ánh trăng dòng sông ngôi làng cánh đồng cơn gió bầu trời ngọn núi khu rừng con đường "
+    "cô gái chàng trai ông lão bà cụ đứa trẻ người lữ khách nhà sư chiến binh "
+    "lặng lẽ bước đi nhìn thấy mỉm cười thì thầm lắng nghe chờ đợi trở về ra đi "
+    "xa xăm huyền bí ấm áp lạnh lẽo rực rỡ mờ ảo bình yên dữ dội "
+    "ký ức lời hứa giấc mơ bí mật hy vọng nỗi nhớ tiếng chuông ngọn lửa"
+).split()
+
+
+class MockProviderError(Exception):
+    """Lỗi do provider giả lập tạo ra (status_code như HTTP)"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MockRateLimitError(MockProviderError):
+    """Provider giả lập từ chối vì vượt giới hạn tốc độ"""
+
+    def __init__(self, message, retry_after=MOCK_RETRY_AFTER):
+        super().__init__(message, status_code=429)
+        self.retry_after = retry_after
+
+
+def configure_mock(provider, **settings):
+    """Thay đổi hồ sơ của một provider giả lập lúc chạy (ví dụ trong benchmark)"""
+    MOCK_PROFILES.setdefault(provider, {}).update(settings)
+
+
+def _seed(*parts):
+    """Seed xác định từ MOCK_SEED và các thành phần cho trước"""
+    digest = hashlib.sha256("\x1f".join(str(part) for part in (MOCK_SEED,) + parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def _call_rng(provider, key):
+    """RNG cho một lần gọi: cùng request gọi lại (thử lại) sẽ nhận lượt bốc thăm mới"""
+    with _call_counts_lock:
+        count = _call_counts.get((provider, key), 0)
+        _call_counts[(provider, key)] = count + 1
+    return random.Random(_seed(provider, key, count))
+
+
+def _sample_latency(profile, rng):
+    latency = profile.get("latency", 0.0) * MOCK_LATENCY_SCALE
+    sigma = profile.get("latency_sigma", 0.0)
+    if latency > 0 and sigma > 0:
+        latency *= math.exp(rng.gauss(0, sigma))
+    return latency
+
+
+def simulate_call(provider, key, extra_latency=0.0):
+    """Giả lập một lần gọi provider: chờ theo phân phối độ trễ rồi có thể lỗi theo tỷ lệ cấu hình
+
+    Raises:
+        MockRateLimitError, MockProviderError
+    """
+    profile = MOCK_PROFILES[provider]
+    rng = _call_rng(provider, key)
+    time.sleep(_sample_latency(profile, rng) + extra_latency * MOCK_LATENCY_SCALE)
+
+    draw = rng.random()
+    if draw < profile.get("rate_limit_rate", 0.0):
+        raise MockRateLimitError(f"{provider}: vượt giới hạn request (giả lập)")
+    if draw < profile.get("rate_limit_rate", 0.0) + profile.get("error_rate", 0.0):
+        raise MockProviderError(f"{provider}: lỗi máy chủ (giả lập)")
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def make_png(width, height, seed=0):
+    """Tạo ảnh PNG RGB (dải màu có nhiễu) với dung lượng gần với ảnh thật cùng kích thước"""
+    rng = random.Random(seed)
+    start = [rng.randrange(256) for _ in range(3)]
+    end = [rng.randrange(256) for _ in range(3)]
+
+    raw = bytearray()
+    for y in range(height):
+        t = y / max(1, height - 1)
+        color = [int(a + (b - a) * t) & 0xF0 for a, b in zip(start, end)]
+        # Nhiễu 4 bit trên nền màu của dòng: dữ liệu nén được một phần như ảnh chụp/ảnh vẽ
+        table = bytes((color[i % 3] | (i & 0x0F)) for i in range(256))
+        raw += b"\x00" + rng.getrandbits(width * 24).to_bytes(width * 3, "little").translate(table)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(bytes(raw), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+# Frame MP3 im lặng: MPEG-1 Layer III, 128 kbps, 44.1 kHz, mono, side info bằng 0
+_SILENT_MP3_FRAME = b"\xff\xfb\x90\xc4" + b"\x00" * 413
+_MP3_FRAME_SECONDS = 1152 / 44100
+
+
+def make_mp3(duration):
+    """Tạo MP3 im lặng dài duration giây (128 kbps, giống kích thước audio TTS thật)"""
+    return _SILENT_MP3_FRAME * max(1, math.ceil(duration / _MP3_FRAME_SECONDS))
+
+
+def speech_duration(text, words_per_second, speed=1.0):
+    """Ước lượng thời lượng đọc văn bản"""
+    return max(0.5, len(text.split()) / (words_per_second * speed))
+
+
+def _sentence(rng):
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 16))]
+    return " ".join(words).capitalize() + "."
+
+
+def mock_prose(rng, words):
+    """Đoạn văn giả có khoảng words từ, chia thành các đoạn cách nhau bởi dòng trống"""
+    paragraphs = []
+    count = 0
+    while count < words:
+        paragraph = " ".join(_sentence(rng) for _ in range(rng.randint(3, 6)))
+        paragraphs.append(paragraph)
+        count += len(paragraph.split())
+    return "\n\n".join(paragraphs)
+
+
+def _mock_text_response(prompt, max_tokens, rng, profile):
+    """Phản hồi giả theo loại prompt của ứng dụng (JSON đúng cấu trúc mà code phía gọi mong đợi)"""
+    if '"chapter_num": 1, "summary"' in prompt:
+        match = re.search(r"gồm đúng (\d+) chương", prompt)
+        num_chapters = int(match.group(1)) if match else 1
+        return json.dumps([
+            {"chapter_num": i, "summary": " ".join(_sentence(rng) for _ in range(3))}
+            for i in range(1, num_chapters + 1)
+        ], ensure_ascii=False)
+
+    if '"characters": [' in prompt:
+        return json.dumps({
+            "characters": [
+                {
+                    "name": rng.choice(["Lan", "Minh", "Hoa", "Tuấn", "Mai"]),
+                    "gender": rng.choice(["Nam", "Nữ"]),
+                    "age": str(rng.randint(8, 70)),
+                    "appearance": _sentence(rng),
+                    "personality": _sentence(rng),
+                    "role": _sentence(rng)
+                }
+                for _ in range(rng.randint(1, 3))
+            ],
+            "setting": {key: _sentence(rng) for key in ("era", "location", "culture", "environment", "atmosphere")},
+            "style": {key: _sentence(rng) for key in ("genre", "color_tone", "art_style")}
+        }, ensure_ascii=False)
+
+    if '"image_count"' in prompt:
+        text = prompt.split("Văn bản:", 1)[-1]
+        image_count = profile.get("images_per_chapter") or max(1, len(text.split()) // 60)
+        return json.dumps({
+            "image_count": image_count,
+            "scenes": [{"description": _sentence(rng), "importance": rng.randint(1, 5)} for _ in range(image_count)]
+        }, ensure_ascii=False)
+
+    if '"index": số_thứ_tự_đoạn' in prompt:
+        indexes = [int(index) for index in re.findall(r"^\s*\[(\d+)\]", prompt, re.M)]
+        return json.dumps([
+            {
+                "index": index,
+                **{key: _sentence(rng) for key in ("subject", "action", "background", "lighting", "style", "atmosphere")}
+            }
+            for index in indexes
+        ], ensure_ascii=False)
+
+    # Văn bản tự do (chương truyện, prompt ảnh): khoảng 0.75 từ mỗi token
+    return mock_prose(rng, int((max_tokens or 200) * 0.75))
+
+
+def _text_response(text):
+    return SimpleNamespace(text=text, parts=[SimpleNamespace(text=text, inline_data=None)])
+
+
+class MockGenerativeModel:
+    """Thay thế genai.GenerativeModel: model text trả về văn bản/JSON giả, model ảnh trả về PNG"""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.provider = "gemini_image" if "image" in model_name else "gemini_text"
+
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        profile = MOCK_PROFILES[self.provider]
+
+        if self.provider == "gemini_image":
+            simulate_call(self.provider, prompt)
+            data = make_png(profile["width"], profile["height"], _seed("image", self.model_name, prompt))
+            inline_data = SimpleNamespace(mime_type="image/png", data=base64.b64encode(data))
+            return SimpleNamespace(text="", parts=[SimpleNamespace(text="", inline_data=inline_data)])
+
+        max_tokens = (generation_config or {}).get("max_output_tokens")
+        text = _mock_text_response(prompt, max_tokens, random.Random(_seed("text", self.model_name, prompt)), profile)
+        generation_time = len(text.split()) / profile["words_per_second"]
+
+        if not stream:
+            simulate_call(self.provider, prompt, extra_latency=generation_time)
+            return _text_response(text)
+
+        simulate_call(self.provider, prompt)
+        return self._stream(text, generation_time)
+
+    @staticmethod
+    def _stream(text, generation_time):
+        """Trả về văn bản theo từng chunk khoảng 20 từ, đều nhau trong thời gian sinh"""
+        pieces = re.findall(r"(?:\S+\s*){1,20}", text)
+        for piece in pieces:
+            time.sleep(generation_time / len(pieces) * MOCK_LATENCY_SCALE)
+            yield _text_response(piece)
+
+
+class _MockSpeechResponse:
+    def __init__(self, data):
+        self.content = data
+
+    def stream_to_file(self, path):
+        with open(path, "wb") as f:
+            f.write(self.content)
+
+
+class MockSpeech:
+    """Thay thế openai.audio.speech"""
+
+    def create(self, model, voice, input, speed=1.0, **kwargs):
+        profile = MOCK_PROFILES["openai_tts"]
+        simulate_call("openai_tts", f"{model}:{voice}:{speed}:{input}")
+        return _MockSpeechResponse(make_mp3(speech_duration(input, profile["words_per_second"], speed)))
+
+
+class MockTTS:
+    """Thay thế gTTS: request được gửi khi gọi save()"""
+
+    def __init__(self, text, lang="vi", slow=False):
+        self.text = text
+        self.lang = lang
+        self.slow = slow
+
+    def save(self, path):
+        profile = MOCK_PROFILES["gtts"]
+        simulate_call("gtts", f"{self.lang}:{self.slow}:{self.text}")
+        speed = 0.7 if self.slow else 1.0
+        with open(path, "wb") as f:
+            f.write(make_mp3(speech_duration(self.text, profile["words_per_second"], speed)))
+
+
+class _MockZhipuImages:
+    def generations(self, model, prompt, **kwargs):
+        profile = MOCK_PROFILES["cogview4"]
+        simulate_call("cogview4", prompt)
+        seed = _seed("image", model, prompt)
+        url = f"{mock_server_url()}/files/{seed}.png?width={profile['width']}&height={profile['height']}"
+        return SimpleNamespace(data=[SimpleNamespace(url=url)])
+
+
+class MockZhipuAI:
+    """Thay thế zhipuai.ZhipuAI: ảnh được tải về từ máy chủ giả lập như URL thật của CogView"""
+
+    def __init__(self, **kwargs):
+        self.images = _MockZhipuImages()
+
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+    """Xử lý request tới máy chủ giả lập: Stability REST API, Telegram Bot API, tải file ảnh"""
+
+    protocol_version = "HTTP/1.1"
+
+    _STABILITY_PATH = re.compile(r"^/v1/generation/([\w.-]+)/text-to-image$")
+    _TELEGRAM_PATH = re.compile(r"^/bot([^/]+)/(\w+)$")
+    _FILE_PATH = re.compile(r"^/files/(\d+)\.png$")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, error):
+        status, body, headers = error
+        self._send(status, body, headers=headers)
+
+    def _simulate(self, provider, key):
+        """Giả lập độ trễ/lỗi, trả về (status, body, headers) của response lỗi hoặc None nếu thành công"""
+        try:
+            simulate_call(provider, key)
+        except MockRateLimitError as e:
+            if provider == "telegram":
+                body = {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {e.retry_after}",
+                        "parameters": {"retry_after": e.retry_after}}
+            else:
+                body = {"name": "rate_limit_exceeded", "message": str(e)}
+            return 429, body, {"Retry-After": str(e.retry_after)}
+        except MockProviderError as e:
+            if provider == "telegram":
+                body = {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+            else:
+                body = {"name": "internal_error", "message": str(e)}
+            return 500, body, {}
+        return None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = self._FILE_PATH.match(url.path)
+        if match:
+            self.server.mock.count_request("files", 0)
+            error = self._simulate("image_download", url.path)
+            if error:
+                return self._send_error(error)
+            query = parse_qs(url.query)
+            width = int(query.get("width", ["1024"])[0])
+            height = int(query.get("height", ["1024"])[0])
+            return self._send(200, make_png(width, height, int(match.group(1))), content_type="image/png")
+
+        match = self._TELEGRAM_PATH.match(url.path)
+        if match:
+            return self._telegram(match.group(2), b"")
+        self._send(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        body = self._read_body()
+        path = urlparse(self.path).path
+
+        match = self._STABILITY_PATH.match(path)
+        if match:
+            self.server.mock.count_request("stability", len(body))
+            payload = json.loads(body or b"{}")
+            prompt = " ".join(item.get("text", "") for item in payload.get("text_prompts", []))
+            error = self._simulate("stability", prompt)
+            if error:
+                return self._send_error(error)
+            seed = _seed("image", match.group(1), prompt)
+            data = make_png(int(payload.get("width", 512)), int(payload.get("height", 512)), seed)
+            return self._send(200, {"artifacts": [
+                {"base64": base64.b64encode(data).decode("ascii"), "seed": seed % 2 ** 32, "finishReason": "SUCCESS"}
+            ]})
+
+        match = self._TELEGRAM_PATH.match(path)
+        if match:
+            return self._telegram(match.group(2), body)
+        self._send(404, {"message": "Not Found"})
+
+    def _telegram(self, method, body):
+        """Bot API giả: sendMessage, sendVideo, getMe"""
+        self.server.mock.count_request(f"telegram.{method}", len(body))
+        if method not in ("sendMessage", "sendVideo", "getMe"):
+            return self._send(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+        error = self._simulate("telegram", method)
+        if error:
+            return self._send_error(error)
+        # Thời gian upload tỷ lệ với dung lượng video (khoảng 20 MB/s)
+        time.sleep(len(body) / (20 * 1024 * 1024) * MOCK_LATENCY_SCALE)
+
+        if method == "getMe":
+            return self._send(200, {"ok": True, "result": {"id": 1, "is_bot": True, "username": "mock_bot"}})
+        return self._send(200, {"ok": True, "result": {"message_id": self.server.mock.next_message_id()}})
+
+
+class MockProviderServer:
+    """Máy chủ HTTP giả lập chạy trên localhost cho các provider gọi qua HTTP"""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), _MockRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.url = f"http://{host}:{self.httpd.server_port}"
+        self.requests = {}  # route -> {"count", "bytes"}
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self._thread = None
+
+    def count_request(self, route, size):
+        with self._lock:
+            stats = self.requests.setdefault(route, {"count": 0, "bytes": 0})
+            stats["count"] += 1
+            stats["bytes"] += size
+
+    def next_message_id(self):
+        with self._lock:
+            self._message_id += 1
+            return self._message_id
+
+    def start(self):
+        """Chạy máy chủ trong thread nền"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+_mock_server = None
+_mock_server_lock = threading.Lock()
+
+
+def get_mock_server():
+    """Máy chủ giả lập dùng chung trong process (khởi động khi cần)"""
+    global _mock_server
+    with _mock_server_lock:
+        if _mock_server is None:
+            _mock_server = MockProviderServer().start()
+        return _mock_server
+
+
+def mock_server_url():
+    """URL của máy chủ giả lập: MOCK_SERVER_URL nếu có (máy chủ chạy riêng), nếu không thì máy chủ trong process"""
+    return get_env_var('MOCK_SERVER_URL') or get_mock_server().url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chạy máy chủ giả lập Stability/CogView/Telegram Bot API")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    server = MockProviderServer(args.host, args.port)
+    print(f"Máy chủ giả lập đang chạy tại {server.url}")
+    print(f"Đặt MOCK_SERVER_URL={server.url} (hoặc TELEGRAM_API_URL/STABILITY_API_URL ở chế độ live)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
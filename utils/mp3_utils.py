@@ -0,0 +1,204 @@
+import os
+import struct
+
+# Bảng bitrate (kbps) theo (phiên bản MPEG, layer)
+_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+
+_VERSIONS = {0b00: 2.5, 0b10: 2, 0b11: 1}
+_LAYERS = {0b01: 3, 0b10: 2, 0b11: 1}
+
+
+def parse_frame_header(header):
+    """Phân tích 4 byte header của một frame MPEG audio
+
+    Returns:
+        dict với version, layer, bitrate, sample_rate, channels, samples, frame_length;
+        None nếu không phải header hợp lệ
+    """
+    if len(header) < 4:
+        return None
+    b1, b2, b3, b4 = header[:4]
+    if b1 != 0xFF or (b2 & 0xE0) != 0xE0:
+        return None
+
+    version = _VERSIONS.get((b2 >> 3) & 0b11)
+    layer = _LAYERS.get((b2 >> 1) & 0b11)
+    bitrate_index = (b3 >> 4) & 0x0F
+    sample_rate_index = (b3 >> 2) & 0b11
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    table_version = 1 if version == 1 else 2
+    bitrate = _BITRATES[(table_version, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b3 >> 1) & 0b1
+    channels = 1 if ((b4 >> 6) & 0b11) == 0b11 else 2
+
+    if layer == 1:
+        samples = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or version == 1) else 576
+        frame_length = (samples // 8) * bitrate // sample_rate + padding
+
+    return {
+        "version": version,
+        "layer": layer,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "samples": samples,
+        "frame_length": frame_length
+    }
+
+
+def id3v2_size(f):
+    """Trả về kích thước tag ID3v2 ở đầu file (0 nếu không có), con trỏ file về lại đầu"""
+    f.seek(0)
+    header = f.read(10)
+    f.seek(0)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    has_footer = header[5] & 0x10
+    return 10 + size + (10 if has_footer else 0)
+
+
+def _side_info_length(info):
+    """Độ dài phần side info ngay sau header (để tìm header Xing/Info)"""
+    if info["version"] == 1:
+        return 17 if info["channels"] == 1 else 32
+    return 9 if info["channels"] == 1 else 17
+
+
+def vbr_frame_count(frame, info):
+    """Đọc số frame từ header Xing/Info hoặc VBRI trong frame đầu tiên (None nếu không có)"""
+    xing_offset = 4 + _side_info_length(info)
+    tag = frame[xing_offset:xing_offset + 4]
+    if tag in (b"Xing", b"Info") and len(frame) >= xing_offset + 12:
+        flags = struct.unpack(">I", frame[xing_offset + 4:xing_offset + 8])[0]
+        if flags & 0x1:
+            return struct.unpack(">I", frame[xing_offset + 8:xing_offset + 12])[0]
+        return None
+
+    # Header VBRI (Fraunhofer) luôn nằm sau 32 byte kể từ cuối header
+    if frame[36:40] == b"VBRI" and len(frame) >= 54:
+        return struct.unpack(">I", frame[50:54])[0]
+    return None
+
+
+def is_vbr_info_frame(frame, info):
+    """Kiểm tra frame có phải frame chứa header Xing/Info/VBRI (không có dữ liệu âm thanh)"""
+    xing_offset = 4 + _side_info_length(info)
+    return frame[xing_offset:xing_offset + 4] in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+
+
+def mp3_duration(path):
+    """Tính thời lượng (giây) của file MP3 chỉ bằng cách đọc header, không decode
+
+    Ưu tiên số frame trong header Xing/Info/VBRI; nếu không có thì duyệt header của
+    từng frame (seek qua phần dữ liệu âm thanh).
+
+    Returns:
+        float hoặc None nếu không đọc được
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        offset = id3v2_size(f)
+        f.seek(offset)
+        header = f.read(4)
+        info = parse_frame_header(header)
+        if not info:
+            return None
+
+        # Header Xing/Info/VBRI cho biết ngay tổng số frame
+        first_frame = header + f.read(info["frame_length"] - 4)
+        frame_count = vbr_frame_count(first_frame, info)
+        if frame_count:
+            return frame_count * info["samples"] / info["sample_rate"]
+
+        # Duyệt qua header của từng frame
+        total_samples = 0
+        while offset + 4 <= file_size:
+            f.seek(offset)
+            frame_info = parse_frame_header(f.read(4))
+            if not frame_info or frame_info["frame_length"] <= 0:
+                break
+            total_samples += frame_info["samples"]
+            offset += frame_info["frame_length"]
+            sample_rate = frame_info["sample_rate"]
+
+        if total_samples == 0:
+            return None
+        return total_samples / sample_rate
+
+
+def concat_mp3_files(paths, output_path, chunk_size=1024 * 1024):
+    """Nối các file MP3 ở mức frame, không decode/encode và không đọc toàn bộ vào bộ nhớ
+
+    Bỏ tag ID3v2/ID3v1 và frame Xing/Info của từng file để file kết quả là một chuỗi
+    frame liên tục. Các file phải có cùng sample rate và số kênh.
+
+    Returns:
+        output_path
+    """
+    stream_format = None
+    tmp_path = output_path + ".tmp"
+
+    try:
+        with open(tmp_path, "wb") as out:
+            for path in paths:
+                file_size = os.path.getsize(path)
+                with open(path, "rb") as f:
+                    start = id3v2_size(f)
+
+                    # Bỏ tag ID3v1 (128 byte) ở cuối file nếu có
+                    end = file_size
+                    if file_size >= 128:
+                        f.seek(file_size - 128)
+                        if f.read(3) == b"TAG":
+                            end = file_size - 128
+
+                    f.seek(start)
+                    header = f.read(4)
+                    info = parse_frame_header(header)
+                    if not info:
+                        raise ValueError(f"Không tìm thấy frame MP3 hợp lệ trong {path}")
+
+                    current_format = (info["version"], info["layer"], info["sample_rate"], info["channels"])
+                    if stream_format is None:
+                        stream_format = current_format
+                    elif current_format != stream_format:
+                        raise ValueError(f"Định dạng MP3 của {path} khác với các file trước")
+
+                    first_frame = header + f.read(info["frame_length"] - 4)
+                    if is_vbr_info_frame(first_frame, info):
+                        start += info["frame_length"]
+
+                    f.seek(start)
+                    remaining = end - start
+                    while remaining > 0:
+                        chunk = f.read(min(chunk_size, remaining))
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                        remaining -= len(chunk)
+
+        os.replace(tmp_path, output_path)
+        return output_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,280 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from utils.streaming import ParagraphStream
+from utils.tracing import tracer, traced, TracedThreadPoolExecutor
+
+
+class StoryPipeline:
+    """Chạy truyện → ảnh/audio → video theo từng chương thay vì bốn bước tuần tự cho cả truyện
+
+    Mỗi chương là một DAG nhỏ: ngay khi chương được viết xong, ảnh và audio của chương đó được
+    tạo trên pool riêng của từng bước; video chương được render ngay khi cả ảnh và audio xong;
+    cuối cùng mới ghép video toàn truyện. Các file JSON kết quả giống hệt luồng tuần tự.
+    """
+
+    def __init__(self, story_generator, image_generator, audio_generator, video_generator,
+                 output_dir="output", image_workers=2, audio_workers=2, stream=False):
+        """
+        image_workers: số chương được tạo ảnh đồng thời
+        audio_workers: số chương được tạo audio đồng thời
+        stream: viết truyện ở chế độ stream, audio bắt đầu ngay trên các đoạn văn đã viết xong
+        """
+        self.story_generator = story_generator
+        self.image_generator = image_generator
+        self.audio_generator = audio_generator
+        self.video_generator = video_generator
+        self.output_dir = output_dir
+        self.image_workers = max(1, image_workers)
+        self.audio_workers = max(1, audio_workers)
+        self.stream = stream
+
+    def _emit(self, stage, chapter_num, status, detail=None):
+        """Đưa sự kiện vào hàng đợi để thread gọi run() xử lý (an toàn với Streamlit)"""
+        self._events.put((stage, chapter_num, status, detail))
+
+    @staticmethod
+    def print_event(stage, chapter_num, status, detail=None):
+        """Xử lý sự kiện mặc định: in ra console"""
+        chapter_info = f" chương {chapter_num}" if chapter_num else ""
+        message = f"[{stage}]{chapter_info}: {status}"
+        if detail:
+            message += f" ({detail})"
+        print(message)
+
+    @traced("pipeline")
+    def run(self, story_concept, num_chapters, tokens_per_chapter, on_event=None):
+        """Chạy toàn bộ pipeline
+
+        Args:
+            on_event: hàm (stage, chapter_num, status, detail) được gọi trong thread hiện tại
+                      mỗi khi một bước của một chương bắt đầu/xong/lỗi
+
+        Returns:
+            dict: story_data, story_images, story_audio, video_data
+        """
+        tracer.set_attribute("num_chapters", num_chapters)
+        on_event = on_event or self.print_event
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._chapters = {}
+        self._characters = Future()
+
+        self.images_dir = os.path.join(self.output_dir, "images")
+        self.audio_dir = os.path.join(self.output_dir, "audio")
+        self.videos_dir = os.path.join(self.output_dir, "videos")
+        for directory in (self.output_dir, self.images_dir, self.audio_dir, self.videos_dir):
+            os.makedirs(directory, exist_ok=True)
+
+        # Mỗi bước có pool riêng để bước chậm không chặn các bước khác
+        self._analysis_pool = TracedThreadPoolExecutor(max_workers=1)
+        self._image_pool = TracedThreadPoolExecutor(max_workers=self.image_workers)
+        self._audio_pool = TracedThreadPoolExecutor(max_workers=self.audio_workers)
+        self._video_pool = self.video_generator.create_render_executor()
+        story_pool = TracedThreadPoolExecutor(max_workers=1)
+        # Audio stream của mỗi chương chờ đoạn văn trong suốt lúc viết truyện, nên cần một worker cho mỗi
+        # chương; nếu dùng chung _audio_pool thì các chương sau chương thứ audio_workers phải chờ viết xong
+        stream_audio_pool = TracedThreadPoolExecutor(max_workers=num_chapters) if self.stream else None
+
+        try:
+            paragraph_streams = None
+            self._stream_audio = {}
+            if self.stream:
+                paragraph_streams = {i: ParagraphStream(i) for i in range(1, num_chapters + 1)}
+                for chapter_num, stream in paragraph_streams.items():
+                    self._stream_audio[chapter_num] = stream_audio_pool.submit(
+                        self.audio_generator.process_chapter_stream, stream, chapter_num, self.audio_dir
+                    )
+
+            self._emit("story", None, "bắt đầu", f"{num_chapters} chương")
+            story_future = story_pool.submit(
+                self.story_generator.generate_full_story,
+                story_concept,
+                num_chapters=num_chapters,
+                tokens_per_chapter=tokens_per_chapter,
+                output_dir=self.output_dir,
+                paragraph_streams=paragraph_streams,
+                on_chapter=self._on_chapter_written
+            )
+            story_future.add_done_callback(self._on_story_done)
+
+            # Xử lý sự kiện trong thread hiện tại cho đến khi mọi chương đã xong
+            while True:
+                try:
+                    on_event(*self._events.get(timeout=0.2))
+                    continue
+                except queue.Empty:
+                    pass
+                if story_future.done() and self._all_chapters_finished():
+                    break
+
+            while not self._events.empty():
+                on_event(*self._events.get())
+
+            story_data = story_future.result()
+            on_event("video", None, "bắt đầu", "ghép video toàn truyện")
+            return self._collect_results(story_data)
+        finally:
+            story_pool.shutdown()
+            self._analysis_pool.shutdown()
+            self._image_pool.shutdown()
+            self._audio_pool.shutdown()
+            if stream_audio_pool:
+                stream_audio_pool.shutdown()
+            self._video_pool.shutdown()
+
+    def _all_chapters_finished(self):
+        with self._lock:
+            return all(state["finished"] for state in self._chapters.values())
+
+    def _on_story_done(self, future):
+        """Khi bước viết truyện kết thúc: đảm bảo các chương đang chờ thông tin nhân vật không bị treo"""
+        if future.exception():
+            self._emit("story", None, "lỗi", str(future.exception()))
+        else:
+            self._emit("story", None, "xong")
+        self._set_characters({})
+
+    def _on_chapter_written(self, chapter):
+        """Chương vừa được viết xong: khởi động các bước ảnh và audio của chương đó"""
+        chapter_num = chapter["chapter_num"]
+        self._emit("story", chapter_num, "xong")
+
+        with self._lock:
+            state = {"chapter": chapter, "image": None, "audio": None, "video": None, "rendering": False,
+                     "finished": False}
+            self._chapters[chapter_num] = state
+
+            # Thông tin nhân vật được trích từ chương đầu tiên, ảnh của mọi chương cần nó
+            if chapter_num == 1:
+                analysis = self._analysis_pool.submit(
+                    self.image_generator.prepare_story, {"chapters": [chapter]}, self.output_dir
+                )
+                analysis.add_done_callback(self._on_characters_ready)
+
+            self._emit("image", chapter_num, "bắt đầu")
+            state["image"] = self._image_pool.submit(self._generate_chapter_images, chapter)
+
+            if chapter_num in self._stream_audio:
+                state["audio"] = self._stream_audio[chapter_num]
+            else:
+                self._emit("audio", chapter_num, "bắt đầu")
+                state["audio"] = self._audio_pool.submit(
+                    self.audio_generator.process_chapter, chapter["content"], chapter_num, self.audio_dir
+                )
+
+        state["image"].add_done_callback(lambda _: self._on_stage_done(chapter_num, "image"))
+        state["audio"].add_done_callback(lambda _: self._on_stage_done(chapter_num, "audio"))
+
+    def _on_characters_ready(self, future):
+        try:
+            characters_info = future.result()
+        except Exception as e:
+            self._emit("image", None, "lỗi phân tích nhân vật", str(e))
+            characters_info = {}
+        self._set_characters(characters_info)
+
+    def _set_characters(self, characters_info):
+        """Đặt kết quả phân tích nhân vật (chỉ lần đầu có hiệu lực)"""
+        with self._lock:
+            if not self._characters.done():
+                self._characters.set_result(characters_info)
+
+    def _generate_chapter_images(self, chapter):
+        # Chờ thông tin nhân vật để ảnh giữa các chương nhất quán
+        self._characters.result()
+        return self.image_generator.process_story_chapter(chapter, self.images_dir)
+
+    def _on_stage_done(self, chapter_num, stage):
+        """Ảnh hoặc audio của một chương xong: render video chương khi cả hai đã sẵn sàng"""
+        with self._lock:
+            state = self._chapters[chapter_num]
+            future = state[stage]
+            if future.exception():
+                self._emit(stage, chapter_num, "lỗi", str(future.exception()))
+            else:
+                self._emit(stage, chapter_num, "xong")
+
+            if state["finished"] or state["rendering"]:
+                return
+            if not (state["image"].done() and state["audio"].done()):
+                return
+
+            if state["image"].exception() or state["audio"].exception():
+                state["finished"] = True
+                self._emit("video", chapter_num, "bỏ qua", "thiếu ảnh hoặc audio")
+                return
+
+            # Đánh dấu trong lock để chỉ một callback gửi việc render chương
+            state["rendering"] = True
+
+        # Gửi render ngoài lock: tra checkpoint phải băm toàn bộ ảnh và audio của chương, không được
+        # chặn callback của các chương khác
+        self._emit("video", chapter_num, "bắt đầu")
+        try:
+            video_future = self.video_generator.submit_chapter_render(
+                self._video_pool, state["chapter"], [state["image"].result()], [state["audio"].result()],
+                self.videos_dir
+            )
+        except Exception as e:
+            with self._lock:
+                state["finished"] = True
+            self._emit("video", chapter_num, "lỗi", str(e))
+            return
+
+        with self._lock:
+            state["video"] = video_future
+        video_future.add_done_callback(lambda _: self._on_video_done(chapter_num))
+
+    def _on_video_done(self, chapter_num):
+        with self._lock:
+            state = self._chapters[chapter_num]
+            future = state["video"]
+            if future.exception():
+                self._emit("video", chapter_num, "lỗi", str(future.exception()))
+            elif future.result():
+                self._emit("video", chapter_num, "xong", future.result())
+            else:
+                self._emit("video", chapter_num, "lỗi", "không tạo được video")
+            state["finished"] = True
+
+    def _collect_results(self, story_data):
+        """Ghép kết quả các chương theo thứ tự, lưu các file JSON và ghép video toàn truyện"""
+        story_images = []
+        story_audio = []
+        video_paths = {}
+
+        for chapter in story_data["chapters"]:
+            chapter_num = chapter["chapter_num"]
+            state = self._chapters[chapter_num]
+
+            if state["image"].exception():
+                story_images.append({"chapter_num": chapter_num, "images": []})
+            else:
+                story_images.append(state["image"].result())
+
+            if state["audio"].exception():
+                story_audio.append({
+                    "chapter_num": chapter_num,
+                    "segments": [],
+                    "full_audio": None,
+                    "error": str(state["audio"].exception())
+                })
+            else:
+                story_audio.append(state["audio"].result())
+
+            video = state["video"]
+            video_paths[chapter_num] = video.result() if video and not video.exception() else None
+
+        story_images = self.image_generator.save_story_images(story_images, self.output_dir)
+        story_audio = self.audio_generator.save_story_audio(story_audio, self.output_dir)
+
+        video_data = self.video_generator.concat_chapter_videos(story_data["chapters"], video_paths, self.output_dir)
+
+        return {
+            "story_data": story_data,
+            "story_images": story_images,
+            "story_audio": story_audio,
+            "video_data": video_data
+        }
@@ -0,0 +1,71 @@
+import os
+import sys
+import signal
+import subprocess
+
+# Mã thoát GetExitCodeProcess trả về khi process còn chạy
+_STILL_ACTIVE = 259
+_PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+
+def _pid_alive_windows(pid):
+    # os.kill(pid, 0) trên Windows gọi TerminateProcess, nên phải hỏi trạng thái qua Win32 API
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    handle = kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # Không mở được: process không còn, hoặc còn nhưng không có quyền truy cập
+        return ctypes.get_last_error() == 5  # ERROR_ACCESS_DENIED
+    try:
+        exit_code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+            return True
+        return exit_code.value == _STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def pid_alive(pid):
+    """Kiểm tra process còn chạy mà không gửi tín hiệu dừng (dùng được trên cả Windows và POSIX)"""
+    if not pid:
+        return False
+    if sys.platform == "win32":
+        return _pid_alive_windows(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def new_process_group_kwargs():
+    """Tham số Popen để process con chạy trong nhóm process riêng (dừng được cả các process cháu)"""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def terminate_process_tree(pid):
+    """Dừng process (khởi động bằng new_process_group_kwargs) cùng các process con của nó
+
+    Returns:
+        bool: False nếu không còn process để dừng
+    """
+    if not pid:
+        return False
+    try:
+        if sys.platform == "win32":
+            result = subprocess.run(["taskkill", "/PID", str(pid), "/T", "/F"],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            return result.returncode == 0
+        os.killpg(pid, signal.SIGTERM)
+        return True
+    except (ProcessLookupError, PermissionError, OSError):
+        return False
@@ -0,0 +1,80 @@
+from utils.config import get_env_var, PROVIDER_MODE, GOOGLE_API_KEY, OPENAI_API_KEY, ZHIPUAI_API_KEY
+
+# Factory tạo client theo (tên provider, chế độ)
+_PROVIDERS = {}
+
+
+def register_provider(name, mode, factory):
+    """Đăng ký factory tạo client cho provider name ở chế độ mode ('live' hoặc 'mock')"""
+    _PROVIDERS[(name, mode)] = factory
+
+
+def get_provider_mode():
+    """Chế độ provider đang dùng (biến môi trường PROVIDER_MODE)"""
+    return PROVIDER_MODE
+
+
+def get_provider(name, *args, mode=None, **kwargs):
+    """Tạo client của provider theo chế độ hiện tại
+
+    Các provider đã đăng ký:
+        gemini(model_name): model có generate_content(prompt, generation_config=None, stream=False)
+        openai_speech(): có create(model, voice, input, speed) trả về response có stream_to_file(path)
+        gtts(text, lang, slow): có save(path)
+        zhipuai(**kwargs): client có images.generations(model, prompt)
+        stability_api(), telegram_api(): URL gốc của API
+    """
+    mode = mode or PROVIDER_MODE
+    factory = _PROVIDERS.get((name, mode))
+    if factory is None:
+        raise ValueError(f"Chưa đăng ký provider '{name}' cho chế độ '{mode}'")
+    return factory(*args, **kwargs)
+
+
+def _live_gemini(model_name):
+    import google.generativeai as genai
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return genai.GenerativeModel(model_name)
+
+
+def _live_openai_speech():
+    if not OPENAI_API_KEY:
+        raise ValueError("Thiếu API key cho OpenAI")
+    import openai
+    openai.api_key = OPENAI_API_KEY
+    return openai.audio.speech
+
+
+def _live_gtts(text, lang="vi", slow=False):
+    from gtts import gTTS
+    return gTTS(text=text, lang=lang, slow=slow)
+
+
+def _live_zhipuai(**kwargs):
+    if not ZHIPUAI_API_KEY:
+        raise ValueError("Thiếu API key cho ZhipuAI (CogView4)")
+    import zhipuai
+    return zhipuai.ZhipuAI(api_key=ZHIPUAI_API_KEY, **kwargs)
+
+
+def _mock(attribute):
+    """Factory lấy từ utils.mock_providers (chỉ import khi dùng chế độ mock)"""
+    def factory(*args, **kwargs):
+        from utils import mock_providers
+        return getattr(mock_providers, attribute)(*args, **kwargs)
+    return factory
+
+
+register_provider("gemini", "live", _live_gemini)
+register_provider("openai_speech", "live", _live_openai_speech)
+register_provider("gtts", "live", _live_gtts)
+register_provider("zhipuai", "live", _live_zhipuai)
+register_provider("stability_api", "live", lambda: get_env_var('STABILITY_API_URL', 'https://api.stability.ai'))
+register_provider("telegram_api", "live", lambda: get_env_var('TELEGRAM_API_URL', 'https://api.telegram.org'))
+
+register_provider("gemini", "mock", _mock("MockGenerativeModel"))
+register_provider("openai_speech", "mock", _mock("MockSpeech"))
+register_provider("gtts", "mock", _mock("MockTTS"))
+register_provider("zhipuai", "mock", _mock("MockZhipuAI"))
+register_provider("stability_api", "mock", _mock("mock_server_url"))
+register_provider("telegram_api", "mock", _mock("mock_server_url"))
@@ -0,0 +1,100 @@
+import time
+import threading
+from utils.config import DEFAULT_CONFIG
+
+# Giới hạn tốc độ của mỗi provider: (số request mỗi giây, số request tối đa dồn một lúc), None = không giới hạn.
+# Lấy từ DEFAULT_CONFIG['rate_limits'] (hạn mức đã công bố của provider, xem utils/config.py)
+RATE_LIMITS = {}
+
+
+def parse_rate_limit(value):
+    """Đổi giới hạn dạng "N/T" (tối đa N request mỗi T giây) thành (rate, capacity) của token bucket
+
+    Bucket được chọn sao cho trong bất kỳ khoảng T giây nào cũng không vượt quá N request:
+    capacity + rate * T <= N. Riêng N = 1: mỗi T giây một request.
+
+    Returns:
+        tuple (rate, capacity), hoặc None nếu không giới hạn ("none", "0" hoặc rỗng)
+
+    Raises:
+        ValueError nếu giá trị không đúng định dạng
+    """
+    value = str(value or "").strip().lower()
+    if value in ("", "0", "none"):
+        return None
+    count, _, period = value.partition("/")
+    count, period = int(count), float(period or 1)
+    if count <= 0 or period <= 0:
+        raise ValueError(f"giới hạn phải dương: {value}")
+    capacity = max(1, count // 10)
+    rate = max(count - capacity, 1) / period
+    return rate, capacity
+
+
+def _configured_limit(name):
+    """Giới hạn của provider lấy từ cấu hình (không giới hạn nếu giá trị sai định dạng)"""
+    value = DEFAULT_CONFIG.get('rate_limits', {}).get(name)
+    try:
+        return parse_rate_limit(value)
+    except ValueError as e:
+        print(f"Giới hạn tần suất không hợp lệ cho {name} ({value!r}), bỏ qua giới hạn: {e}")
+        return None
+
+
+class TokenBucket:
+    """Token bucket an toàn đa luồng: mỗi request lấy một token, token được nạp lại theo tốc độ cố định"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Chờ cho đến khi có đủ token rồi lấy ra"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class UnlimitedBucket:
+    """Bucket cho provider không giới hạn tần suất (lỗi 429 vẫn được HttpClient thử lại)"""
+
+    def acquire(self, tokens=1):
+        return
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _make_bucket(limit):
+    return UnlimitedBucket() if limit is None else TokenBucket(*limit)
+
+
+def get_rate_limiter(name):
+    """Lấy token bucket dùng chung trong process cho một provider"""
+    with _limiters_lock:
+        if name not in _limiters:
+            if name not in RATE_LIMITS:
+                RATE_LIMITS[name] = _configured_limit(name)
+            _limiters[name] = _make_bucket(RATE_LIMITS[name])
+        return _limiters[name]
+
+
+def configure_rate_limit(name, rate, capacity):
+    """Thay đổi giới hạn tốc độ của một provider (áp dụng cho các lần gọi sau), rate=None = không giới hạn"""
+    with _limiters_lock:
+        RATE_LIMITS[name] = None if rate is None else (rate, capacity)
+        _limiters[name] = _make_bucket(RATE_LIMITS[name])
@@ -1,21 +1,109 @@
-import google.generativeai as genai
 from tqdm import tqdm
 import os
+import re
 import json
-from utils.config import GOOGLE_API_KEY
-
-# Cấu hình API Gemini
-genai.configure(api_key=GOOGLE_API_KEY)
+from concurrent.futures import as_completed
+from utils.rate_limiter import get_rate_limiter
+from utils.streaming import split_paragraphs
+from utils.providers import get_provider
+from utils.metrics import run_metrics, text_size
+from utils.tracing import tracer, traced, TracedThreadPoolExecutor
 
 class StoryGenerator:
-    def __init__(self, model_name="gemini-2.0-flash"):
-        self.model = genai.GenerativeModel(model_name)
+    def __init__(self, model_name="gemini-2.0-flash", max_workers=4, checkpoint=None):
+        """
+        model_name: model Gemini dùng để viết truyện
+        max_workers: số chương được viết đồng thời khi tạo truyện theo dàn ý
+        checkpoint: CheckpointManifest để ghi lại/dùng lại dàn ý và các chương đã viết
+        """
+        self.model_name = model_name
+        self.model = get_provider("gemini", model_name)
+        self.max_workers = max(1, max_workers)
+        self.checkpoint = checkpoint
     
-    def generate_chapter(self, story_concept, chapter_num, total_chapters, max_tokens=800):
-        """Tạo một chương truyện từ ý tưởng ban đầu"""
+    def generate_outline(self, story_concept, num_chapters):
+        """Tạo dàn ý cho toàn bộ truyện bằng một lần gọi model
+        
+        Returns:
+            list: [{"chapter_num", "summary"}] theo thứ tự chương, None nếu không tạo được
+        """
         prompt = f"""
         Dựa trên ý tưởng truyện sau: {story_concept}
         
+        Hãy lập dàn ý cho một câu chuyện gồm đúng {num_chapters} chương.
+        Với mỗi chương, tóm tắt trong 3-5 câu: các sự kiện chính, nhân vật xuất hiện,
+        bối cảnh và trạng thái câu chuyện ở cuối chương, để các chương nối tiếp nhau liền mạch.
+        Chương đầu tiên giới thiệu nhân vật và bối cảnh, chương cuối cùng kết thúc câu chuyện hoàn chỉnh.
+        
+        Kết quả trả về phải là một mảng JSON:
+        [
+            {{"chapter_num": 1, "summary": "Tóm tắt chương 1"}},
+            ...
+        ]
+        
+        Chỉ trả về JSON, không thêm giải thích.
+        """
+        
+        try:
+            get_rate_limiter("gemini_text").acquire()
+            with run_metrics.measure("story.outline", bytes_in=text_size(prompt)) as event:
+                response = self.model.generate_content(prompt)
+                response_text = response.text
+                event["bytes_out"] = text_size(response_text)
+            
+            # Trích xuất phần JSON
+            json_match = re.search(r'```(?:json)?\s*(\[.*?\])\s*```', response_text, re.DOTALL)
+            if json_match:
+                response_text = json_match.group(1)
+            
+            items = json.loads(response_text.strip())
+            summaries = {int(item["chapter_num"]): item["summary"] for item in items if item.get("summary")}
+            
+            if sorted(summaries) != list(range(1, num_chapters + 1)):
+                print(f"Dàn ý không đủ {num_chapters} chương")
+                return None
+            
+            return [{"chapter_num": i, "summary": summaries[i]} for i in range(1, num_chapters + 1)]
+        except Exception as e:
+            print(f"Lỗi khi tạo dàn ý truyện: {e}")
+            return None
+    
+    def _get_outline(self, story_concept, num_chapters):
+        """Tạo dàn ý, dùng lại dàn ý trong checkpoint nếu có (các chương đã viết phụ thuộc vào nó)"""
+        input_hash = None
+        if self.checkpoint:
+            input_hash = self.checkpoint.input_hash(self.model_name, story_concept, num_chapters)
+            outline = self.checkpoint.get("story:outline", input_hash)
+            if outline:
+                print("Dùng lại dàn ý truyện từ checkpoint")
+                return outline
+        
+        print("Đang tạo dàn ý truyện...")
+        outline = self.generate_outline(story_concept, num_chapters)
+        if outline and self.checkpoint:
+            self.checkpoint.put("story:outline", input_hash, outline)
+        return outline
+    
+    def generate_chapter(self, story_concept, chapter_num, total_chapters, max_tokens=800, outline=None,
+                         paragraph_stream=None):
+        """Tạo một chương truyện từ ý tưởng ban đầu (bám theo dàn ý nếu có)
+        
+        paragraph_stream: ParagraphStream nhận từng đoạn văn ngay khi model viết xong đoạn đó
+                          (luồng được đóng khi chương kết thúc, kể cả khi lỗi)
+        """
+        outline_info = ""
+        if outline:
+            outline_text = "\n".join(f"Chương {item['chapter_num']}: {item['summary']}" for item in outline)
+            outline_info = f"""
+        Dàn ý của toàn bộ câu chuyện:
+        {outline_text}
+        
+        Nội dung chương {chapter_num} phải bám sát dàn ý: {outline[chapter_num - 1]['summary']}
+        """
+        
+        prompt = f"""
+        Dựa trên ý tưởng truyện sau: {story_concept}
+        {outline_info}
         Hãy viết chương {chapter_num}/{total_chapters} của câu chuyện này.
         Chương này phải liên quan và phát triển từ ý tưởng chính.
         Mỗi chương nên có mở đầu, phần thân, và kết thúc rõ ràng.
@@ -25,11 +113,125 @@ class StoryGenerator:
         Đảm bảo tạo ra nội dung hấp dẫn, giàu chi tiết và phù hợp để chuyển thành hình ảnh.
         """
         
-        response = self.model.generate_content(prompt, generation_config={"max_output_tokens": max_tokens})
-        return response.text
+        get_rate_limiter("gemini_text").acquire()
+        with run_metrics.measure("story.chapter", f"chapter_{chapter_num}", bytes_in=text_size(prompt),
+                                 stream=paragraph_stream is not None) as event:
+            if paragraph_stream is None:
+                response = self.model.generate_content(prompt, generation_config={"max_output_tokens": max_tokens})
+                chapter_content = response.text
+            else:
+                try:
+                    chapter_content = self._stream_chapter(prompt, max_tokens, paragraph_stream)
+                finally:
+                    paragraph_stream.close()
+            event["bytes_out"] = text_size(chapter_content)
+        
+        return chapter_content
     
-    def generate_full_story(self, story_concept, num_chapters=3, tokens_per_chapter=800, output_dir="output"):
-        """Tạo toàn bộ câu chuyện với nhiều chương"""
+    def _stream_chapter(self, prompt, max_tokens, paragraph_stream):
+        """Gọi model ở chế độ stream, đẩy từng đoạn văn hoàn chỉnh vào paragraph_stream"""
+        response = self.model.generate_content(
+            prompt,
+            generation_config={"max_output_tokens": max_tokens},
+            stream=True
+        )
+        
+        parts = []
+        buffer = ""
+        for chunk in response:
+            parts.append(chunk.text)
+            paragraphs, buffer = split_paragraphs(buffer + chunk.text)
+            for paragraph in paragraphs:
+                paragraph_stream.put(paragraph)
+        
+        if buffer.strip():
+            paragraph_stream.put(buffer.strip())
+        
+        return "".join(parts)
+    
+    def _write_chapter(self, story_concept, chapter_num, total_chapters, max_tokens, outline, paragraph_stream):
+        """Viết một chương, dùng lại chương trong checkpoint nếu đầu vào không đổi"""
+        if not self.checkpoint:
+            return self.generate_chapter(story_concept, chapter_num, total_chapters, max_tokens=max_tokens,
+                                         outline=outline, paragraph_stream=paragraph_stream)
+        
+        artifact_id = f"story:chapter_{chapter_num}"
+        input_hash = self.checkpoint.input_hash(
+            self.model_name, story_concept, chapter_num, total_chapters, max_tokens, outline
+        )
+        chapter_content = self.checkpoint.get(artifact_id, input_hash)
+        if chapter_content is not None:
+            print(f"Dùng lại chương {chapter_num} từ checkpoint")
+            if paragraph_stream is not None:
+                paragraphs, rest = split_paragraphs(chapter_content)
+                for paragraph in paragraphs + ([rest.strip()] if rest.strip() else []):
+                    paragraph_stream.put(paragraph)
+                paragraph_stream.close()
+            return chapter_content
+        
+        chapter_content = self.generate_chapter(story_concept, chapter_num, total_chapters, max_tokens=max_tokens,
+                                                outline=outline, paragraph_stream=paragraph_stream)
+        self.checkpoint.put(artifact_id, input_hash, chapter_content)
+        return chapter_content
+    
+    def _save_chapter(self, chapter_num, chapter_content, output_dir):
+        """Lưu chương vào file riêng và trả về dữ liệu chương"""
+        chapter_filename = os.path.join(output_dir, f"chapter_{chapter_num}.txt")
+        with open(chapter_filename, "w", encoding="utf-8") as f:
+            f.write(chapter_content)
+        
+        return {
+            "chapter_num": chapter_num,
+            "title": f"Chương {chapter_num}",
+            "content": chapter_content
+        }
+    
+    def _generate_chapters(self, story_concept, num_chapters, tokens_per_chapter, output_dir, outline,
+                           paragraph_streams, on_chapter):
+        """Viết và lưu tất cả các chương, trả về danh sách dữ liệu chương theo thứ tự"""
+        if outline:
+            # Các chương chỉ phụ thuộc vào dàn ý nên có thể viết đồng thời
+            chapters = {}
+            with TracedThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {
+                    executor.submit(
+                        self._write_chapter, story_concept, i, num_chapters,
+                        tokens_per_chapter, outline, paragraph_streams.get(i)
+                    ): i
+                    for i in range(1, num_chapters + 1)
+                }
+                for future in tqdm(as_completed(futures), total=len(futures)):
+                    i = futures[future]
+                    chapters[i] = self._save_chapter(i, future.result(), output_dir)
+                    if on_chapter:
+                        on_chapter(chapters[i])
+            
+            return [chapters[i] for i in range(1, num_chapters + 1)]
+        
+        chapters = []
+        for i in tqdm(range(1, num_chapters + 1)):
+            chapter_content = self._write_chapter(
+                story_concept, i, num_chapters, tokens_per_chapter, None, paragraph_streams.get(i)
+            )
+            
+            chapters.append(self._save_chapter(i, chapter_content, output_dir))
+            if on_chapter:
+                on_chapter(chapters[-1])
+        
+        return chapters
+    
+    @traced("story")
+    def generate_full_story(self, story_concept, num_chapters=3, tokens_per_chapter=800, output_dir="output",
+                            use_outline=True, paragraph_streams=None, on_chapter=None):
+        """Tạo toàn bộ câu chuyện với nhiều chương
+        
+        use_outline: tạo dàn ý trước rồi viết các chương đồng thời theo dàn ý;
+                     nếu không tạo được dàn ý thì viết lần lượt từng chương như cũ
+        paragraph_streams: dict {chapter_num: ParagraphStream}; nếu có, các chương được viết ở
+                           chế độ stream để bước sau (TTS...) bắt đầu trên các đoạn đã viết xong
+        on_chapter: hàm được gọi với dữ liệu chương ngay khi mỗi chương được viết và lưu xong
+        """
+        paragraph_streams = paragraph_streams or {}
         story_data = {
             "concept": story_concept,
             "num_chapters": num_chapters,
@@ -38,27 +240,19 @@ class StoryGenerator:
         
         os.makedirs(output_dir, exist_ok=True)
         
+        outline = None
+        if use_outline and num_chapters > 1:
+            outline = self._get_outline(story_concept, num_chapters)
+        
         print(f"Đang tạo câu chuyện với {num_chapters} chương...")
-        for i in tqdm(range(1, num_chapters + 1)):
-            chapter_content = self.generate_chapter(
-                story_concept, 
-                i, 
-                num_chapters,
-                max_tokens=tokens_per_chapter
+        try:
+            story_data["chapters"] = self._generate_chapters(
+                story_concept, num_chapters, tokens_per_chapter, output_dir, outline, paragraph_streams, on_chapter
             )
-            
-            chapter_data = {
-                "chapter_num": i,
-                "title": f"Chương {i}",
-                "content": chapter_content
-            }
-            
-            story_data["chapters"].append(chapter_data)
-            
-            # Lưu chương vào file riêng
-            chapter_filename = os.path.join(output_dir, f"chapter_{i}.txt")
-            with open(chapter_filename, "w", encoding="utf-8") as f:
-                f.write(chapter_content)
+        finally:
+            # Đóng mọi luồng đoạn văn để bên đọc không chờ mãi khi có chương bị lỗi
+            for stream in paragraph_streams.values():
+                stream.close()
         
         # Lưu toàn bộ dữ liệu truyện vào file JSON
         story_filename = os.path.join(output_dir, "story_data.json")
@@ -0,0 +1,72 @@
+import re
+import threading
+
+# Đoạn văn được ngăn cách bởi ít nhất một dòng trống
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def split_paragraphs(buffer):
+    """Tách các đoạn văn đã hoàn chỉnh khỏi buffer
+
+    Returns:
+        (danh sách đoạn văn hoàn chỉnh, phần còn lại chưa kết thúc)
+    """
+    paragraphs = []
+    while True:
+        match = _PARAGRAPH_BREAK.search(buffer)
+        if not match:
+            return paragraphs, buffer
+        paragraph = buffer[:match.start()].strip()
+        if paragraph:
+            paragraphs.append(paragraph)
+        buffer = buffer[match.end():]
+
+
+class ParagraphStream:
+    """Luồng đoạn văn của một chương: một bên ghi (story), nhiều bên đọc (TTS, tạo ảnh...)
+
+    Các đoạn đã nhận được giữ lại, nên mỗi lần duyệt đều nhận đủ các đoạn từ đầu và
+    chờ đoạn mới cho đến khi luồng được đóng.
+    """
+
+    def __init__(self, chapter_num=None):
+        self.chapter_num = chapter_num
+        self._paragraphs = []
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def put(self, paragraph):
+        """Thêm một đoạn văn hoàn chỉnh"""
+        with self._condition:
+            if self._closed:
+                raise ValueError("Không thể ghi vào luồng đoạn văn đã đóng")
+            self._paragraphs.append(paragraph)
+            self._condition.notify_all()
+
+    def close(self):
+        """Đánh dấu chương đã viết xong (gọi được nhiều lần)"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    @property
+    def closed(self):
+        with self._condition:
+            return self._closed
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self._paragraphs) and not self._closed:
+                    self._condition.wait()
+                if index >= len(self._paragraphs):
+                    return
+                paragraph = self._paragraphs[index]
+            index += 1
+            yield paragraph
+
+    def text(self):
+        """Nội dung đã nhận được, các đoạn cách nhau bởi một dòng trống"""
+        with self._condition:
+            return "\n\n".join(self._paragraphs)
@@ -1,8 +1,10 @@
 import os
-import requests
 import json
 from datetime import datetime
 from utils.config import get_env_var
+from utils.http_client import http_client
+from utils.providers import get_provider, get_provider_mode
+from utils.metrics import run_metrics, text_size
 
 # Lấy thông tin Telegram Bot từ biến môi trường
 TELEGRAM_BOT_TOKEN = get_env_var('TELEGRAM_BOT_TOKEN')
@@ -13,12 +15,21 @@ class TelegramManager:
         """Khởi tạo Telegram Manager"""
         self.bot_token = TELEGRAM_BOT_TOKEN
         self.chat_id = TELEGRAM_CHAT_ID
-        self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+        
+        # Bot API giả lập chấp nhận mọi token/chat ID
+        if get_provider_mode() == "mock":
+            self.bot_token = self.bot_token or "000000:MOCK"
+            self.chat_id = self.chat_id or "1"
         
         if not self.bot_token or not self.chat_id:
             print("Cảnh báo: Thiếu thông tin Telegram Bot Token hoặc Chat ID")
             print("Vui lòng thêm TELEGRAM_BOT_TOKEN và TELEGRAM_CHAT_ID vào file .env")
     
+    @property
+    def base_url(self):
+        """URL Bot API của bot (TELEGRAM_API_URL hoặc máy chủ giả lập, xác định khi gửi request đầu tiên)"""
+        return f"{get_provider('telegram_api')}/bot{self.bot_token}"
+    
     def is_configured(self):
         """Kiểm tra xem Telegram Bot đã được cấu hình đúng chưa"""
         return bool(self.bot_token and self.chat_id)
@@ -36,7 +47,9 @@ class TelegramManager:
                 "text": message,
                 "parse_mode": "HTML"
             }
-            response = requests.post(url, data=data)
+            with run_metrics.measure("telegram.message", bytes_in=text_size(message)) as event:
+                response = http_client.post(url, data=data)
+                event["bytes_out"] = len(response.content)
             response_json = response.json()
             
             if response_json.get("ok"):
@@ -88,11 +101,18 @@ class TelegramManager:
             
             # Gửi yêu cầu
             print(f"Đang gửi video lên Telegram... (file size: {os.path.getsize(video_path) / (1024*1024):.2f} MB)")
-            response = requests.post(url, data=data, files=files)
-            
-            # Đóng file
-            for file in files.values():
-                file.close()
+            upload_size = sum(os.path.getsize(file.name) for file in files.values())
+            try:
+                with run_metrics.measure("telegram.upload", os.path.basename(video_path), bytes_in=upload_size) as event:
+                    # Upload video lớn cần thời gian đọc dài hơn mặc định
+                    response = http_client.post(url, data=data, files=files, timeout=(10, 600))
+                    event["bytes_out"] = len(response.content)
+                    if response.status_code != 200:
+                        event["error"] = f"HTTP {response.status_code}"
+            finally:
+                # Đóng file
+                for file in files.values():
+                    file.close()
             
             # Xử lý kết quả
             response_json = response.json()
@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import uuid
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# Span đang mở trong luồng/ngữ cảnh hiện tại
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Span:
+    """Một đoạn công việc có thời gian bắt đầu/kết thúc, span cha và các thuộc tính"""
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = "ok"
+        self.start = time.time()
+        self.end = None
+        self.pid = os.getpid()
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        """Sự kiện tức thời trong span (thử lại, fallback, cache hit...)"""
+        self.events.append({"name": name, "time": time.time(), "attributes": attributes})
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "end": self.end,
+            "status": self.status,
+            "attributes": self.attributes,
+            "events": self.events,
+            "pid": self.pid,
+            "thread_id": self.thread_id,
+            "thread_name": self.thread_name
+        }
+
+
+class Tracer:
+    """Ghi lại các span của một lần chạy và xuất ra file Chrome Trace Event (JSON)
+
+    File trace.json mở được offline bằng https://ui.perfetto.dev hoặc chrome://tracing.
+    Span con chạy ở thread/process khác span cha được nối bằng mũi tên (flow event).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Bắt đầu trace mới"""
+        with self._lock:
+            self.trace_id = uuid.uuid4().hex
+            self._spans = []
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Mở span con của span hiện tại (hoặc span gốc nếu chưa có)"""
+        parent = _current_span.get()
+        if parent is not None:
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+        else:
+            span = Span(name, self.trace_id, None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.status = "error"
+            span.set_attribute("error", f"{e.__class__.__name__}: {e}")
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end = time.time()
+            with self._lock:
+                self._spans.append(span.to_dict())
+
+    @staticmethod
+    def current_span():
+        return _current_span.get()
+
+    def set_attribute(self, key, value):
+        """Đặt thuộc tính cho span hiện tại (bỏ qua nếu không có span)"""
+        span = _current_span.get()
+        if span is not None:
+            span.set_attribute(key, value)
+
+    def add_event(self, name, **attributes):
+        """Thêm sự kiện vào span hiện tại (bỏ qua nếu không có span)"""
+        span = _current_span.get()
+        if span is not None:
+            span.add_event(name, **attributes)
+
+    def current_context(self):
+        """Ngữ cảnh trace để truyền sang process khác: (trace_id, span_id của span hiện tại)"""
+        span = _current_span.get()
+        if span is not None:
+            return span.trace_id, span.span_id
+        return self.trace_id, None
+
+    @contextmanager
+    def remote_parent(self, context):
+        """Dùng span ở process khác (từ current_context) làm span cha trong khối lệnh"""
+        trace_id, span_id = context
+        parent = Span("remote", trace_id)
+        parent.span_id = span_id
+        token = _current_span.set(parent if span_id else None)
+        try:
+            yield
+        finally:
+            _current_span.reset(token)
+
+    def drain(self):
+        """Lấy và xóa các span đã ghi (để gửi từ process con về process chính)"""
+        with self._lock:
+            spans, self._spans = self._spans, []
+        return spans
+
+    def merge(self, spans):
+        """Thêm các span ghi ở process khác"""
+        with self._lock:
+            self._spans.extend(spans)
+
+    def export_chrome_trace(self, path):
+        """Xuất các span ra file Chrome Trace Event, trả về đường dẫn file"""
+        with self._lock:
+            spans = sorted(self._spans, key=lambda span: span["start"])
+
+        origin = min((span["start"] for span in spans), default=time.time())
+        by_id = {span["span_id"]: span for span in spans}
+        trace_events = []
+        threads = {}
+
+        def ts(value):
+            return round((value - origin) * 1e6, 1)
+
+        for span in spans:
+            threads[(span["pid"], span["thread_id"])] = span["thread_name"]
+            trace_events.append({
+                "name": span["name"],
+                "cat": span["name"].split(".")[0],
+                "ph": "X",
+                "ts": ts(span["start"]),
+                "dur": round((span["end"] - span["start"]) * 1e6, 1),
+                "pid": span["pid"],
+                "tid": span["thread_id"],
+                "args": dict(span["attributes"], span_id=span["span_id"], parent_id=span["parent_id"],
+                             status=span["status"])
+            })
+            for event in span["events"]:
+                trace_events.append({
+                    "name": event["name"],
+                    "cat": "event",
+                    "ph": "i",
+                    "s": "t",
+                    "ts": ts(event["time"]),
+                    "pid": span["pid"],
+                    "tid": span["thread_id"],
+                    "args": event["attributes"]
+                })
+
+            # Mũi tên từ span cha sang span con khi chúng chạy ở thread/process khác nhau
+            parent = by_id.get(span["parent_id"])
+            if parent and (parent["pid"], parent["thread_id"]) != (span["pid"], span["thread_id"]):
+                flow = {"name": "spawn", "cat": "flow", "id": span["span_id"]}
+                trace_events.append(dict(flow, ph="s", ts=ts(span["start"]), pid=parent["pid"], tid=parent["thread_id"]))
+                trace_events.append(dict(flow, ph="f", bp="e", ts=ts(span["start"]), pid=span["pid"],
+                                         tid=span["thread_id"]))
+
+        for (pid, thread_id), thread_name in threads.items():
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id,
+                                 "args": {"name": thread_name}})
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "traceEvents": trace_events,
+                "displayTimeUnit": "ms",
+                "otherData": {"trace_id": self.trace_id}
+            }, f, ensure_ascii=False)
+        return path
+
+
+def traced(name, **attributes):
+    """Decorator: chạy hàm trong một span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor chạy mỗi task trong bản sao ngữ cảnh của nơi submit
+
+    Nhờ vậy span mở trong task là con của span đang mở lúc submit.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        context = contextvars.copy_context()
+        return super().submit(context.run, fn, *args, **kwargs)
+
+
+# Tạo instance mặc định
+tracer = Tracer()
@@ -1,64 +1,109 @@
 import os
 import json
 import random
+import shutil
 import tempfile
+from concurrent.futures import ProcessPoolExecutor, Future, as_completed
 from tqdm import tqdm
 from moviepy.editor import *
 from pydub import AudioSegment
 from PIL import Image
+from io import BytesIO
+from fractions import Fraction
+from utils.config import DEFAULT_CONFIG
+from utils.file_cache import FileCache, file_digest
+from utils.duration_probe import duration_probe
+from utils.image_utils import fit_to_frame, image_size, normalize_image_file
+from utils.metrics import run_metrics, file_size
+from utils.tracing import tracer, traced, TracedThreadPoolExecutor
+from utils.governor import governor
+from utils.ffmpeg_utils import (
+    ffmpeg_available, ffprobe_available, write_concat_list, run_ffmpeg, probe_stream_params
+)
 
 class VideoGenerator:
-    def __init__(self, width=1280, height=720, fps=30):
+    def __init__(self, width=1280, height=720, fps=30, render_engine="ffmpeg",
+                 render_workers=1, x264_threads=None, temp_dir=None, checkpoint=None):
         """
         Khởi tạo video generator
         width, height: kích thước video
         fps: frames per second
+        render_engine: 'ffmpeg' (encode trực tiếp) hoặc 'moviepy'
+        render_workers: số process render chương song song (1 = tuần tự)
+        x264_threads: số thread x264 cho mỗi lần encode (None = để encoder tự chọn)
+        temp_dir: thư mục chứa file tạm khi render (None = thư mục tạm của hệ thống)
+        checkpoint: CheckpointManifest để ghi lại/dùng lại video chương đã render
         """
         self.width = width
         self.height = height
         self.fps = fps
+        self.render_engine = render_engine
+        self.render_workers = max(1, int(render_workers or 1))
+        self.x264_threads = x264_threads
+        self.temp_dir = temp_dir
+        self.checkpoint = checkpoint
+        
+        # Cache ảnh đã resize, dùng chung giữa các lần chạy và các process render
+        self.resample_name = "LANCZOS"
+        self.resize_cache = FileCache(
+            os.path.join(DEFAULT_CONFIG['temp_dir'], "resize_cache"),
+            max_bytes=DEFAULT_CONFIG['resize_cache_max_mb'] * 1024 * 1024
+        )
     
-    def resize_image(self, image_path, output_path=None):
-        """Resize hình ảnh để phù hợp với kích thước video"""
+    def resize_image(self, image_path, output_path):
+        """Resize hình ảnh để phù hợp với kích thước video, ghi kết quả ra output_path
+
+        Kết quả được lưu trong resize cache theo hash nội dung ảnh gốc + kích thước + kiểu resample,
+        nên mỗi ảnh chỉ phải crop/resize một lần dù được dùng lại nhiều lần hoặc qua nhiều lần chạy.
+        Ảnh trong cache được link/sao chép ra output_path (thư mục của người gọi) vì process khác
+        dùng chung cache có thể dọn entry bất kỳ lúc nào.
+        Ảnh đã đúng kích thước video (frame chuẩn hóa lúc tạo ảnh) được sao chép nguyên vẹn.
+        """
         try:
-            img = Image.open(image_path)
+            if image_size(image_path) == (self.width, self.height):
+                shutil.copyfile(image_path, output_path)
+                return output_path
             
-            # Tính toán tỷ lệ khung hình
-            img_ratio = img.width / img.height
-            target_ratio = self.width / self.height
+            cache_key = FileCache.make_key(
+                "resize", file_digest(image_path), self.width, self.height, self.resample_name
+            )
             
-            if img_ratio > target_ratio:
-                # Ảnh rộng hơn so với tỷ lệ target
-                new_width = int(img.height * target_ratio)
-                left = (img.width - new_width) // 2
-                img = img.crop((left, 0, left + new_width, img.height))
-            else:
-                # Ảnh cao hơn so với tỷ lệ target
-                new_height = int(img.width / target_ratio)
-                top = (img.height - new_height) // 2
-                img = img.crop((0, top, img.width, top + new_height))
+            if self.resize_cache.link_to(cache_key, output_path):
+                return output_path
             
-            # Resize ảnh theo kích thước video
-            img = img.resize((self.width, self.height), Image.LANCZOS)
+            with run_metrics.measure("video.resize", os.path.basename(image_path),
+                                     bytes_in=file_size(image_path)) as event:
+                with Image.open(image_path) as img:
+                    img = fit_to_frame(img, self.width, self.height, self.resample_name)
+                
+                buffer = BytesIO()
+                img.save(buffer, format="PNG")
+                event["bytes_out"] = buffer.tell()
             
-            # Lưu ảnh đã resize
-            if output_path:
-                img.save(output_path)
-                return output_path
-            else:
-                # Lưu vào file tạm
-                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                    output_path = tmp.name
-                    img.save(output_path)
-                return output_path
+            # Ghi bản riêng cho người gọi trước, rồi lưu ảnh đã resize vào cache
+            with open(output_path, "wb") as f:
+                f.write(buffer.getvalue())
+            self.resize_cache.put_bytes(cache_key, buffer.getvalue(), suffix=".png")
+            return output_path
                 
         except Exception as e:
-            print(f"Lỗi khi resize hình ảnh: {e}")
-            return image_path
+            # Không trả về ảnh gốc: ảnh sai kích thước sẽ bị kéo giãn khác các frame còn lại trong video.
+            # Resize trực tiếp không qua cache; nếu ảnh không đọc được thì lỗi được báo cho người gọi
+            print(f"Lỗi khi resize hình ảnh qua cache, resize trực tiếp: {e}")
+            return normalize_image_file(image_path, output_path, self.width, self.height, self.resample_name)
+    
+    def _frame_clip(self, image_path):
+        """ImageClip của ảnh đã resize (MoviePy đọc ảnh vào bộ nhớ ngay khi tạo clip)"""
+        with tempfile.TemporaryDirectory(prefix="frame_", dir=self.temp_dir) as frame_dir:
+            return ImageClip(self.resize_image(image_path, os.path.join(frame_dir, "frame.png")))
     
     def get_audio_duration(self, audio_path):
         """Lấy độ dài (giây) của file audio"""
         try:
+            # Đọc từ header (có ghi nhớ), chỉ decode toàn bộ file khi không đọc được header
+            duration = duration_probe.get_duration(audio_path)
+            if duration is not None:
+                return duration
             audio = AudioSegment.from_file(audio_path)
             return len(audio) / 1000.0  # Chuyển từ milliseconds sang giây
         except Exception as e:
@@ -79,11 +124,8 @@ class VideoGenerator:
             return None
         
         try:
-            # Resize hình ảnh
-            resized_image = self.resize_image(image_path)
-            
-            # Tạo image clip
-            image_clip = ImageClip(resized_image, duration=None)
+            # Tạo image clip từ ảnh đã resize
+            image_clip = self._frame_clip(image_path)
             
             # Tạo audio clip
             audio_clip = AudioFileClip(audio_path)
@@ -100,6 +142,271 @@ class VideoGenerator:
             print(f"Lỗi khi tạo segment clip: {e}")
             return None
     
+    def _build_timeline(self, segment_durations, available_images):
+        """Phân bổ hình ảnh theo thời lượng audio
+
+        Args:
+            segment_durations: danh sách (segment, thời lượng) theo thứ tự phát
+            available_images: danh sách đường dẫn hình ảnh khả dụng
+
+        Returns:
+            list: danh sách (đường dẫn ảnh, thời lượng hiển thị) theo thứ tự thời gian
+        """
+        total_duration = sum(duration for _, duration in segment_durations)
+        num_segments = len(segment_durations)
+        num_images = len(available_images)
+
+        timeline = []
+
+        # Cách phân bổ hình ảnh mới, dựa trên tỷ lệ thời gian
+        if num_segments <= num_images:
+            # Trường hợp nhiều ảnh hơn đoạn audio
+            # Phân bổ nhiều ảnh cho mỗi đoạn audio dựa trên thời lượng
+            for i, (segment, duration) in enumerate(segment_durations):
+                # Tính số ảnh sẽ sử dụng cho đoạn audio này dựa trên tỷ lệ thời lượng
+                segment_ratio = duration / total_duration
+                num_images_for_segment = max(1, round(segment_ratio * num_images))
+
+                # Tính khoảng thời gian hiển thị cho mỗi ảnh
+                image_duration = duration / num_images_for_segment
+
+                # Xác định các ảnh sẽ sử dụng cho đoạn này
+                start_idx = int((i / num_segments) * num_images)
+
+                for j in range(num_images_for_segment):
+                    img_idx = min(start_idx + j, num_images - 1)
+                    timeline.append((available_images[img_idx], image_duration))
+        else:
+            # Trường hợp nhiều đoạn audio hơn ảnh
+            for i, (segment, duration) in enumerate(segment_durations):
+                # Chọn hình ảnh phù hợp dựa trên vị trí tương đối
+                img_index = min(int((i / num_segments) * num_images), num_images - 1)
+                timeline.append((available_images[img_index], duration))
+
+        return timeline
+
+    def _render_timeline_ffmpeg(self, timeline, audio_paths, output_path):
+        """Render slideshow bằng một lượt encode ffmpeg qua concat demuxer
+
+        Args:
+            timeline: danh sách (đường dẫn ảnh, thời lượng) từ _build_timeline
+            audio_paths: danh sách file audio sẽ được phát nối tiếp
+            output_path: đường dẫn file video đầu ra
+        """
+        with tempfile.TemporaryDirectory(prefix="render_", dir=self.temp_dir) as work_dir:
+            # Resize một lần cho mỗi ảnh gốc, dùng lại cho các lần xuất hiện sau
+            resized = {}
+            entries = []
+            for image_path, duration in timeline:
+                if image_path not in resized:
+                    frame_path = os.path.join(work_dir, f"frame_{len(resized)}.png")
+                    resized[image_path] = self.resize_image(image_path, frame_path)
+                entries.append((resized[image_path], duration))
+
+            # Concat demuxer bỏ qua thời lượng của ảnh cuối cùng nên cần lặp lại ảnh cuối;
+            # ảnh cuối được kéo dài thêm một chút, -shortest sẽ cắt đúng theo audio
+            last_image, last_duration = entries[-1]
+            entries[-1] = (last_image, last_duration + 1.0)
+            entries.append((last_image, None))
+
+            video_list = write_concat_list(entries, os.path.join(work_dir, "video_list.txt"))
+
+            args = ["-f", "concat", "-safe", "0", "-i", video_list]
+            if len(audio_paths) == 1:
+                args += ["-i", audio_paths[0]]
+            else:
+                audio_list = write_concat_list(
+                    [(path, None) for path in audio_paths],
+                    os.path.join(work_dir, "audio_list.txt")
+                )
+                args += ["-f", "concat", "-safe", "0", "-i", audio_list]
+
+            args += ["-map", "0:v:0", "-map", "1:a:0"]
+            args += self._encode_args(tune="stillimage")
+            args += ["-shortest", "-movflags", "+faststart", output_path]
+            run_ffmpeg(args)
+
+        return output_path
+
+    def _encode_args(self, tune=None):
+        """Tham số encode chung để mọi video chương có cùng codec, kích thước và fps"""
+        args = [
+            "-vf", f"scale={self.width}:{self.height},setsar=1,format=yuv420p",
+            "-r", self.fps,
+            "-c:v", "libx264",
+            "-preset", "medium"
+        ]
+        if tune:
+            args += ["-tune", tune]
+        if self.x264_threads:
+            args += ["-threads", self.x264_threads]
+        args += ["-c:a", "aac", "-ar", "44100", "-ac", "2"]
+        return args
+
+    def _target_stream_params(self):
+        """Tham số stream mà _encode_args tạo ra, dùng để so sánh trước khi ghép"""
+        return {
+            "video_codec": "h264",
+            "width": self.width,
+            "height": self.height,
+            # fps dạng số thực (29.97) được đổi về phân số ffprobe báo (2997/100, 30000/1001)
+            "fps": Fraction(self.fps).limit_denominator(1001),
+            "pix_fmt": "yuv420p",
+            "audio_codec": "aac",
+            "sample_rate": 44100,
+            "channels": 2
+        }
+
+    def _normalize_video(self, video_path, output_path, has_audio=True):
+        """Encode lại một video chương theo tham số chuẩn để có thể ghép bằng stream copy"""
+        args = ["-i", video_path]
+        if has_audio:
+            args += ["-map", "0:v:0", "-map", "0:a:0"]
+        else:
+            # Thêm track im lặng để mọi chương đều có audio giống nhau
+            args += ["-f", "lavfi", "-i", "anullsrc=channel_layout=stereo:sample_rate=44100"]
+            args += ["-map", "0:v:0", "-map", "1:a:0", "-shortest"]
+        args += self._encode_args()
+        args += ["-movflags", "+faststart", output_path]
+        run_ffmpeg(args)
+        return output_path
+
+    def _concat_videos_ffmpeg(self, video_paths, output_path):
+        """Ghép các video chương bằng concat demuxer (-c copy), không encode lại
+
+        Chương nào có tham số stream khác chuẩn sẽ được encode lại riêng trước khi ghép.
+        """
+        target = self._target_stream_params()
+
+        with tempfile.TemporaryDirectory(prefix="concat_", dir=self.temp_dir) as work_dir:
+            concat_paths = []
+            for i, video_path in enumerate(video_paths):
+                params = probe_stream_params(video_path)
+                mismatched = {
+                    key: params[key] for key in target if not _stream_param_matches(key, params[key], target[key])
+                }
+                if not mismatched:
+                    concat_paths.append(video_path)
+                    continue
+
+                print(f"Video {os.path.basename(video_path)} có tham số khác chuẩn {mismatched}, đang encode lại...")
+                normalized_path = os.path.join(work_dir, f"normalized_{i}.mp4")
+                self._normalize_video(video_path, normalized_path, has_audio=params["audio_codec"] is not None)
+                concat_paths.append(normalized_path)
+
+            concat_list = write_concat_list(
+                [(path, None) for path in concat_paths],
+                os.path.join(work_dir, "concat_list.txt")
+            )
+            run_ffmpeg([
+                "-f", "concat", "-safe", "0", "-i", concat_list,
+                "-map", "0", "-c", "copy",
+                "-movflags", "+faststart",
+                output_path
+            ])
+
+        return output_path
+
+    def _write_moviepy_clip(self, clip, output_path):
+        """Xuất clip MoviePy, file audio tạm nằm trong thư mục riêng để các process không ghi đè nhau"""
+        with tempfile.TemporaryDirectory(prefix="moviepy_", dir=self.temp_dir) as work_dir:
+            clip.write_videofile(
+                output_path,
+                fps=self.fps,
+                codec="libx264",
+                audio_codec="aac",
+                temp_audiofile=os.path.join(work_dir, "temp-audio.m4a"),
+                remove_temp=True,
+                threads=self.x264_threads
+            )
+        return output_path
+
+    def _concat_videos_moviepy(self, video_paths, output_path):
+        """Ghép các video chương bằng MoviePy (decode và encode lại toàn bộ)"""
+        # Tạo clip cho từng chương
+        clips = [VideoFileClip(video_path) for video_path in video_paths]
+
+        # Nối các clip lại với nhau
+        final_clip = concatenate_videoclips(clips)
+
+        # Xuất video
+        self._write_moviepy_clip(final_clip, output_path)
+
+        return output_path
+
+    def _render_timeline_moviepy(self, timeline, audio_path, output_path):
+        """Render slideshow bằng MoviePy (CompositeVideoClip), dùng khi không có ffmpeg"""
+        full_audio_clip = AudioFileClip(audio_path)
+
+        # Tạo danh sách clips
+        clips = []
+        current_time = 0
+
+        for image_path, duration in timeline:
+            # Tạo image clip từ ảnh đã resize
+            image_clip = self._frame_clip(image_path)
+            image_clip = image_clip.set_duration(duration)
+
+            # Set start time
+            image_clip = image_clip.set_start(current_time)
+
+            clips.append(image_clip)
+            current_time += duration
+
+        # Ghép các clip lại với nhau
+        final_clip = CompositeVideoClip(clips, size=(self.width, self.height))
+
+        # Thêm audio vào video
+        final_clip = final_clip.set_audio(full_audio_clip)
+
+        # Xuất video
+        self._write_moviepy_clip(final_clip, output_path)
+
+        return output_path
+
+    def _render_segments_moviepy(self, audio_segments, available_images, output_path):
+        """Render video từ các audio segments bằng MoviePy, dùng khi không có ffmpeg"""
+        # Tạo clip cho từng segment
+        segment_clips = []
+
+        num_segments = len(audio_segments)
+        num_images = len(available_images)
+
+        for i, segment in enumerate(audio_segments):
+            # Lấy đường dẫn audio
+            audio_path = segment["audio_path"]
+
+            # Chọn hình ảnh phù hợp
+            img_index = min(int((i / num_segments) * num_images), num_images - 1)
+            image_path = available_images[img_index]
+
+            # Tạo clip cho segment này
+            image_clip = self._frame_clip(image_path)
+            audio_clip = AudioFileClip(audio_path)
+
+            # Cập nhật duration cho image clip
+            image_clip = image_clip.set_duration(audio_clip.duration)
+
+            # Thêm audio vào image clip
+            video_clip = image_clip.set_audio(audio_clip)
+
+            segment_clips.append(video_clip)
+
+        # Nối các segment clips lại với nhau
+        if not segment_clips:
+            return None
+
+        final_clip = concatenate_videoclips(segment_clips)
+
+        # Xuất video
+        self._write_moviepy_clip(final_clip, output_path)
+
+        return output_path
+
+    def _use_ffmpeg(self):
+        """Kiểm tra có thể render bằng ffmpeg hay không"""
+        return self.render_engine == "ffmpeg" and ffmpeg_available()
+
     def create_chapter_video(self, chapter_data, story_images, story_audio, output_dir):
         """Tạo video cho một chương"""
         chapter_num = chapter_data["chapter_num"]
@@ -126,114 +433,43 @@ class VideoGenerator:
             print(f"Không tìm thấy dữ liệu hình ảnh cho chương {chapter_num}")
             return None
         
+        output_path = os.path.join(output_dir, f"chapter_{chapter_num}.mp4")
+        
+        # Lấy danh sách hình ảnh
+        available_images = []
+        for img in chapter_images["images"]:
+            # Ưu tiên frame đã chuẩn hóa đúng kích thước video lúc tạo ảnh
+            normalized_path = img.get("normalized_path")
+            if (normalized_path and img.get("normalized_size") == [self.width, self.height]
+                    and os.path.exists(normalized_path)):
+                available_images.append(normalized_path)
+            elif img.get("image_path") and os.path.exists(img["image_path"]):
+                available_images.append(img["image_path"])
+        
+        if not available_images:
+            print(f"Không có hình ảnh khả dụng cho chương {chapter_num}")
+            return None
+        
         # Nếu có file audio đầy đủ cho cả chương và không có lỗi
         if chapter_audio.get("full_audio") and os.path.exists(chapter_audio["full_audio"]) and not chapter_audio.get("error"):
-            output_path = os.path.join(output_dir, f"chapter_{chapter_num}.mp4")
-            
             try:
-                full_audio_clip = AudioFileClip(chapter_audio["full_audio"])
-                audio_duration = full_audio_clip.duration
-                
-                # Tạo clip cho từng segment của chương
-                segment_clips = []
-                
-                # Lấy danh sách hình ảnh
-                available_images = []
-                for img in chapter_images["images"]:
-                    if img.get("image_path") and os.path.exists(img["image_path"]):
-                        available_images.append(img["image_path"])
-                
-                if not available_images:
-                    print(f"Không có hình ảnh khả dụng cho chương {chapter_num}")
-                    return None
-                
                 # Phân bổ hình ảnh cho các segment
                 segment_durations = []
                 for segment in chapter_audio["segments"]:
                     if segment.get("audio_path") and os.path.exists(segment["audio_path"]):
-                        duration = self.get_audio_duration(segment["audio_path"])
+                        duration = segment.get("duration") or self.get_audio_duration(segment["audio_path"])
                         segment_durations.append((segment, duration))
                 
-                total_duration = sum(duration for _, duration in segment_durations)
-                num_segments = len(segment_durations)
-                num_images = len(available_images)
+                print(f"Phân bổ {len(available_images)} ảnh cho {len(segment_durations)} đoạn audio")
+                timeline = self._build_timeline(segment_durations, available_images)
                 
-                # Tạo danh sách clips
-                clips = []
-                current_time = 0
+                if self._use_ffmpeg():
+                    try:
+                        return self._render_timeline_ffmpeg(timeline, [chapter_audio["full_audio"]], output_path)
+                    except Exception as e:
+                        print(f"Lỗi khi render bằng ffmpeg cho chương {chapter_num}, chuyển sang MoviePy: {e}")
                 
-                print(f"Phân bổ {num_images} ảnh cho {num_segments} đoạn audio")
-                
-                # Cách phân bổ hình ảnh mới, dựa trên tỷ lệ thời gian
-                if num_segments <= num_images:
-                    # Trường hợp nhiều ảnh hơn đoạn audio
-                    # Phân bổ nhiều ảnh cho mỗi đoạn audio dựa trên thời lượng
-                    for i, (segment, duration) in enumerate(segment_durations):
-                        # Tính số ảnh sẽ sử dụng cho đoạn audio này dựa trên tỷ lệ thời lượng
-                        segment_ratio = duration / total_duration
-                        num_images_for_segment = max(1, round(segment_ratio * num_images))
-                        
-                        # Tính khoảng thời gian hiển thị cho mỗi ảnh
-                        image_duration = duration / num_images_for_segment
-                        
-                        # Xác định các ảnh sẽ sử dụng cho đoạn này
-                        start_idx = int((i / num_segments) * num_images)
-                        
-                        for j in range(num_images_for_segment):
-                            img_idx = min(start_idx + j, num_images - 1)
-                            image_path = available_images[img_idx]
-                            
-                            # Resize hình ảnh
-                            resized_image = self.resize_image(image_path)
-                            
-                            # Tạo image clip
-                            image_clip = ImageClip(resized_image)
-                            image_clip = image_clip.set_duration(image_duration)
-                            
-                            # Set start time
-                            seg_start_time = current_time + j * image_duration
-                            image_clip = image_clip.set_start(seg_start_time)
-                            
-                            clips.append(image_clip)
-                        
-                        current_time += duration
-                else:
-                    # Trường hợp nhiều đoạn audio hơn ảnh
-                    for i, (segment, duration) in enumerate(segment_durations):
-                        # Chọn hình ảnh phù hợp dựa trên vị trí tương đối
-                        img_index = min(int((i / num_segments) * num_images), num_images - 1)
-                        image_path = available_images[img_index]
-                        
-                        # Resize hình ảnh
-                        resized_image = self.resize_image(image_path)
-                        
-                        # Tạo image clip
-                        image_clip = ImageClip(resized_image)
-                        image_clip = image_clip.set_duration(duration)
-                        
-                        # Set start time
-                        image_clip = image_clip.set_start(current_time)
-                        
-                        clips.append(image_clip)
-                        current_time += duration
-                
-                # Ghép các clip lại với nhau
-                final_clip = CompositeVideoClip(clips, size=(self.width, self.height))
-                
-                # Thêm audio vào video
-                final_clip = final_clip.set_audio(full_audio_clip)
-                
-                # Xuất video
-                final_clip.write_videofile(
-                    output_path,
-                    fps=self.fps,
-                    codec="libx264",
-                    audio_codec="aac",
-                    temp_audiofile="temp-audio.m4a",
-                    remove_temp=True
-                )
-                
-                return output_path
+                return self._render_timeline_moviepy(timeline, chapter_audio["full_audio"], output_path)
                 
             except Exception as e:
                 print(f"Lỗi khi tạo video cho chương {chapter_num}: {e}")
@@ -243,18 +479,6 @@ class VideoGenerator:
             print(f"Không tìm thấy file audio đầy đủ cho chương {chapter_num}, sẽ sử dụng audio segments")
             
             try:
-                output_path = os.path.join(output_dir, f"chapter_{chapter_num}.mp4")
-                
-                # Lấy danh sách hình ảnh
-                available_images = []
-                for img in chapter_images["images"]:
-                    if img.get("image_path") and os.path.exists(img["image_path"]):
-                        available_images.append(img["image_path"])
-                
-                if not available_images:
-                    print(f"Không có hình ảnh khả dụng cho chương {chapter_num}")
-                    return None
-                
                 # Lấy danh sách các audio segments
                 audio_segments = []
                 for segment in chapter_audio["segments"]:
@@ -265,74 +489,181 @@ class VideoGenerator:
                     print(f"Không có audio segments khả dụng cho chương {chapter_num}")
                     return None
                 
-                # Tạo clip cho từng segment
-                segment_clips = []
-                
                 num_segments = len(audio_segments)
                 num_images = len(available_images)
                 
                 print(f"Sử dụng audio segments: Phân bổ {num_images} ảnh cho {num_segments} đoạn audio")
                 
-                for i, segment in enumerate(audio_segments):
-                    # Lấy đường dẫn audio
-                    audio_path = segment["audio_path"]
-                    
-                    # Lấy độ dài audio
-                    audio_duration = self.get_audio_duration(audio_path)
-                    
-                    # Chọn hình ảnh phù hợp
-                    img_index = min(int((i / num_segments) * num_images), num_images - 1)
-                    image_path = available_images[img_index]
-                    
-                    # Resize hình ảnh
-                    resized_image = self.resize_image(image_path)
-                    
-                    # Tạo clip cho segment này
-                    image_clip = ImageClip(resized_image)
-                    audio_clip = AudioFileClip(audio_path)
-                    
-                    # Cập nhật duration cho image clip
-                    image_clip = image_clip.set_duration(audio_clip.duration)
-                    
-                    # Thêm audio vào image clip
-                    video_clip = image_clip.set_audio(audio_clip)
-                    
-                    segment_clips.append(video_clip)
+                if self._use_ffmpeg():
+                    try:
+                        # Mỗi segment hiển thị một ảnh theo vị trí tương đối, audio được nối tiếp
+                        timeline = []
+                        for i, segment in enumerate(audio_segments):
+                            img_index = min(int((i / num_segments) * num_images), num_images - 1)
+                            duration = segment.get("duration") or self.get_audio_duration(segment["audio_path"])
+                            timeline.append((available_images[img_index], duration))
+                        
+                        audio_paths = [segment["audio_path"] for segment in audio_segments]
+                        return self._render_timeline_ffmpeg(timeline, audio_paths, output_path)
+                    except Exception as e:
+                        print(f"Lỗi khi render bằng ffmpeg cho chương {chapter_num}, chuyển sang MoviePy: {e}")
                 
-                # Nối các segment clips lại với nhau
-                if segment_clips:
-                    final_clip = concatenate_videoclips(segment_clips)
-                    
-                    # Xuất video
-                    final_clip.write_videofile(
-                        output_path,
-                        fps=self.fps,
-                        codec="libx264",
-                        audio_codec="aac",
-                        temp_audiofile="temp-audio.m4a",
-                        remove_temp=True
-                    )
-                    
-                    return output_path
-                else:
+                result = self._render_segments_moviepy(audio_segments, available_images, output_path)
+                if not result:
                     print(f"Không thể tạo clip cho chương {chapter_num}")
-                    return None
+                return result
                 
             except Exception as e:
                 print(f"Lỗi khi tạo video từ audio segments cho chương {chapter_num}: {e}")
                 return None
     
+    def render_chapter(self, chapter_data, story_images, story_audio, output_dir):
+        """Render video một chương và ghi thời gian encode vào run_metrics
+
+        Chờ slot encode dùng chung của máy chủ để các phiên không cùng lúc chạy quá nhiều x264.
+        """
+        with governor.slot("encode"):
+            with run_metrics.measure("video.encode", f"chapter_{chapter_data['chapter_num']}",
+                                     engine=self.render_engine, chapter_num=chapter_data['chapter_num']) as event:
+                video_path = self.create_chapter_video(chapter_data, story_images, story_audio, output_dir)
+                event["bytes_out"] = file_size(video_path)
+                if not video_path:
+                    event["error"] = "không tạo được video chương"
+        return video_path
+
+    def _worker_settings(self):
+        """Cấu hình truyền cho các process render chương"""
+        x264_threads = self.x264_threads
+        if not x264_threads:
+            # Chia đều số core cho các worker để không bị oversubscribe
+            x264_threads = max(1, (os.cpu_count() or 1) // self.render_workers)
+        return {
+            "width": self.width,
+            "height": self.height,
+            "fps": self.fps,
+            "render_engine": self.render_engine,
+            "x264_threads": x264_threads,
+            # Process con (spawn) không mang theo trạng thái governor của process chính
+            "session_id": governor.session_id,
+            "governor_enabled": governor.enabled
+        }
+
+    def create_render_executor(self):
+        """Tạo pool render chương: pool process nếu render_workers > 1, ngược lại một thread"""
+        if self.render_workers > 1:
+            return ProcessPoolExecutor(max_workers=self.render_workers)
+        return TracedThreadPoolExecutor(max_workers=1)
+
+    def _chapter_video_hash(self, chapter, story_images, story_audio):
+        """Hash nội dung đầu vào của video một chương: cấu hình render, ảnh và audio của chương"""
+        chapter_num = chapter["chapter_num"]
+        inputs = []
+        for image_data in story_images:
+            if image_data["chapter_num"] != chapter_num:
+                continue
+            for img in image_data["images"]:
+                for key in ("normalized_path", "image_path"):
+                    if img.get(key) and os.path.exists(img[key]):
+                        inputs.append(file_digest(img[key]))
+        for audio_data in story_audio:
+            if audio_data["chapter_num"] != chapter_num:
+                continue
+            audio_paths = [segment.get("audio_path") for segment in audio_data.get("segments", [])]
+            audio_paths.append(audio_data.get("full_audio"))
+            inputs.extend(file_digest(path) for path in audio_paths if path and os.path.exists(path))
+        return self.checkpoint.input_hash(self.width, self.height, self.fps, self.render_engine, inputs)
+
+    def submit_chapter_render(self, executor, chapter, story_images, story_audio, videos_dir):
+        """Gửi việc render một chương vào pool tạo bởi create_render_executor, trả về Future
+
+        Chương có video trong checkpoint (cùng ảnh, audio và cấu hình) không phải render lại.
+        """
+        artifact_id = f"video:chapter_{chapter['chapter_num']}"
+        input_hash = None
+        if self.checkpoint:
+            input_hash = self._chapter_video_hash(chapter, story_images, story_audio)
+            video_path = self.checkpoint.get(artifact_id, input_hash)
+            if video_path:
+                print(f"Dùng lại video chương {chapter['chapter_num']} từ checkpoint")
+                future = Future()
+                future.set_result(video_path)
+                return future
+
+        if isinstance(executor, ProcessPoolExecutor):
+            future = _unpack_worker_result(executor.submit(
+                _render_chapter_worker, self._worker_settings(), chapter, story_images, story_audio, videos_dir,
+                tracer.current_context()
+            ))
+        else:
+            future = executor.submit(self.render_chapter, chapter, story_images, story_audio, videos_dir)
+
+        if self.checkpoint:
+            def record(done):
+                if not done.exception() and done.result():
+                    self.checkpoint.put(artifact_id, input_hash, done.result(), [done.result()])
+            future.add_done_callback(record)
+        return future
+
+    def _render_chapters_parallel(self, chapters, story_images, story_audio, videos_dir):
+        """Render các chương song song trên một pool process
+
+        Returns:
+            dict: chapter_num -> đường dẫn video (None nếu chương đó lỗi)
+        """
+        settings = self._worker_settings()
+        print(f"Render song song với {self.render_workers} process, {settings['x264_threads']} thread x264 mỗi process")
+
+        video_paths = {}
+        with ProcessPoolExecutor(max_workers=self.render_workers) as executor:
+            futures = {}
+            for chapter in chapters:
+                chapter_num = chapter["chapter_num"]
+                # Chỉ gửi dữ liệu của chương cần render sang worker
+                chapter_images = [data for data in story_images if data["chapter_num"] == chapter_num]
+                chapter_audio = [data for data in story_audio if data["chapter_num"] == chapter_num]
+                future = self.submit_chapter_render(executor, chapter, chapter_images, chapter_audio, videos_dir)
+                futures[future] = chapter_num
+
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                chapter_num = futures[future]
+                try:
+                    video_paths[chapter_num] = future.result()
+                except Exception as e:
+                    print(f"Lỗi khi render chương {chapter_num} trong process riêng: {e}")
+                    video_paths[chapter_num] = None
+
+        return video_paths
+
+    @traced("video")
     def create_full_video(self, story_data, story_images, story_audio, output_dir="output"):
         """Tạo video đầy đủ cho toàn bộ câu chuyện"""
         videos_dir = os.path.join(output_dir, "videos")
         os.makedirs(videos_dir, exist_ok=True)
         
         # Tạo video cho từng chương
-        chapter_videos = []
-        
         print(f"Đang tạo video cho {len(story_data['chapters'])} chương...")
-        for chapter in tqdm(story_data["chapters"]):
-            video_path = self.create_chapter_video(chapter, story_images, story_audio, videos_dir)
+        if self.render_workers > 1 and len(story_data["chapters"]) > 1:
+            video_paths = self._render_chapters_parallel(story_data["chapters"], story_images, story_audio, videos_dir)
+        else:
+            video_paths = {}
+            with self.create_render_executor() as executor:
+                for chapter in tqdm(story_data["chapters"]):
+                    video_paths[chapter["chapter_num"]] = self.submit_chapter_render(
+                        executor, chapter, story_images, story_audio, videos_dir
+                    ).result()
+        
+        return self.concat_chapter_videos(story_data["chapters"], video_paths, output_dir)
+    
+    def concat_chapter_videos(self, chapters, video_paths, output_dir="output"):
+        """Ghép video các chương thành full_story.mp4 và lưu video_data.json
+        
+        Args:
+            chapters: danh sách chương theo thứ tự
+            video_paths: dict chapter_num -> đường dẫn video chương (None nếu chương lỗi)
+        """
+        chapter_videos = []
+        for chapter in chapters:
+            video_path = video_paths.get(chapter["chapter_num"])
             if video_path:
                 chapter_videos.append({
                     "chapter_num": chapter["chapter_num"],
@@ -345,26 +676,25 @@ class VideoGenerator:
             try:
                 full_video_path = os.path.join(output_dir, "full_story.mp4")
                 
-                # Tạo clip cho từng chương
-                clips = []
-                for chapter_video in chapter_videos:
-                    video_path = chapter_video["video_path"]
-                    if os.path.exists(video_path):
-                        clip = VideoFileClip(video_path)
-                        clips.append(clip)
-                
-                # Nối các clip lại với nhau
-                final_clip = concatenate_videoclips(clips)
-                
-                # Xuất video
-                final_clip.write_videofile(
-                    full_video_path,
-                    fps=self.fps,
-                    codec="libx264",
-                    audio_codec="aac",
-                    temp_audiofile="temp-audio.m4a",
-                    remove_temp=True
-                )
+                video_paths = [
+                    chapter_video["video_path"] for chapter_video in chapter_videos
+                    if os.path.exists(chapter_video["video_path"])
+                ]
+                
+                # Ghép bằng stream copy nếu có ffmpeg/ffprobe, ngược lại dùng MoviePy
+                with run_metrics.measure("video.concat", bytes_in=sum(file_size(path) for path in video_paths)) as event:
+                    concatenated = False
+                    if self._use_ffmpeg() and ffprobe_available():
+                        try:
+                            self._concat_videos_ffmpeg(video_paths, full_video_path)
+                            concatenated = True
+                        except Exception as e:
+                            print(f"Lỗi khi ghép video bằng ffmpeg, chuyển sang MoviePy: {e}")
+                    
+                    if not concatenated:
+                        event["engine"] = "moviepy"
+                        self._concat_videos_moviepy(video_paths, full_video_path)
+                    event["bytes_out"] = file_size(full_video_path)
                 
                 print(f"Đã tạo video đầy đủ: {full_video_path}")
                 
@@ -390,4 +720,54 @@ class VideoGenerator:
         return {
             "full_video": None,
             "chapter_videos": chapter_videos
-        } 
\ No newline at end of file
+        } 
+
+
+def _stream_param_matches(key, value, expected):
+    """So sánh một tham số stream với giá trị chuẩn; fps chấp nhận sai số làm tròn (29.97 và 30000/1001)"""
+    if key == "fps" and value is not None:
+        return abs(float(value) - float(expected)) < 1e-4
+    return value == expected
+
+
+def _render_chapter_worker(settings, chapter_data, story_images, story_audio, output_dir, trace_context=None):
+    """Hàm chạy trong process con: render một chương với thư mục tạm riêng
+
+    trace_context: tracer.current_context() của process chính, span render là con của span đó
+
+    Returns:
+        (đường dẫn video hoặc None, các sự kiện run_metrics và các span ghi trong process con)
+    """
+    # Process con tạo bằng fork mang theo các sự kiện/span của process chính, bỏ đi để không bị gộp trùng
+    run_metrics.drain()
+    tracer.drain()
+    settings = dict(settings)
+    # Slot encode được tính cho phiên của process chính, không phải pid-<pid> của process con
+    governor.set_session(settings.pop("session_id"))
+    governor.set_enabled(settings.pop("governor_enabled"))
+    temp_dir = tempfile.mkdtemp(prefix=f"chapter_{chapter_data['chapter_num']}_")
+    try:
+        generator = VideoGenerator(temp_dir=temp_dir, **settings)
+        with tracer.remote_parent(trace_context or tracer.current_context()):
+            video_path = generator.render_chapter(chapter_data, story_images, story_audio, output_dir)
+        return video_path, run_metrics.drain(), tracer.drain()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _unpack_worker_result(worker_future):
+    """Future trả về đường dẫn video từ Future của _render_chapter_worker, gộp sự kiện đo và span vào process chính"""
+    future = Future()
+
+    def unpack(done):
+        try:
+            video_path, events, spans = done.result()
+        except Exception as e:
+            future.set_exception(e)
+            return
+        run_metrics.merge(events)
+        tracer.merge(spans)
+        future.set_result(video_path)
+
+    worker_future.add_done_callback(unpack)
+    return future